@@ -1,5 +1,7 @@
 import os.path
 import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import make_dataclass
 from typing import Any, List, Dict, Optional, OrderedDict, Union, Callable
 from omegaconf.omegaconf import OmegaConf, DictConfig, ListConfig
@@ -10,6 +12,8 @@ from scabha.exceptions import ScabhaBaseException
 from .deps import ConfigDependencies
 from .resolvers import resolve_config_refs
 from .cache import load_cache, save_cache
+from .yaml_loader import load_yaml
+from . import include_index
 from .common import *
 
 
@@ -40,11 +44,29 @@ def load(path: str, use_sources: Optional[List[DictConfig]] = [], name: Optional
             conf (DictConfig): config object
             dependencies (ConfigDependencies): filenames that were _included
     """
+    with include_index.session():
+        conf, dependencies = _load_plain(path, use_sources=use_sources, name=name, location=location,
+                                         includes=includes, selfrefs=selfrefs, include_path=include_path,
+                                         use_cache=use_cache, no_toplevel_cache=no_toplevel_cache,
+                                         include_stack=include_stack, verbose=verbose)
+    return OmegaConf.create(conf), dependencies
+
+
+def _load_plain(path: str, use_sources: Optional[List[DictConfig]] = [], name: Optional[str]=None,
+        location: Optional[str]=None,
+        includes: bool=True, selfrefs: bool=True, include_path: str=None,
+        use_cache: bool = True,
+        no_toplevel_cache = False,
+        include_stack = [],
+        verbose: bool = False):
+    """Internal version of load(), returning the config as plain containers. This is also used to load 
+    _include-d files, so that the whole tree of includes is resolved without building any OmegaConf 
+    containers. Cache entries for single files contain plain containers as well."""
     use_toplevel_cache = use_cache and not no_toplevel_cache
     conf, dependencies = load_cache((path,), verbose=verbose) if use_toplevel_cache else (None, None)
 
     if conf is None:
-        subconf = OmegaConf.load(path)
+        subconf = load_yaml(path)
         name = name or os.path.basename(path)
         dependencies = ConfigDependencies()
         dependencies.add(path)
@@ -65,6 +87,40 @@ def load(path: str, use_sources: Optional[List[DictConfig]] = [], name: Optional
 
     return conf, dependencies
 
+# load_nested() loads files in a process pool when given at least this many of them
+PARALLEL_LOAD_THRESHOLD = 32
+
+# max number of worker processes used by load_nested() (None for number of CPUs)
+PARALLEL_LOAD_WORKERS = None
+
+# _use sources of the current load_nested() call, inherited by the worker processes
+_worker_use_sources = None
+
+def _init_load_worker(use_sources):
+    global _worker_use_sources
+    _worker_use_sources = use_sources
+
+def _load_worker(path: str, location: Optional[str], include_path: Optional[str]):
+    return load(path, location=location, use_sources=_worker_use_sources, include_path=include_path)
+
+
+def _load_files(filelist: List[str], use_sources, location, include_path, parallel):
+    """Loads a list of config files, returning a list of (conf, deps) tuples in the same order. Files are
+    independent of each other, so with enough of them, they are loaded in parallel by a pool of (forked)
+    worker processes. The _use sources are passed to the workers once, when they start up, rather than
+    pickled with each file."""
+    if not parallel or len(filelist) < PARALLEL_LOAD_THRESHOLD or "fork" not in multiprocessing.get_all_start_methods():
+        return [load(path, location=location, use_sources=use_sources, include_path=include_path)
+                for path in filelist]
+    num_workers = min(PARALLEL_LOAD_WORKERS or os.cpu_count() or 1, len(filelist))
+    with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("fork"),
+                             initializer=_init_load_worker, initargs=(use_sources,)) as pool:
+        # map() returns results in order of submission, so the merge below is deterministic
+        chunksize = max(1, len(filelist) // (num_workers * 4))
+        return list(pool.map(_load_worker, filelist, [location] * len(filelist), [include_path] * len(filelist),
+                             chunksize=chunksize))
+
+
 def load_nested(filelist: List[str],
                 structured: Optional[DictConfig] = None,
                 typeinfo = None,
@@ -74,6 +130,7 @@ def load_nested(filelist: List[str],
                 config_class: Optional[str] = None,
                 include_path: Optional[str] = None,
                 use_cache: bool = True,
+                parallel: bool = True,
                 verbose: bool = False):
     """Builds nested configuration from a set of YAML files corresponding to sub-sections
 
@@ -98,6 +155,8 @@ def load_nested(filelist: List[str],
         name of config dataclass to form (when using typeinfo), if None, then generated automatically
     include_path : Optional[str]
         if set, path to each config file will be included in the section as element 'include_path'
+    parallel : bool
+        if True (default), large sets of files (see PARALLEL_LOAD_THRESHOLD) are loaded in parallel
 
     Returns
     -------
@@ -116,9 +175,10 @@ def load_nested(filelist: List[str],
         section_content = {} # OmegaConf.create()
         dependencies = ConfigDependencies()
 
-        for path in filelist:
-            # load file
-            subconf, deps = load(path, location=location, use_sources=use_sources, include_path=include_path)
+        with include_index.session():
+            loaded = _load_files(filelist, use_sources, location, include_path, parallel)
+
+        for path, (subconf, deps) in zip(filelist, loaded):
             dependencies.update(deps)
             if include_path:
                 subconf[include_path] = path
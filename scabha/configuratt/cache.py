@@ -1,12 +1,20 @@
+import os
 import os.path
+import re
 import sys
 import glob
+import time
 import hashlib
 import pathlib
+import tempfile
+import fcntl
+import struct
+import marshal
 import dill as pickle
 
 import uuid
-from dataclasses import make_dataclass
+from collections import Counter
+from dataclasses import dataclass, make_dataclass
 
 from omegaconf.omegaconf import OmegaConf, DictConfig, ListConfig
 from omegaconf.errors import OmegaConfBaseException
@@ -15,7 +23,7 @@ from typing import Any, List, Dict, Optional, OrderedDict, Union, Callable
 from scabha.exceptions import ScabhaBaseException
 
 from yaml.error import YAMLError
-from .deps import ConfigDependencies
+from .deps import ConfigDependencies, file_digest
 from .resolvers import resolve_config_refs
 from .common import *
 
@@ -23,18 +31,75 @@ from .common import *
 CACHEDIR = os.environ.get("CONFIGURATT_CACHE_DIR") or os.path.expanduser(
     "~/.cache/configuratt")
 
+# optional cache directory shared between users (e.g. on a cluster filesystem). Entries are looked up here after
+# the private cache, but new entries only go here when explicitly asked for (see PUBLISH_TO_SHARED_CACHE). Since
+# its entries are written by someone else, only entries made of plain containers (i.e. marshalled, never pickled)
+# are accepted from it, and only if they're owned by a trusted user, and not writable by anyone else.
+SHARED_CACHEDIR = os.environ.get("CONFIGURATT_SHARED_CACHE_DIR") or None
+
+# if set, shareable entries are saved to (and only looked up in) the shared cache rather than the private one.
+# This is meant for explicitly warming the shared cache, e.g. by an administrator.
+PUBLISH_TO_SHARED_CACHE = False
+
+# bump this when the layout of cache entries changes
+CACHE_FORMAT_VERSION = 4
+
+# An entry starts with a header, followed by the dependencies, in the columnar form of 
+# ConfigDependencies.to_table(), and then the config itself. Dependencies are always marshalled. The config 
+# is marshalled if it's made of plain containers (as single-file entries are), and pickled with dill otherwise
+# (e.g. structured configs). Dependencies are decoded first, so that the (larger) config is only decoded once
+# the entry has been found to be up to date.
+_ENTRY_MAGIC = b"configuratt\n"
+_ENTRY_HEADER = struct.Struct("<12sBBBI")      # magic, format version, marshal version, codec, size of deps
+_CODEC_MARSHAL, _CODEC_DILL = 1, 2
+
+# The private cache is kept under this size (in bytes), by evicting the least recently used entries whenever
+# a new entry is written. Entries are stamped with their access time when loaded (their mtime is left alone,
+# since it's what dependencies are checked against). None or 0 for no limit. The shared cache is never pruned
+# automatically, since it's not ours to manage.
+CACHE_MAX_SIZE = int(os.environ.get("CONFIGURATT_CACHE_MAX_SIZE") or 512*2**20)
+
+# If set, cache entries are trusted to be up to date, and their dependencies are not checked. This saves a lot of
+# filesystem traffic when the configs are known not to change, e.g. for production runs on a cluster.
+TRUST_CACHE = bool(os.environ.get("CONFIGURATT_TRUST_CACHE"))
+
+# counts of cache hits, misses (no usable entry found), stale entries skipped over (dependencies changed),
+# writes and evictions
+CACHE_STATS = Counter()
+
+# cache entries are named by their key
+_ENTRY_NAME = re.compile("^[0-9a-f]{64}$")
+
+# temporary files older than this (in seconds) were left by writers that died, and can be removed
+_STALE_TMPFILE_AGE = 3600
+
 
 def _compute_hash(filelist, extra_keys):
-    filelist = list(filelist) + list(extra_keys)
-    return hashlib.md5(" ".join(filelist).encode()).hexdigest()
+    """Computes cache key from the paths and contents of the given files, the extra keys, and the package version"""
+    hasher = hashlib.sha256(f"{CACHE_FORMAT_VERSION} {PACKAGE_VERSION}".encode())
+    for filename in filelist:
+        hasher.update(f" {os.path.abspath(filename)}:{file_digest(filename)}".encode())
+    for key in extra_keys:
+        hasher.update(f" {key}".encode())
+    return hasher.hexdigest()
 
 
-def set_cache_dir(cachedir: str):
-    global CACHEDIR
+def set_cache_dir(cachedir: str, shared_cachedir: Optional[str] = None, max_size: Optional[int] = None):
+    global CACHEDIR, SHARED_CACHEDIR, CACHE_MAX_SIZE
     CACHEDIR = cachedir
+    if shared_cachedir is not None:
+        SHARED_CACHEDIR = shared_cachedir
+    if max_size is not None:
+        CACHE_MAX_SIZE = max_size
+
+
+def _cache_dirs():
+    """Returns list of cache directories to be searched, in order"""
+    return [CACHEDIR] + ([SHARED_CACHEDIR] if SHARED_CACHEDIR and SHARED_CACHEDIR != CACHEDIR else [])
 
 
 def clear_cache(log=None):
+    """Clears the private cache. The shared cache (if any) is left alone, since other users may be relying on it."""
     if os.path.isdir(CACHEDIR):
         files = glob.glob(f"{CACHEDIR}/*")
         log and log.info(f"clearing {len(files)} cached config(s) from cache")
@@ -48,51 +113,270 @@ def clear_cache(log=None):
             log and log.error(f"failed to remove cached config {filename}: {exc}")
             sys.exit(1)
 
-def load_cache(filelist: List[str], extra_keys=[], verbose=None):
-    filehash = _compute_hash(filelist, extra_keys)
-    if not os.path.isdir(CACHEDIR):
-        if verbose:
-            print(f"{CACHEDIR} does not exist")
-        return None, None
-    filename = os.path.join(CACHEDIR, filehash)
-    if not os.path.exists(filename):
+@dataclass
+class CacheEntry(object):
+    path: str
+    size: int
+    atime: float            # time of last use
+    mtime: float            # time of creation
+
+
+def _encode_entry(conf, deps: ConfigDependencies) -> bytes:
+    try:
+        payload, codec = marshal.dumps(conf), _CODEC_MARSHAL
+    except ValueError:
+        payload, codec = pickle.dumps(conf, 2), _CODEC_DILL
+    deps_data = marshal.dumps(deps.to_table())
+    return _ENTRY_HEADER.pack(_ENTRY_MAGIC, CACHE_FORMAT_VERSION, marshal.version, codec, 
+                              len(deps_data)) + deps_data + payload
+
+
+def _decode_entry(data: bytes, allow_pickle: bool = True):
+    """Decodes the dependencies of an entry. Returns tuple of (deps, callable decoding the config)"""
+    magic, version, marshal_version, codec, deps_size = _ENTRY_HEADER.unpack_from(data)
+    if magic != _ENTRY_MAGIC or version != CACHE_FORMAT_VERSION or marshal_version != marshal.version:
+        raise ValueError("unknown cache entry format")
+    if codec != _CODEC_MARSHAL and not allow_pickle:
+        raise ValueError("pickled entries are not accepted from here")
+    offset = _ENTRY_HEADER.size
+    deps = ConfigDependencies.from_table(marshal.loads(data[offset:offset + deps_size]))
+    payload = memoryview(data)[offset + deps_size:]
+    if codec == _CODEC_MARSHAL:
+        return deps, lambda: marshal.loads(payload)
+    return deps, lambda: pickle.loads(payload)
+
+
+def _check_shared_entry(st: os.stat_result):
+    """Checks that an entry of the shared cache may be trusted: it must be owned by us, root, or the owner 
+    of the shared cache directory, and must not be writable by group or others. Raises ValueError if not."""
+    trusted_uids = {os.getuid(), 0, os.stat(SHARED_CACHEDIR).st_uid}
+    if st.st_uid not in trusted_uids:
+        raise ValueError(f"entry is owned by untrusted uid {st.st_uid}")
+    if st.st_mode & 0o022:
+        raise ValueError("entry is writable by group or others")
+
+
+def _read_entry(filename: str, shared: bool = False):
+    """Reads and decodes the dependencies of an entry. Entries of the shared cache are checked for trust 
+    first, and must not be pickled."""
+    with open(filename, 'rb') as f:
+        if shared:
+            _check_shared_entry(os.fstat(f.fileno()))
+        return _decode_entry(f.read(), allow_pickle=not shared)
+
+
+def list_entries(cachedir: Optional[str] = None) -> List[CacheEntry]:
+    """Lists entries in a cache directory (the private cache by default), least recently used first"""
+    entries = []
+    try:
+        dirents = list(os.scandir(cachedir or CACHEDIR))
+    except FileNotFoundError:
+        return entries
+    for dirent in dirents:
+        if _ENTRY_NAME.match(dirent.name):
+            try:
+                st = dirent.stat()
+            except FileNotFoundError:
+                continue
+            entries.append(CacheEntry(dirent.path, st.st_size, max(st.st_atime, st.st_mtime), st.st_mtime))
+    return sorted(entries, key=lambda entry: entry.atime)
+
+
+def _remove_entry(path: str):
+    os.unlink(path)
+    try:
+        os.unlink(f"{path}.lock")
+    except FileNotFoundError:
+        pass
+
+
+def prune_cache(max_size: Optional[int] = None, cachedir: Optional[str] = None, log=None):
+    """Evicts least recently used entries from a cache directory (the private cache by default) until its 
+    total size is under max_size (CACHE_MAX_SIZE by default). Leftovers of interrupted writes are removed as well.
+
+    Returns:
+        Tuple of (number of entries removed, number of bytes freed)
+    """
+    cachedir = cachedir or CACHEDIR
+    max_size = CACHE_MAX_SIZE if max_size is None else max_size
+    entries = list_entries(cachedir)
+    total = sum(entry.size for entry in entries)
+    nremoved = nfreed = 0
+    for entry in entries:
+        if total <= max_size:
+            break
+        try:
+            _remove_entry(entry.path)
+        except OSError as exc:
+            log and log.warning(f"failed to remove cached config {entry.path}: {exc}")
+            continue
+        total -= entry.size
+        nremoved += 1
+        nfreed += entry.size
+        CACHE_STATS["evictions"] += 1
+    # clean up temporary files of dead writers, and lock files of entries that are gone
+    for filename in glob.glob(f"{cachedir}/.*.tmp"):
+        try:
+            if os.path.getmtime(filename) < time.time() - _STALE_TMPFILE_AGE:
+                os.unlink(filename)
+        except OSError:
+            pass
+    for filename in glob.glob(f"{cachedir}/*.lock"):
+        if not os.path.exists(filename[:-5]):
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+    if nremoved:
+        log and log.info(f"evicted {nremoved} cached config(s), freeing {nfreed} bytes")
+    return nremoved, nfreed
+
+
+def verify_cache(cachedir: Optional[str] = None, remove: bool = False, log=None):
+    """Checks that entries in a cache directory (the private cache by default) can be loaded, and are up to date 
+    with respect to their dependencies. If remove is True, entries that fail the check are removed.
+
+    Returns:
+        Tuple of (number of valid entries, list of (path, reason) for invalid entries)
+    """
+    nvalid = 0
+    invalid = []
+    for entry in list_entries(cachedir):
+        try:
+            deps, load_conf = _read_entry(entry.path)
+            load_conf()
+        except Exception as exc:
+            invalid.append((entry.path, f"unreadable: {exc}"))
+        else:
+            if deps.have_deps_changed(entry.mtime):
+                invalid.append((entry.path, "dependencies have changed"))
+            else:
+                nvalid += 1
+                continue
+        if remove:
+            try:
+                _remove_entry(entry.path)
+            except OSError as exc:
+                log and log.warning(f"failed to remove cached config {entry.path}: {exc}")
+    return nvalid, invalid
+
+
+def _mark_used(filename: str):
+    """Updates access time of cache entry, leaving its mtime alone. This may fail for shared entries 
+    belonging to other users, which is fine."""
+    try:
+        os.utime(filename, ns=(time.time_ns(), os.stat(filename).st_mtime_ns))
+    except OSError:
+        pass
+
+
+def load_cache(filelist: List[str], extra_keys=[], verbose=None, shared: bool = True):
+    """Looks up cache entry for the given files. If shared is False, the shared cache is not consulted 
+    (for entries that are never shared, see save_cache()). Returns tuple of (conf, deps), or (None, None)"""
+    try:
+        filehash = _compute_hash(filelist, extra_keys)
+    except OSError as exc:
         if verbose:
-            print(f"hash file {filename} does not exist")
+            print(f"can't compute cache key: {exc}")
+        CACHE_STATS["misses"] += 1
         return None, None
-    # check that all configs are older than the cache
-    cache_mtime = os.path.getmtime(filename)
-    for f in filelist:
-        if os.path.getmtime(f) > cache_mtime:
+    if not shared:
+        cachedirs = [CACHEDIR]
+    elif PUBLISH_TO_SHARED_CACHE and SHARED_CACHEDIR:
+        cachedirs = [SHARED_CACHEDIR]
+    else:
+        cachedirs = _cache_dirs()
+    for cachedir in cachedirs:
+        filename = os.path.join(cachedir, filehash)
+        if not os.path.exists(filename):
             if verbose:
-                print(f"Config {f} is newer than the cache, forcing reload")
-            return None, None
-    # load cache
+                print(f"hash file {filename} does not exist")
+            continue
+        # load cache. Entries are written atomically, so we never see a partial one, and since they may
+        # belong to someone else, an unreadable one is left alone (the next save will replace it)
+        try:
+            cache_mtime = os.path.getmtime(filename)
+            deps, load_conf = _read_entry(filename, shared=cachedir != CACHEDIR)
+        except Exception as exc:
+            print(f"Error loading cached config from {filename}: {exc}, ignoring the cache.")
+            continue
+        # the configs themselves are part of the key, but check that nothing they include has changed
+        if not TRUST_CACHE and deps.have_deps_changed(cache_mtime, verbose=verbose):
+            CACHE_STATS["stale"] += 1
+            continue
+        try:
+            conf = load_conf()
+        except Exception as exc:
+            print(f"Error loading cached config from {filename}: {exc}, ignoring the cache.")
+            continue
+        if verbose:
+            print(f"Loaded cached config for {' '.join(filelist)} from {filename}")
+        _mark_used(filename)
+        CACHE_STATS["hits"] += 1
+        return conf, deps
+    CACHE_STATS["misses"] += 1
+    return None, None
+
+
+def _write_cache_entry(cachedir: str, filehash: str, data: bytes):
+    """Writes cache entry to directory. Entries are written to a temporary file and renamed, so that readers
+    never see a partial entry. Writers take an advisory lock, so only one of a set of concurrent writers (e.g.
+    the jobs of a job array starting up at the same time) does the writing. Returns path to entry, or None if
+    it was left to another writer."""
+    pathlib.Path(cachedir).mkdir(parents=True, exist_ok=True)
+    filename = os.path.join(cachedir, filehash)
+    # the lock file may have been created by another user, so don't insist on opening it for writing
+    lockfd = os.open(f"{filename}.lock", os.O_RDONLY | os.O_CREAT, 0o644)
     try:
-        conf, deps = pickle.load(open(filename, 'rb'))
-        if not isinstance(deps, ConfigDependencies):
-            raise TypeError(f"cached deps object is of type {type(deps)}, expecting ConfigDependencies")
-    except Exception as exc:
-        print(f"Error loading cached config from {filename}: {exc}. Removing the cache.")
-        os.unlink(filename)
-        return None, None
-    # check that all dependencies are older than the cache
-    if deps.have_deps_changed(cache_mtime, verbose=verbose):
-        return None, None
-    if verbose:
-        print(f"Loaded cached config for {' '.join(filelist)} from {filename}")
-    return conf, deps
-
-
-def save_cache(filelist: List[str], conf, deps: ConfigDependencies, extra_keys=[], verbose=False):
-    pathlib.Path(CACHEDIR).mkdir(parents=True, exist_ok=True)
+        try:
+            fcntl.flock(lockfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=cachedir, prefix=f".{filehash}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                # make entry readable by all, so that the cache may be shared
+                os.chmod(tmpname, 0o644)
+                os.replace(tmpname, filename)
+            except BaseException:
+                os.unlink(tmpname)
+                raise
+        finally:
+            fcntl.flock(lockfd, fcntl.LOCK_UN)
+    finally:
+        os.close(lockfd)
+    return filename
+
+
+def save_cache(filelist: List[str], conf, deps: ConfigDependencies, extra_keys=[], verbose=False, shared: bool = True):
+    """Saves cache entry for the given files. Entries go to the private cache, unless PUBLISH_TO_SHARED_CACHE is 
+    set, shared is True, and the entry is made of plain containers, in which case they go to the shared cache."""
     filelist = list(filelist)   # add self to dependencies
     filehash = _compute_hash(filelist, extra_keys)
-    filename = os.path.join(CACHEDIR, filehash)
     # add ourselves to dependencies, so that cache is cleared if implementation changes
     deps.add(__file__, version=PACKAGE_VERSION)
-    pickle.dump((conf, deps), open(filename, "wb"), 2)
+    data = _encode_entry(conf, deps)
+    cachedir = CACHEDIR
+    if shared and PUBLISH_TO_SHARED_CACHE and SHARED_CACHEDIR and \
+            _ENTRY_HEADER.unpack_from(data)[3] == _CODEC_MARSHAL:
+        cachedir = SHARED_CACHEDIR
+    try:
+        filename = _write_cache_entry(cachedir, filehash, data)
+    except OSError as exc:
+        if verbose:
+            print(f"Can't write to cache directory {cachedir}: {exc}")
+        return
     if verbose:
-        print(f"Caching config for {' '.join(filelist)} as {filename}")
+        if filename is None:
+            print(f"Config for {' '.join(filelist)} is being cached by another process")
+        else:
+            print(f"Caching config for {' '.join(filelist)} as {filename}")
+    if filename is not None:
+        CACHE_STATS["writes"] += 1
+        if cachedir == CACHEDIR and CACHE_MAX_SIZE:
+            prune_cache(cachedir=cachedir)
 
 
 def load(path: str, use_sources: Optional[List[DictConfig]] = [], name: Optional[str]=None,
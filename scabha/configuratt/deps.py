@@ -1,16 +1,41 @@
 import os.path
+import stat
 import importlib
+import dataclasses
 import hashlib
 import datetime
 import fnmatch
 import subprocess
 from shutil import which
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 
 from omegaconf.omegaconf import OmegaConf, DictConfig, ListConfig
 from typing import Any, List, Dict, Optional, OrderedDict, Union, Callable
 
 from .common import *
+from .gitinfo import find_repo_root, read_git_info, UnsupportedGitLayout
+
+# content digests of files, keyed by (path, size, mtime), so that each file is only read once per session
+_digest_cache = {}
+
+# Dependencies are grouped by directory, and checked one directory at a time, with a stat per file (the mtime
+# of a directory doesn't change when files in it are modified in place, so it can't stand in for them). When they're
+# spread over at least this many directories, directories are checked in a thread pool with this many workers, 
+# since on network filesystems most of the time is spent waiting
+PARALLEL_CHECK_THRESHOLD = 4
+PARALLEL_CHECK_WORKERS = 8
+
+def file_digest(filename: str, st: Optional[os.stat_result] = None) -> str:
+    """Returns MD5 digest of the contents of a file. If the file has already been stat-ed, pass in the result"""
+    st = st or os.stat(filename)
+    key = os.path.abspath(filename), st.st_size, st.st_mtime_ns
+    digest = _digest_cache.get(key)
+    if digest is None:
+        with open(filename, "rb") as f:
+            digest = _digest_cache[key] = hashlib.md5(f.read()).hexdigest()
+    return digest
+
 
 @dataclass
 class FailRecord(object):
@@ -29,12 +54,14 @@ class RequirementRecord(object):
 
 
 class ConfigDependencies(object):
+    # git info structures, keyed by repository root
     _git_cache = {}
 
     def __init__(self):
-        self.deps = OmegaConf.create()
-        self.fails = OmegaConf.create()
-        self._git = which("git")
+        # dependency records (dicts of attributes), keyed by filename
+        self.deps = {}
+        # failed optional includes, keyed by filename
+        self.fails = {}
         # self.provides = OmegaConf.create()
         # self.requires = OmegaConf.create()
     
@@ -49,32 +76,33 @@ class ConfigDependencies(object):
         filename = os.path.abspath(filename)
         if filename in self.deps:
             return
-        depinfo = OmegaConf.create()
-        depinfo.update(**extra_attrs)
+        depinfo = dict(extra_attrs)
         if origin is not None:
-            depinfo.origin = origin
+            depinfo['origin'] = origin
         else:
             if missing or not os.path.exists(filename):
-                depinfo.mtime     = 0 
-                depinfo.mtime_str = "n/a"
+                depinfo['mtime']     = 0 
+                depinfo['mtime_str'] = "n/a"
                 self.deps[filename] = depinfo
                 return
             # get mtime and hash
-            depinfo.mtime     = os.path.getmtime(filename) 
-            depinfo.mtime_str = datetime.datetime.fromtimestamp(depinfo.mtime).strftime('%c')
-            if not os.path.isdir(filename):
-                depinfo.md5hash   = hashlib.md5(open(filename, "rb").read()).hexdigest()
+            st = os.stat(filename)
+            depinfo['mtime']     = st.st_mtime
+            depinfo['mtime_str'] = datetime.datetime.fromtimestamp(depinfo['mtime']).strftime('%c')
+            if not stat.S_ISDIR(st.st_mode):
+                depinfo['size']      = st.st_size
+                depinfo['md5hash']   = file_digest(filename, st)
             # add git info
             dirname = os.path.realpath(filename)
             if not os.path.isdir(dirname):
                 dirname = os.path.dirname(dirname) 
             gitinfo = self._get_git_info(dirname)
             if gitinfo:
-                depinfo.git = gitinfo
+                depinfo['git'] = gitinfo
         self.deps[filename] = depinfo
 
     def add_fail(self, fail: FailRecord):
-        self.fails[fail.filename] = OmegaConf.structured(fail)
+        self.fails[fail.filename] = fail
 
     def replace(self, globs: List[str], dirname: str, **extra_attrs):
         remove = set()
@@ -82,7 +110,7 @@ class ConfigDependencies(object):
             remove.update(fnmatch.filter(self.deps, glob))
         if remove:
             for name in remove:
-                self.deps[name] = OmegaConf.create(dict(origin=dirname))
+                self.deps[name] = dict(origin=dirname)
         # add directory
         if dirname not in self.deps:
             self.add(dirname, **extra_attrs)
@@ -91,12 +119,32 @@ class ConfigDependencies(object):
         for name in other.deps:
             if name not in self.deps:
                 self.deps[name] = other.deps[name]
-        self.fails = OmegaConf.unsafe_merge(self.fails, other.fails)
+        self.fails.update(other.fails)
         # self.provides = OmegaConf.unsafe_merge(self.provides, other.provides)
         # self.requires = OmegaConf.unsafe_merge(self.requires, other.requires)
 
     def save(self, filename):
-        OmegaConf.save(self.deps, filename)
+        OmegaConf.save(OmegaConf.create(self.deps), filename)
+
+    def to_table(self) -> Dict[str, Any]:
+        """Returns the dependencies in a compact columnar form, made up of plain containers (for caching).
+        Attributes missing from a record are marked by Ellipsis in their column."""
+        records = list(self.deps.values())
+        names = sorted(set().union(*records)) if records else []
+        return dict(files=list(self.deps.keys()),
+                    columns={name: [record.get(name, ...) for record in records] for name in names},
+                    fails=[dataclasses.astuple(fail) for fail in self.fails.values()])
+
+    @classmethod
+    def from_table(cls, table: Dict[str, Any]) -> "ConfigDependencies":
+        """Creates dependencies from a table returned by to_table()"""
+        deps = cls()
+        columns = table['columns'].items()
+        for i, filename in enumerate(table['files']):
+            deps.deps[filename] = {name: column[i] for name, column in columns if column[i] is not ...}
+        for fail in table['fails']:
+            deps.fails[fail[0]] = FailRecord(*fail)
+        return deps
 
     def _get_git_info(self, dirname: str):
         """Returns git info structure for a directory, or None if not under git control
@@ -105,41 +153,51 @@ class ConfigDependencies(object):
             dirname (str): path
 
         Returns:
-            DictConfig: directory info
+            Dict: directory info
         """
+        root = find_repo_root(dirname)
+        if root is None:
+            return None
         # check cache first
-        if dirname in self._git_cache:
-            return self._git_cache[dirname]
-        if not self._git:
+        if root in self._git_cache:
+            return self._git_cache[root]
+        try:
+            gitinfo = read_git_info(root)
+        except (UnsupportedGitLayout, OSError, ValueError):
+            gitinfo = self._run_git_info(root)
+        self._git_cache[root] = gitinfo
+        return gitinfo
+
+    def _run_git_info(self, dirname: str):
+        """Gets git info structure for a directory by running git. Used for repository layouts 
+        that read_git_info() doesn't handle."""
+        if not which("git"):
             return None
         try:
             branches = subprocess.check_output("git -c color.ui=never branch -a -v -v".split(), 
                                                 cwd=dirname, 
                                                 stderr=subprocess.DEVNULL)
         except subprocess.CalledProcessError as exc:
-            self._git_cache[dirname] = None
             return None
         # use git to get the info
-        gitinfo = OmegaConf.create()
+        gitinfo = {}
         for line in branches.decode().split("\n"):
             line = line.strip()
             if line.startswith("*"):
-                gitinfo.branch = line[1:].strip()
+                gitinfo['branch'] = line[1:].strip()
                 break
         # get description
         try:
             describe = subprocess.check_output("git describe --abbrev=16 --always --long --all".split(), cwd=dirname)
-            gitinfo.describe = describe.decode().strip()
+            gitinfo['describe'] = describe.decode().strip()
         except subprocess.CalledProcessError as exc:
             pass
         # get remote info
         try:
             remotes = subprocess.check_output("git remote -v".split(), cwd=dirname)
-            gitinfo.remotes = remotes.decode().strip().split('\n')
+            gitinfo['remotes'] = remotes.decode().strip().split('\n')
         except subprocess.CalledProcessError as exc:
             pass
-
-        self._git_cache[dirname] = gitinfo
         return gitinfo
 
     def get_description(self):
@@ -152,17 +210,52 @@ class ConfigDependencies(object):
             desc[filename] = attrs_str
         return desc
 
+    def _check_directory(self, dirname: str, filenames: List[str], mtime: float) -> Optional[str]:
+        """Checks dependencies within one directory. Returns description of the first change found, or None"""
+        for f in filenames:
+            try:
+                st = os.stat(f)
+            except OSError:
+                return f"Dependency {f} doesn't exist, forcing reload"
+            depinfo = self.deps[f]
+            if depinfo and "md5hash" in depinfo and stat.S_ISREG(st.st_mode):
+                # files with an unchanged size and mtime needn't be read
+                if (depinfo.get('size'), depinfo.get('mtime')) != (st.st_size, st.st_mtime) and \
+                        file_digest(f, st) != depinfo['md5hash']:
+                    return f"Dependency {f} has changed, forcing reload"
+            elif st.st_mtime > mtime:
+                return f"Dependency {f} is newer than the cache, forcing reload"
+        return None
+
     def have_deps_changed(self, mtime, verbose=False):
-        # check that all dependencies are older than the cache
-        for f in self.deps.keys():
-            if not os.path.exists(f):
-                if verbose:
-                    print(f"Dependency {f} doesn't exist, forcing reload")
-                return True
-            if os.path.getmtime(f) > mtime:
-                if verbose:
-                    print(f"Dependency {f} is newer than the cache, forcing reload")
-                return True
+        # check that all dependencies are unchanged since the cache was written. Files with a recorded hash
+        # are checked by content (so e.g. a fresh checkout of the same files doesn't invalidate the cache), 
+        # anything else must be older than the cache
+        dirs = {}
+        for f in self.deps:
+            dirs.setdefault(os.path.dirname(f), []).append(f)
+        change = None
+        if len(dirs) >= PARALLEL_CHECK_THRESHOLD and PARALLEL_CHECK_WORKERS > 1:
+            pool = ThreadPoolExecutor(PARALLEL_CHECK_WORKERS)
+            try:
+                # the first change found stops the check
+                futures = [pool.submit(self._check_directory, dirname, filenames, mtime) 
+                           for dirname, filenames in dirs.items()]
+                for future in as_completed(futures):
+                    change = future.result()
+                    if change:
+                        break
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            for dirname, filenames in dirs.items():
+                change = self._check_directory(dirname, filenames, mtime)
+                if change:
+                    break
+        if change:
+            if verbose:
+                print(change)
+            return True
         # check that previously failing includes are not now succeeding (because that's also reason to reload cache)
         for filename, dep in self.fails.items():
             if dep.modulename:
@@ -173,9 +266,9 @@ class ConfigDependencies(object):
                         return True
                 except ImportError as exc:
                     pass
-            elif not dep.missing_parent:
-                if os.path.exists(filename):
-                    return True
+            # relative includes are looked up relative to the including file, among other places
+            elif os.path.exists(os.path.join(os.path.dirname(dep.origin or ""), filename)):
+                return True
         return False
 
     # def add_provision_record(self, loc, filename):
@@ -0,0 +1,275 @@
+import os, os.path, re, zlib
+from typing import Dict, List, Optional, Tuple
+
+# Dependency records include git metadata (branch, description, remotes) for every file that lives in a git
+# repository. Running git for this costs a few subprocesses per directory, which adds up on slow filesystems.
+# So the metadata is read directly from the repository: HEAD, loose refs, packed-refs and config. It is cached
+# per repository root, so each repository is read once per session, and finding the root of a directory is a
+# matter of a few stat calls. Layouts that this reader doesn't understand (e.g. reftable ref storage, config
+# includes, or git environment variables that relocate the repository) raise UnsupportedGitLayout, in which case
+# the caller should fall back to asking git.
+
+class UnsupportedGitLayout(Exception):
+    pass
+
+
+# environment variables that change where git looks for the repository
+_GIT_ENV_VARS = ("GIT_DIR", "GIT_WORK_TREE", "GIT_COMMON_DIR", "GIT_CEILING_DIRECTORIES", "GIT_CONFIG",
+                 "GIT_CONFIG_PARAMETERS", "GIT_CONFIG_COUNT")
+
+_SHA_RE = re.compile("^[0-9a-f]{40}([0-9a-f]{24})?$")
+
+# directory -> repository root (or None if not in a repository)
+_repo_roots = {}
+# repository root -> metadata dict
+_repo_info = {}
+
+
+def find_repo_root(dirname: str) -> Optional[str]:
+    """Returns the root of the git working tree containing dirname, or None if it's not in one"""
+    visited = []
+    root = None
+    path = os.path.abspath(dirname)
+    while True:
+        if path in _repo_roots:
+            root = _repo_roots[path]
+            break
+        visited.append(path)
+        if os.path.lexists(os.path.join(path, ".git")):
+            root = path
+            break
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    for path in visited:
+        _repo_roots[path] = root
+    return root
+
+
+def _read_line(filename: str) -> Optional[str]:
+    try:
+        with open(filename, "rt") as f:
+            return f.readline().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _git_dirs(root: str) -> Tuple[str, str]:
+    """Returns the git directory of a working tree, and the common git directory (which differs from the former
+    for linked worktrees)"""
+    gitdir = os.path.join(root, ".git")
+    if os.path.isfile(gitdir):
+        # submodules and linked worktrees have a .git file pointing to the real git directory
+        line = _read_line(gitdir) or ""
+        if not line.startswith("gitdir:"):
+            raise UnsupportedGitLayout(f"unrecognized {gitdir} file")
+        gitdir = os.path.normpath(os.path.join(root, line[7:].strip()))
+    if not os.path.isdir(gitdir):
+        raise UnsupportedGitLayout(f"{gitdir} is not a directory")
+    commondir = _read_line(os.path.join(gitdir, "commondir"))
+    commondir = os.path.normpath(os.path.join(gitdir, commondir)) if commondir else gitdir
+    return gitdir, commondir
+
+
+def _unquote(value: str) -> str:
+    """Processes a git config value: strips comments, removes quotes and handles escapes"""
+    result = []
+    quoted = False
+    chars = iter(value.strip())
+    for char in chars:
+        if char == '"':
+            quoted = not quoted
+        elif char == "\\":
+            char = next(chars, "")
+            result.append({"n": "\n", "t": "\t", "b": "\b"}.get(char, char))
+        elif char in "#;" and not quoted:
+            break
+        else:
+            result.append(char)
+    return "".join(result).strip()
+
+
+_SECTION_RE = re.compile(r'^\[\s*([\w.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(.*)$')
+
+def parse_config(filename: str) -> Dict[Tuple[str, Optional[str]], Dict[str, List[str]]]:
+    """Parses a git config file into a dict of {(section, subsection): {key: [values]}}. Section names and keys
+    are lowercased, as they are case-insensitive."""
+    config = {}
+    values = None
+    try:
+        with open(filename, "rt") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return config
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("["):
+            match = _SECTION_RE.match(line)
+            if not match:
+                raise UnsupportedGitLayout(f"{filename}: can't parse section header {line}")
+            section, subsection, line = match.groups()
+            section = section.lower()
+            if "." in section and subsection is None:
+                # old-style [section.subsection] syntax
+                section, subsection = section.split(".", 1)
+            elif subsection is not None:
+                subsection = re.sub(r"\\(.)", r"\1", subsection)
+            values = config.setdefault((section, subsection), {})
+            if not line or line[0] in "#;":
+                continue
+        if values is None or line.endswith("\\"):
+            raise UnsupportedGitLayout(f"{filename}: can't parse line {line}")
+        key, _, value = line.partition("=")
+        values.setdefault(key.strip().lower(), []).append(_unquote(value) if _ else "true")
+    return config
+
+
+def _read_refs(commondir: str) -> Dict[str, str]:
+    """Returns dict of all refs in the repository (loose refs taking precedence over packed ones),
+    and of tags peeled to the commits they point to, under '<tagname>^{}'. Packed lightweight tags
+    are "peeled" to themselves, if packed-refs says that all its tags have been peeled."""
+    refs = {}
+    try:
+        with open(os.path.join(commondir, "packed-refs"), "rt") as f:
+            lastref = None
+            peeled = False
+            for line in f:
+                line = line.strip()
+                if line.startswith("# pack-refs with:"):
+                    traits = line.split(":", 1)[1].split()
+                    peeled = "peeled" in traits or "fully-peeled" in traits
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("^"):
+                    if lastref is not None:
+                        refs[lastref + "^{}"] = line[1:]
+                    continue
+                sha, _, lastref = line.partition(" ")
+                refs[lastref] = sha
+                if peeled and lastref.startswith("refs/tags/"):
+                    refs[lastref + "^{}"] = sha
+    except FileNotFoundError:
+        pass
+    refsdir = os.path.join(commondir, "refs")
+    for dirpath, _, filenames in os.walk(refsdir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            sha = _read_line(path)
+            if sha and _SHA_RE.match(sha):
+                ref = os.path.relpath(path, commondir).replace(os.sep, "/")
+                refs[ref] = sha
+                refs.pop(ref + "^{}", None)
+    return refs
+
+
+def _peel(commondir: str, sha: str) -> Optional[str]:
+    """Peels a (loose) annotated tag object to the object it points to. Other loose objects are returned as is.
+    Returns None if the object (or the one a tag points to) is not loose, since packs are not read."""
+    try:
+        with open(os.path.join(commondir, "objects", sha[:2], sha[2:]), "rb") as f:
+            data = zlib.decompressobj().decompress(f.read(), 256)
+    except (FileNotFoundError, zlib.error):
+        return None
+    if data.startswith(b"tag "):
+        target = data.split(b"\0", 1)[-1].split(b"\n", 1)[0]
+        if target.startswith(b"object "):
+            return _peel(commondir, target[7:].decode())
+    return sha
+
+
+def _tags_at(commondir: str, refs: Dict[str, str], sha: str) -> List[str]:
+    """Returns the tags pointing at the given commit, in the order 'git describe --all' prefers them: 
+    annotated tags, else lightweight ones, by name.
+
+    Raises:
+        UnsupportedGitLayout: if this can't be told without the help of git, i.e. if a tag object is packed
+            (and not peeled in packed-refs), or several annotated tags point at the commit (git picks the newest)
+    """
+    annotated, lightweight = [], []
+    for ref, refsha in refs.items():
+        if not ref.startswith("refs/tags/") or ref.endswith("^{}"):
+            continue
+        if refsha == sha:
+            lightweight.append(ref)
+            continue
+        peeled = refs.get(ref + "^{}") or _peel(commondir, refsha)
+        if peeled is None:
+            raise UnsupportedGitLayout(f"can't peel {ref}")
+        if peeled == sha:
+            annotated.append(ref)
+    if len(annotated) > 1:
+        raise UnsupportedGitLayout("several annotated tags point at HEAD")
+    return sorted(annotated) or sorted(lightweight)
+
+
+def _remote_lines(config) -> List[str]:
+    """Returns the remotes in the format of 'git remote -v'"""
+    lines = []
+    for (section, name), values in sorted(config.items(), key=lambda item: str(item[0][1])):
+        if section == "remote" and name is not None and "url" in values:
+            urls = values["url"]
+            lines.append(f"{name}\t{urls[0]} (fetch)")
+            for url in values.get("pushurl", urls):
+                lines.append(f"{name}\t{url} (push)")
+    return lines
+
+
+def read_git_info(root: str) -> Dict[str, object]:
+    """Reads the metadata of the repository with the given working tree root. Returns dict with
+    the current branch, a 'git describe --all --long'-style description, and the remotes.
+
+    Raises:
+        UnsupportedGitLayout: if the repository can't be read without the help of git
+    """
+    if root in _repo_info:
+        return _repo_info[root]
+    if any(var in os.environ for var in _GIT_ENV_VARS):
+        raise UnsupportedGitLayout("git environment variables are set")
+    gitdir, commondir = _git_dirs(root)
+    config = parse_config(os.path.join(commondir, "config"))
+    core = config.get(("core", None), {})
+    extensions = config.get(("extensions", None), {})
+    if int(core.get("repositoryformatversion", ["0"])[-1]) > 1 or \
+            set(extensions) - {"objectformat"} or \
+            any(section in ("include", "includeif", "url") for section, _ in config):
+        raise UnsupportedGitLayout("unsupported repository config")
+
+    head = _read_line(os.path.join(gitdir, "HEAD"))
+    if not head:
+        raise UnsupportedGitLayout("missing HEAD")
+    refs = _read_refs(commondir)
+    # HEAD is per-worktree, so a linked worktree's own refs (e.g. refs/bisect) are not considered
+
+    if head.startswith("ref:"):
+        ref = head[4:].strip()
+        sha = refs.get(ref)
+        if sha is None or not ref.startswith("refs/heads/"):
+            # unborn branch, or symbolic ref pointing somewhere unusual
+            raise UnsupportedGitLayout(f"can't resolve HEAD ({ref})")
+        name = ref[len("refs/heads/"):]
+        branch = f"{name} {sha[:7]}"
+        tracking = config.get(("branch", name), {})
+        if "remote" in tracking and "merge" in tracking:
+            remote, merge = tracking["remote"][-1], tracking["merge"][-1]
+            merge = merge[len("refs/heads/"):] if merge.startswith("refs/heads/") else merge
+            branch += f" [{merge if remote == '.' else f'{remote}/{merge}'}]"
+    else:
+        sha = head
+        if not _SHA_RE.match(sha):
+            raise UnsupportedGitLayout("can't parse HEAD")
+        branch = f"(HEAD detached at {sha[:7]}) {sha[:7]}"
+    # git describe --all picks a ref pointing at HEAD, preferring tags over the branch. Anything more 
+    # involved (i.e. a detached HEAD that isn't tagged) needs a walk through the history, which is left to git
+    tags = _tags_at(commondir, refs, sha)
+    if tags:
+        describe = f"{tags[0][len('refs/'):]}-0-g{sha[:16]}"
+    elif head.startswith("ref:"):
+        describe = f"heads/{name}-0-g{sha[:16]}"
+    else:
+        raise UnsupportedGitLayout("detached HEAD is not tagged")
+
+    info = _repo_info[root] = dict(branch=branch, describe=describe, remotes=_remote_lines(config))
+    return info
@@ -0,0 +1,102 @@
+import os, os.path, time, importlib
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Resolving an _include means probing for the file in a number of places (the including file's directory,
+# the current directory, every entry of PATH), and for (module)filename includes, importing the module to find
+# its location. A config tree with many includes makes the same probes over and over. So directory listings
+# and module locations are indexed here. A directory's listing is reused as long as its mtime is unchanged,
+# and within an index session (i.e. during one top-level load), its mtime is only checked once.
+
+# directory -> (session it was validated in, mtime_ns, dict of {name: is_symlink}). The last two are None
+# for a directory that doesn't exist
+_listings: Dict[str, tuple] = {}
+# module name -> package directory (None if it has no location)
+_module_roots: Dict[str, Optional[str]] = {}
+# module name -> (session it failed in, ImportError). Failures are only remembered for the rest of the session,
+# since the module may be installed in the meantime
+_failed_imports: Dict[str, tuple] = {}
+
+_session = 0
+_session_depth = 0
+
+# listings of directories modified less than this many seconds before they were read are not reused, since
+# an entry added later within the same mtime tick would go unnoticed
+_RACY_INTERVAL = 2
+
+
+@contextmanager
+def session():
+    """Context manager marking a top-level load. Sessions nest: only the outermost one counts."""
+    global _session, _session_depth
+    if not _session_depth:
+        _session += 1
+    _session_depth += 1
+    try:
+        yield
+    finally:
+        _session_depth -= 1
+
+
+def _listing(dirname: str) -> Optional[Dict[str, bool]]:
+    """Returns listing of a directory as a dict of {name: is_symlink}, or None if it can't be listed"""
+    cached = _listings.get(dirname)
+    if cached is not None and _session_depth and cached[0] == _session:
+        return cached[2]
+    try:
+        mtime_ns = os.stat(dirname).st_mtime_ns
+    except OSError:
+        # missing directories are remembered for the rest of the session
+        _listings[dirname] = _session, None, None
+        return None
+    if cached is not None and cached[1] == mtime_ns:
+        _listings[dirname] = _session, mtime_ns, cached[2]
+        return cached[2]
+    try:
+        entries = {entry.name: entry.is_symlink() for entry in os.scandir(dirname)}
+    except OSError:
+        return None
+    if time.time() - mtime_ns / 1e9 > _RACY_INTERVAL:
+        _listings[dirname] = _session, mtime_ns, entries
+    else:
+        _listings.pop(dirname, None)
+    return entries
+
+
+def exists(path: str) -> bool:
+    """Equivalent of os.path.exists(), consulting the index"""
+    dirname, basename = os.path.split(os.path.abspath(path))
+    if not basename:
+        return os.path.exists(path)
+    entries = _listing(dirname)
+    if entries is None or basename not in entries:
+        return False
+    # symlinks may be dangling
+    return not entries[basename] or os.path.exists(path)
+
+
+def module_root(modulename: str) -> Optional[str]:
+    """Returns the directory of a module or package, importing it if needed (the first time only), or None if
+    it doesn't have one.
+
+    Raises:
+        ImportError: if the module can't be imported
+    """
+    if modulename in _module_roots:
+        return _module_roots[modulename]
+    failed = _failed_imports.get(modulename)
+    if failed is not None and _session_depth and failed[0] == _session:
+        raise failed[1]
+    try:
+        mod = importlib.import_module(modulename)
+    except ImportError as exc:
+        _failed_imports[modulename] = _session, exc
+        raise
+    if mod.__file__ is not None:
+        root = os.path.dirname(mod.__file__)
+    else:
+        root = getattr(mod, '__path__', None)
+        root = root and list(root)[0]
+    _module_roots[modulename] = root
+    _failed_imports.pop(modulename, None)
+    return root
@@ -1,15 +1,15 @@
 import os.path
-import importlib
 import re
 import fnmatch
 from collections.abc import Sequence
 
-from omegaconf.omegaconf import OmegaConf, DictConfig, ListConfig
+from omegaconf.omegaconf import OmegaConf, DictConfig, ListConfig, MISSING
 from omegaconf.errors import OmegaConfBaseException
 from typing import Any, List, Dict, Optional, OrderedDict, Union, Callable
 
 from .common import *
 from .deps import ConfigDependencies, FailRecord
+from . import include_index
 
 
 def _lookup_nameseq(name_seq: List[str], source_dict: Dict):
@@ -62,6 +62,54 @@ def _lookup_name(name: str, *sources: List[Dict]):
     raise ConfigurattError(f"unknown key {name}")
 
 
+def _to_plain(value: Any):
+    """Internal helper: converts OmegaConf containers into plain ones (leaving interpolations as they are)"""
+    if isinstance(value, (DictConfig, ListConfig)):
+        return OmegaConf.to_container(value, resolve=False)
+    return value
+
+
+def _copy_plain(value: Any):
+    """Internal helper: deep-copies plain containers, converting any OmegaConf containers into plain ones"""
+    if type(value) is dict:
+        return {key: _copy_plain(item) for key, item in value.items()}
+    if type(value) is list:
+        return [_copy_plain(item) for item in value]
+    return _to_plain(value)
+
+
+def _merge_plain(dest: Dict, *sources: Dict, copy: bool = True) -> Dict:
+    """Internal helper: merges plain dicts into dest (modifying it in place), following the rules of OmegaConf.merge()
+    for untyped configs. Subsections are merged recursively, anything else (lists included) is replaced, and 
+    missing values ("???") do not replace existing ones.
+
+    Args:
+        dest (Dict): dict to merge into
+        sources (Dict): dicts (or DictConfigs) to merge
+        copy (bool): if True (default), content is copied from the sources. If False, the sources are 
+            owned by the caller, and their content may be reused.
+
+    Returns:
+        Dict: dest
+    """
+    for source in sources:
+        copy_values = copy
+        if isinstance(source, DictConfig):
+            source, copy_values = _to_plain(source), False
+        elif not isinstance(source, dict):
+            raise ConfigurattError(f"can't merge a {type(source).__name__} into a section")
+        for key, value in source.items():
+            if key in dest:
+                current = dest[key]
+                if type(current) is dict and type(value) is dict:
+                    _merge_plain(current, value, copy=copy_values)
+                    continue
+                if type(value) is str and value == MISSING:
+                    continue
+            dest[key] = _copy_plain(value) if copy_values else value
+    return dest
+
+
 def _flatten_subsections(conf, depth: int = 1, sep: str = "__"):
     """Recursively flattens subsections in a DictConfig (modifying in place)
     A structure such as
@@ -77,7 +125,7 @@ def _flatten_subsections(conf, depth: int = 1, sep: str = "__"):
         depth (int):       depth to which to flatten. Default is 1 level.
         sep (str):         separator to use, default is "__"
     """
-    subsections = [(key, value) for key, value in conf.items() if isinstance(value, DictConfig)]
+    subsections = [(key, value) for key, value in conf.items() if isinstance(value, (dict, DictConfig))]
     for name, subsection in subsections:
         pop_conf(conf, name)
         if depth > 1:
@@ -91,7 +139,7 @@ def _scrub_subsections(conf: DictConfig, scrubs: Union[str, List[str]]):
     Scrubs named subsections from a config.
 
     Args:
-        conf (DictConfig): config to scrub
+        conf (DictConfig): config to scrub (a plain dict is also accepted)
         scrubs (Union[str, List[str]]): sections to remove (can include dots to remove nested sections)
     """
     if isinstance(scrubs, str):
@@ -114,7 +162,7 @@ def _scrub_subsections(conf: DictConfig, scrubs: Union[str, List[str]]):
         for key in matches:
             if remainder:
                 subconf = conf[key]
-                if type(subconf) is DictConfig:
+                if type(subconf) in (dict, DictConfig):
                     _scrub_subsections(subconf, remainder)
                 elif not is_pattern:
                     raise ConfigurattError(f"'{name}' does not refer to a subsection")
@@ -130,8 +178,10 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
 
     Parameters
     ----------
-    conf : OmegaConf object
-        input configuration object
+    conf : OmegaConf object or plain container
+        input configuration object. Plain containers (as returned by load_yaml()) are resolved in place, 
+        and are much faster to process, with any content brought in by _include or _use converted 
+        to plain containers
     pathname : str
         full path to this config (directory component of that is used for _includes)
     location : str
@@ -150,7 +200,7 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
     Returns
     -------
     Tuple of (conf, dependencies)
-    conf : OmegaConf object    
+    conf : OmegaConf object or plain container
         This may be a new object if a _use key was resolved, or it may be the existing object
     dependencies : ConfigDependencies
         Set of filenames that were _included
@@ -165,9 +215,10 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
     # self-referencing enabled if first source is ourselves
     selfrefs =  use_sources and conf is use_sources[0]
 
-    from scabha.configuratt import load, PATH
+    from scabha.configuratt import load, _load_plain, PATH
 
-    if isinstance(conf, DictConfig):
+    if isinstance(conf, (dict, DictConfig)):
+        plain = type(conf) is dict
         
         ## NB: perhaps have _use and _include take effect at the point they're inserted?
         ## also add an _all statement to insert a section into all section that follow
@@ -190,8 +241,8 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                     elif isinstance(directive, (tuple, list, ListConfig)):
                         for dir1 in directive:
                             process_include_directive(include_files, keyword, dir1, subpath)
-                    elif isinstance(directive, DictConfig):
-                        for key, value in directive.items_ex():
+                    elif isinstance(directive, (dict, DictConfig)):
+                        for key, value in directive.items():
                             process_include_directive(include_files, keyword, value, subpath=key if subpath is None else f"{subpath}/{key}")
                     else:
                         raise ConfigurattError(f"{errloc}: {keyword} contains invalid entry of type {type(directive)}")
@@ -211,7 +262,7 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                     include_files = []
                     process_include_directive(include_files, keyword, include_directive)
 
-                    accum_incl_conf = OmegaConf.create()
+                    accum_incl_conf = {} if plain else OmegaConf.create()
 
                     # load includes
                     for incl in include_files:
@@ -234,7 +285,7 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                             modulename, filename = match.groups()
                             if modulename.startswith("."):
                                 filename = os.path.join(os.path.dirname(pathname), modulename, filename)
-                                if not os.path.exists(filename):
+                                if not include_index.exists(filename):
                                     if optional:
                                         dependencies.add_fail(FailRecord(filename, pathname,warn=warn))
                                         if warn:
@@ -243,7 +294,7 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                                     raise ConfigurattError(f"{errloc}: {keyword} {incl} does not exist")
                             else:
                                 try:
-                                    mod = importlib.import_module(modulename)
+                                    path = include_index.module_root(modulename)
                                 except ImportError as exc:
                                     if optional:
                                         dependencies.add_fail(FailRecord(incl, pathname, modulename=modulename, 
@@ -252,22 +303,17 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                                             print(f"Warning: unable to import module for optional include {incl}")
                                         continue
                                     raise ConfigurattError(f"{errloc}: {keyword} {incl}: can't import {modulename} ({exc})")
-                                if mod.__file__ is not None:
-                                    path = os.path.dirname(mod.__file__)
-                                else:
-                                    path = getattr(mod, '__path__', None)
-                                    if path is None:
-                                        if optional:
-                                            dependencies.add_fail(FailRecord(incl, pathname, modulename=modulename, 
-                                                                             fname=filename, warn=warn))
-                                            if warn:
-                                                print(f"Warning: unable to resolve path for optional include {incl}, does {modulename} contain __init__.py?")
-                                            continue
-                                        raise ConfigurattError(f"{errloc}: {keyword} {incl}: can't resolve path for {modulename}, does it contain __init__.py?")
-                                    path = path[0]
+                                if path is None:
+                                    if optional:
+                                        dependencies.add_fail(FailRecord(incl, pathname, modulename=modulename, 
+                                                                         fname=filename, warn=warn))
+                                        if warn:
+                                            print(f"Warning: unable to resolve path for optional include {incl}, does {modulename} contain __init__.py?")
+                                        continue
+                                    raise ConfigurattError(f"{errloc}: {keyword} {incl}: can't resolve path for {modulename}, does it contain __init__.py?")
 
                                 filename = os.path.join(path, filename)
-                                if not os.path.exists(filename):
+                                if not include_index.exists(filename):
                                     if optional:
                                         dependencies.add_fail(FailRecord(incl, pathname, modulename=modulename, 
                                                                          fname=filename, warn=warn))
@@ -277,7 +323,7 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                                     raise ConfigurattError(f"{errloc}: {keyword} {incl}: {filename} does not exist")
                         # absolute path -- one candidate
                         elif os.path.isabs(incl):
-                            if not os.path.exists(incl):
+                            if not include_index.exists(incl):
                                 if optional:
                                     dependencies.add_fail(FailRecord(incl, pathname, warn=warn))
                                     if warn:
@@ -290,7 +336,7 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                             paths = ['.', os.path.dirname(pathname)] + PATH
                             candidates = [os.path.join(p, incl) for p in paths] 
                             for filename in candidates:
-                                if os.path.exists(filename):
+                                if include_index.exists(filename):
                                     break
                             else:
                                 if optional:
@@ -305,7 +351,7 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                             if os.path.samefile(path, filename):
                                 raise ConfigurattError(f"{errloc}: {filename} is included recursively")
                         # load included file
-                        incl_conf, deps = load(filename, location=location, 
+                        incl_conf, deps = (_load_plain if plain else load)(filename, location=location, 
                                             name=f"{filename}, included from {name}",
                                             includes=True, 
                                             include_stack=include_stack,
@@ -317,7 +363,10 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                             incl_conf[include_path] = filename
 
                         # accumulate included config so that later includes override earlier ones
-                        accum_incl_conf = OmegaConf.unsafe_merge(accum_incl_conf, incl_conf)
+                        if plain:
+                            _merge_plain(accum_incl_conf, incl_conf, copy=False)
+                        else:
+                            accum_incl_conf = OmegaConf.unsafe_merge(accum_incl_conf, incl_conf)
 
                     if scrub:
                         try:
@@ -331,7 +380,13 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                 accum_post = load_include_files("_include_post")
 
                 # merge: our section overrides anything that has been included
-                conf = OmegaConf.unsafe_merge(accum_pre or {}, conf, accum_post or {})
+                if not plain:
+                    conf = OmegaConf.unsafe_merge(accum_pre or {}, conf, accum_post or {})
+                else:
+                    if accum_pre:
+                        conf = _merge_plain(accum_pre, conf, copy=False)
+                    if accum_post:
+                        _merge_plain(conf, accum_post, copy=False)
                 if accum_pre or accum_post:
                     updated = True
                 if selfrefs:
@@ -352,8 +407,11 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                         # convert to actual sections
                         merge_sections = [_lookup_name(name, *use_sources) for name in merge_sections]
                         # merge them all together
-                        base = merge_sections[0].copy()
-                        base.merge_with(*merge_sections[1:])
+                        if plain:
+                            base = _merge_plain({}, *merge_sections)
+                        else:
+                            base = merge_sections[0].copy()
+                            base.merge_with(*merge_sections[1:])
                         # resolve references before flattening
                         base, deps = resolve_config_refs(base, pathname=pathname, name=name, 
                                                 location=f"{location}.{keyword}" if location else keyword, 
@@ -371,18 +429,24 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                 
                 base = load_use_sections("_use")
                 if base is not None:
-                    base.merge_with(conf)
-                    conf = base
+                    if plain:
+                        conf = _merge_plain(base, conf, copy=False)
+                    else:
+                        base.merge_with(conf)
+                        conf = base
                 post = load_use_sections("_use_post")
                 if post is not None:
-                    conf.merge_with(post)
+                    if plain:
+                        _merge_plain(conf, post, copy=False)
+                    else:
+                        conf.merge_with(post)
                 
                 if selfrefs:
                     use_sources[0] = conf
 
         # recurse into content
-        for key, value in conf.items_ex(resolve=False):
-            if isinstance(value, (DictConfig, ListConfig)):
+        for key, value in list(conf.items() if plain else conf.items_ex(resolve=False)):
+            if isinstance(value, (dict, list, DictConfig, ListConfig)):
                 value1, deps = resolve_config_refs(value, pathname=pathname, name=name, 
                                                 location=f"{location}.{key}" if location else key, 
                                                 includes=includes, 
@@ -395,10 +459,10 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                     conf[key] = value1
                     
     # recurse into lists
-    elif isinstance(conf, ListConfig):
+    elif isinstance(conf, (list, ListConfig)):
         # recurse in
-        for i, value in enumerate(conf._iter_ex(resolve=False)):
-            if isinstance(value, (DictConfig, ListConfig)):
+        for i, value in enumerate(conf if type(conf) is list else conf._iter_ex(resolve=False)):
+            if isinstance(value, (dict, list, DictConfig, ListConfig)):
                 value1, deps = resolve_config_refs(value, pathname=pathname, name=name, 
                                                 location=f"{location or ''}[{i}]", 
                                                 includes=includes, 
@@ -407,6 +471,6 @@ def resolve_config_refs(conf, pathname: str, location: str, name: str, includes:
                                                 include_path=include_path)
                 dependencies.update(deps)
                 if value1 is not value:
-                    conf[i] = value
+                    conf[i] = value1
 
     return conf, dependencies
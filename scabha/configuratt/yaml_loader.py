@@ -0,0 +1,75 @@
+import re
+import yaml
+from yaml.constructor import ConstructorError
+from yaml.resolver import BaseResolver
+
+from .common import ConfigurattError
+
+# Config files are parsed into plain containers (dicts and lists), which are much cheaper to build and
+# to manipulate than OmegaConf containers. _include and _use statements are resolved on the plain containers,
+# and these are only converted into DictConfigs at the very end. The libyaml-based loader is used when
+# available, falling back to the pure-Python one.
+try:
+    from yaml import CSafeLoader as _BaseLoader
+except ImportError:
+    from yaml import SafeLoader as _BaseLoader
+
+HAVE_LIBYAML = _BaseLoader is not yaml.SafeLoader
+
+
+class ConfigLoader(_BaseLoader):
+    """YAML loader following OmegaConf's parsing conventions: floats such as "1e-3" are recognized,
+    timestamps are left as strings, and duplicate keys are an error"""
+
+    def construct_mapping(self, node, deep=False):
+        keys = set()
+        for key_node, _ in node.value:
+            if key_node.tag == BaseResolver.DEFAULT_SCALAR_TAG:
+                if key_node.value in keys:
+                    raise ConstructorError("while constructing a mapping", node.start_mark,
+                                           f"found duplicate key {key_node.value}", key_node.start_mark)
+                keys.add(key_node.value)
+        return super().construct_mapping(node, deep=deep)
+
+
+ConfigLoader.add_implicit_resolver(
+    "tag:yaml.org,2002:float",
+    re.compile(
+        """^(?:
+     [-+]?[0-9]+(?:_[0-9]+)*\\.[0-9_]*(?:[eE][-+]?[0-9]+)?
+    |[-+]?[0-9]+(?:_[0-9]+)*(?:[eE][-+]?[0-9]+)
+    |\\.[0-9]+(?:_[0-9]+)*(?:[eE][-+][0-9]+)?
+    |[-+]?[0-9]+(?:_[0-9]+)*(?::[0-5]?[0-9])+\\.[0-9_]*
+    |[-+]?\\.(?:inf|Inf|INF)
+    |\\.(?:nan|NaN|NAN))$""",
+        re.X,
+    ),
+    list("-+0123456789."),
+)
+
+ConfigLoader.yaml_implicit_resolvers = {
+    key: [(tag, regexp) for tag, regexp in resolvers if tag != "tag:yaml.org,2002:timestamp"]
+    for key, resolvers in ConfigLoader.yaml_implicit_resolvers.items()
+}
+
+
+def load_yaml(path: str):
+    """Parses a YAML config file into plain containers. An empty file yields an empty dict.
+
+    Args:
+        path (str): path to config file
+
+    Returns:
+        Union[Dict, List]: file contents
+
+    Raises:
+        yaml.YAMLError: if the file is not valid YAML
+        ConfigurattError: if the file does not contain a mapping or a sequence
+    """
+    with open(path, "rt", encoding="utf-8") as f:
+        conf = yaml.load(f, Loader=ConfigLoader)
+    if conf is None:
+        return {}
+    if not isinstance(conf, (dict, list)):
+        raise ConfigurattError(f"{path}: expected a mapping or a sequence, got {type(conf).__name__}")
+    return conf
@@ -1,16 +1,20 @@
 
 import glob
+import os
 import os.path
 import fnmatch
+import atexit
+import hashlib
+import marshal
+import tempfile
 import pyparsing
-pyparsing.ParserElement.enable_packrat()
 from pyparsing import *
 from pyparsing import common
-from functools import reduce
+from functools import reduce, lru_cache
 import operator
 import dataclasses
 
-from .substitutions import SubstitutionError, SubstitutionContext
+from .substitutions import SubstitutionError, SubstitutionContext, SubstitutionNS, reads_unchanged
 from .basetypes import Unresolved, UNSET
 from .exceptions import *
 
@@ -20,6 +24,9 @@ from omegaconf import DictConfig, ListConfig
 
 _parser = None
 
+# bound on the packrat memoization cache, which is enabled when the parser is constructed
+PACKRAT_CACHE_SIZE = 1024
+
 # see https://stackoverflow.com/questions/43244861/pyparsing-infixnotation-optimization for a cleaner parser with functions
 
 def _not_operator(value):
@@ -223,6 +230,7 @@ class FunctionHandler(ResultsHandler):
         pattern = evaluator._evaluate_result(args[0])
         if type(pattern) is UNSET:
             return pattern
+        evaluator.record_untrackable()
         return sorted(glob.glob(pattern))
 
     def EXISTS(self, evaluator, args):
@@ -231,6 +239,7 @@ class FunctionHandler(ResultsHandler):
         pattern = evaluator._evaluate_result(args[0])
         if type(pattern) is UNSET:
             return pattern
+        evaluator.record_untrackable()
         return bool(glob.glob(pattern))
 
     def DIRNAME(self, evaluator, args):
@@ -354,8 +363,15 @@ def construct_parser():
     return expr
 
 
-if _parser is None:
-    _parser = construct_parser()
+def get_parser():
+    """Returns the formula parser, constructing it on first use. Building the grammar takes a while, so it is not
+    done at import time: most processes that import scabha never parse a formula."""
+    global _parser
+    if _parser is None:
+        ParserElement.enable_packrat(cache_size_limit=PACKRAT_CACHE_SIZE)
+        _parser = construct_parser()
+    return _parser
+
 
 _parse_cache = {}
 
@@ -375,7 +391,7 @@ def parse_string(text: str, location: List[str] = []):
     parse_results = _parse_cache.get(text)
     if parse_results is None:
         try:
-            parse_results = _parser.parse_string(text, parse_all=True)
+            parse_results = get_parser().parse_string(text, parse_all=True)
         except Exception as exc:
             parse_results = ParserError(f"{'.'.join(location)}: error parsing formula ({exc})")
         _parse_cache[text] = parse_results
@@ -385,6 +401,231 @@ def parse_string(text: str, location: List[str] = []):
 
     return parse_results
 
+# Formulas are compiled into nested closures, so that evaluating them doesn't involve walking the parse tree
+# and dispatching on the type of each element. Compiled formulas are kept in an LRU cache of this size.
+FORMULA_CACHE_SIZE = 4096
+
+# Parse trees are compiled from (and optionally stored on disk as) plain nested tuples:
+#   ("U", op, arg), ("B", arg1, op, arg2), ("F", func, args) for handlers,
+#   ("P", name, children) for ParseResults, ("E", message) for parse errors, and raw values as is
+FORMULA_TREE_VERSION = 1
+
+
+def _to_tree(node):
+    """Converts an element of a parse tree into plain tuples"""
+    if isinstance(node, UnaryHandler):
+        return ("U", node.op, _to_tree(node.arg))
+    if isinstance(node, BinaryHandler):
+        return ("B", _to_tree(node.arg1), node.op, _to_tree(node.arg2))
+    if isinstance(node, FunctionHandler):
+        return ("F", node.func, tuple(_to_tree(arg) for arg in node.args))
+    if isinstance(node, ParseResults):
+        return ("P", node.getName(), tuple(_to_tree(child) for child in node))
+    if isinstance(node, (str, bool, int, float)) or node is None:
+        return node
+    raise TypeError(f"unexpected element of type {type(node)} in parse tree")
+
+
+class CompiledNode(object):
+    """Wraps a compiled element of a parse tree, so that Evaluator._evaluate_result() can tell it apart"""
+    __slots__ = ("run",)
+    def __init__(self, run):
+        self.run = run
+
+
+def _compile_handler(evaluate):
+    """Wraps compiled handler, giving it the semantics of Evaluator._evaluate_result()"""
+    def run(evaluator, allow_unset=False, subst=True):
+        value = evaluate(evaluator)
+        if type(value) is UNSET and not (allow_unset or evaluator.allow_unresolved):
+            raise UnsetError(f"'{value.value}' undefined")
+        return value
+    return run
+
+
+def compile_tree(tree):
+    """Compiles a parse tree (in the form of plain tuples) into a function f(evaluator, allow_unset=False, subst=True),
+    which is equivalent to evaluator._evaluate_result(node, allow_unset, subst) on the original parse tree"""
+    if type(tree) is not tuple:
+        def run(evaluator, allow_unset=False, subst=True):
+            return evaluator._resolve(tree, subst=subst)
+        return run
+
+    kind = tree[0]
+    if kind == "U":
+        _, opname, arg = tree
+        arg, op, arg_allow_unset = compile_tree(arg), _UNARY_OPERATORS[opname], (opname == 'not')
+        def evaluate(evaluator):
+            value = arg(evaluator, arg_allow_unset)
+            if type(value) is UNSET:
+                return value
+            return op(value)
+        return _compile_handler(evaluate)
+
+    if kind == "B":
+        _, arg1, opname, arg2 = tree
+        arg1, arg2, op = compile_tree(arg1), compile_tree(arg2), _BINARY_OPERATORS[opname]
+        def evaluate(evaluator):
+            value1, value2 = arg1(evaluator), arg2(evaluator)
+            if type(value1) is UNSET:
+                return value1
+            if type(value2) is UNSET:
+                return value2
+            return op(value1, value2)
+        return _compile_handler(evaluate)
+
+    if kind == "F":
+        # the function implementations inspect some of their (raw) arguments, so only subexpressions are compiled
+        _, func, args = tree
+        args = [CompiledNode(compile_tree(arg)) if type(arg) is tuple else arg for arg in args]
+        return _compile_handler(FunctionHandler(func, *args).evaluate)
+
+    if kind != "P":
+        raise TypeError(f"unexpected element {kind} in parse tree")
+
+    _, method, args = tree
+    if method == "subexpression" and len(args) == 1:
+        subexpr = compile_tree(args[0])
+        call = lambda evaluator, subst: subexpr(evaluator, True, subst)
+    elif method == "namespace_lookup":
+        if len(args) == 1 and type(args[0]) is tuple and args[0][:2] == ("P", "namespace_lookup"):
+            args = args[0][2]
+        call = lambda evaluator, subst: evaluator.namespace_lookup(*args, subst=subst)
+    else:
+        def call(evaluator, subst):
+            assert method is not None
+            if not hasattr(evaluator, method):
+                raise ParserError(f"{'.'.join(evaluator.location)}: don't know how to deal with an element of type '{method}'")
+            # raw values are passed as they would be by the parser
+            return getattr(evaluator, method)(*[_from_raw(arg) for arg in args], subst=subst)
+
+    def run(evaluator, allow_unset=False, subst=True):
+        allow_unset = allow_unset or evaluator.allow_unresolved
+        try:
+            value = call(evaluator, subst)
+        except SubstitutionError as exc:
+            if allow_unset:
+                return UNSET("", [exc])
+            raise
+        if type(value) is UNSET and not allow_unset:
+            raise UnsetError(f"'{value.value}' undefined")
+        return value
+    return run
+
+
+def _from_raw(arg):
+    return CompiledNode(compile_tree(arg)) if type(arg) is tuple else arg
+
+
+def compile_node(node):
+    """Compiles an element of a parse tree into a function f(evaluator, allow_unset=False, subst=True),
+    which is equivalent to evaluator._evaluate_result(node, allow_unset, subst)"""
+    return compile_tree(_to_tree(node))
+
+
+# Parse trees can optionally be stored on disk, so that warm runs don't need to construct the parser at all.
+# Maximum number of formulas stored. Beyond this, entries that were not used in the current session are dropped.
+FORMULA_DISK_CACHE_SIZE = 16384
+
+_disk_cache_file = None
+_disk_cache = None              # text -> tree, as read from disk (loaded on first use)
+_disk_cache_used = {}           # text -> tree, for formulas used in this session
+
+
+def set_formula_cache_dir(cachedir: typing.Optional[str], version: typing.Optional[str] = None):
+    """Enables the on-disk cache of parsed formulas, in the given directory (or disables it if None).
+    Entries are specific to the given package version."""
+    global _disk_cache_file, _disk_cache
+    if cachedir:
+        key = hashlib.sha256(f"{FORMULA_TREE_VERSION} {version} {pyparsing.__version__}".encode()).hexdigest()[:16]
+        _disk_cache_file = os.path.join(cachedir, f"formulas-{key}.marshal")
+    else:
+        _disk_cache_file = None
+    _disk_cache = None
+    _disk_cache_used.clear()
+
+
+def _read_disk_cache(filename: str) -> Dict[str, Any]:
+    try:
+        with open(filename, "rb") as f:
+            entries = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+
+@atexit.register
+def save_formula_cache():
+    """Stores formulas parsed in this session in the on-disk cache (if enabled). Failure to do so is not an error."""
+    if _disk_cache_file is None or not _disk_cache_used:
+        return
+    if _disk_cache is not None and all(text in _disk_cache for text in _disk_cache_used):
+        return
+    # merge with what's on disk now, since other processes may have added to it
+    entries = _read_disk_cache(_disk_cache_file)
+    if len(entries) + len(_disk_cache_used) > FORMULA_DISK_CACHE_SIZE:
+        entries = {}
+    entries.update(_disk_cache_used)
+    try:
+        dirname = os.path.dirname(_disk_cache_file)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump(entries, f)
+        os.replace(tmpname, _disk_cache_file)
+    except (OSError, ValueError):
+        pass
+
+
+def _parse_formula(text: str):
+    """Parses a formula into a tree, consulting the on-disk cache if enabled"""
+    global _disk_cache
+    tree = None
+    if _disk_cache_file is not None:
+        if _disk_cache is None:
+            _disk_cache = _read_disk_cache(_disk_cache_file)
+        tree = _disk_cache.get(text)
+    if tree is None:
+        try:
+            tree = _to_tree(get_parser().parse_string(text, parse_all=True))
+        except ParseBaseException as exc:
+            tree = ("E", f"error parsing formula ({exc})")
+        except Exception as exc:
+            return ("E", f"error parsing formula ({exc})")
+    if _disk_cache_file is not None:
+        _disk_cache_used[text] = tree
+    return tree
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def _compile_formula(text: str):
+    tree = _parse_formula(text)
+    if type(tree) is tuple and tree[0] == "E":
+        return ParserError(tree[1])
+    try:
+        return compile_tree(tree)
+    except Exception as exc:
+        return ParserError(f"error compiling formula ({exc})")
+
+
+def compile_formula(text: str):
+    """Compiles a formula (without the leading '='). Implements cache.
+
+    Args:
+        text (str): formula to compile
+
+    Raises:
+        ParserError: on any parse error
+
+    Returns:
+        Callable: function f(evaluator, allow_unset=False, subst=True) returning the value of the formula
+    """
+    formula = _compile_formula(text)
+    if isinstance(formula, Exception):
+        raise formula
+    return formula
+
+
 def is_missing(result):
     return result is None
 
@@ -392,15 +633,26 @@ class SELF(object):
     pass
 
 
+# types of evaluation results that are memoized
+_MEMOIZABLE_TYPES = (str, int, float, bool, type(None), list)
+
 class Evaluator(object):
     def __init__(self,  ns: Dict[str, Any], 
                         subst_context: typing.Optional[SubstitutionContext] = None, 
                         allow_unresolved: bool = False,
-                        location: List[str] = []):
+                        location: List[str] = [],
+                        memo: typing.Optional[Dict[Any, Any]] = None):
+        """If memo is given, results of evaluate() are memoized in it, along with the namespace lookups they
+        depended on, and reused for as long as these lookups would give the same values."""
         self.ns = ns
         self.subst_context = subst_context
         self.location = location
         self.allow_unresolved = allow_unresolved
+        self.memo = memo if subst_context is not None else None
+
+    def record_untrackable(self):
+        if self.subst_context is not None:
+            self.subst_context.record_untrackable()
 
     def _resolve(self, value, in_formula=True, subst=True):
         if type(value) is str:
@@ -445,8 +697,14 @@ class Evaluator(object):
                 names = sorted(fnmatch.filter(value.keys(), fld))
                 if names:
                     fld = names[-1]
+                self.record_untrackable()
             # last element allowed to be UNSET, otherwise substitution error
             if fld not in value:
+                if self.subst_context is not None:
+                    if isinstance(value, SubstitutionNS):
+                        self.subst_context.record_read(value, fld)
+                    else:
+                        self.subst_context.record_untrackable()
                 if fields:
                     raise SubstitutionError(f"{'.'.join(self.location)}: '{fld}' undefined (in '{'.'.join(args)}')")
                 else:
@@ -459,6 +717,9 @@ class Evaluator(object):
         return self._resolve(value, subst=subst)
 
     def _evaluate_result(self, parse_result, allow_unset=False, subst=True):
+        # compiled elements do all of the below themselves
+        if type(parse_result) is CompiledNode:
+            return parse_result.run(self, allow_unset, subst)
         allow_unset = allow_unset or self.allow_unresolved
         # if result is a handler, use evaluate
         if isinstance(parse_result, ResultsHandler):
@@ -490,7 +751,36 @@ class Evaluator(object):
     def evaluate(self, value, sublocation: List[str] = []):
         if type(value) is not str:
             return value
+        if self.memo is not None:
+            return self._evaluate_memoized(value, sublocation)
+        return self._evaluate(value, sublocation)
+
+    def _evaluate_memoized(self, value: str, sublocation: List[str]):
+        """Implements evaluate() with memoization. Memo entries are keyed by location, and record the value,
+        the result, and the namespace lookups done to get the result."""
+        context = self.subst_context
+        key = tuple(self.location + sublocation)
+        entry = self.memo.get(key)
+        if entry is not None and entry[0] == value and reads_unchanged(entry[2]):
+            result, reads = entry[1], entry[2]
+        else:
+            outer_reads = context.reads
+            reads = context.reads = []
+            try:
+                result = self._evaluate(value, sublocation)
+            finally:
+                context.reads = outer_reads
+            if (type(result) in _MEMOIZABLE_TYPES or result is UNSET or type(result) is UNSET) and \
+                    not any(ns is None for ns, _, _ in reads):
+                self.memo[key] = value, result, reads
+            else:
+                self.memo.pop(key, None)
+        # evaluations may be nested, in which case the outer one depends on the same lookups
+        if context.reads is not None:
+            context.reads += reads
+        return list(result) if type(result) is list else result
 
+    def _evaluate(self, value: str, sublocation: List[str]):
         loclen = len(self.location)
         self.location += sublocation
 
@@ -500,12 +790,12 @@ class Evaluator(object):
                     return self._resolve(value[1:], in_formula=False)
                 else:
                     try:
-                        parse_results = parse_string(value[1:])
+                        formula = compile_formula(value[1:])
                     except Exception as exc:
                         raise ParserError(f"{'.'.join(self.location)}: error parsing formula '{value}'", exc)
 
                     try:
-                        return self._evaluate_result(parse_results, allow_unset=True)
+                        return formula(self, True)
                     except Exception as exc:
                         raise FormulaError(f"{'.'.join(self.location)}: evaluation of '{value}' failed", exc, tb=True)
             else:
@@ -1,5 +1,6 @@
-import re, string
+import re, string, _string
 from collections import OrderedDict
+from functools import lru_cache
 from dataclasses import dataclass
 from contextlib import contextmanager
 from typing import Any, Dict, Optional, Union, List
@@ -11,6 +12,9 @@ from .basetypes import EmptyDictDefault, Unresolved
 
 from omegaconf import DictConfig
 
+# recorded as the value of a lookup that found nothing (see SubstitutionContext.record_read())
+_MISSING = object()
+
 # thanks to https://gist.github.com/bgusach/a967e0587d6e01e889fd1d776c5f3729
 def multireplace(string, replacements, ignore_case=False):
     """
@@ -50,6 +54,26 @@ def multireplace(string, replacements, ignore_case=False):
     )
 
 
+class _LazyNS(object):
+    """Placeholder for a nested mapping in a SubstitutionNS. The mapping is only converted into a SubstitutionNS
+    when first looked up, since most of a large nested namespace (e.g. the config) is never referred to.
+    Placeholders are shared between copies of a namespace, so the copies end up sharing the nested namespace,
+    as they would have had it been converted up front."""
+    __slots__ = ("mapping", "nosubst", "name", "ns")
+
+    def __init__(self, mapping, nosubst, name):
+        self.mapping, self.nosubst, self.name, self.ns = mapping, nosubst, name, None
+
+    def resolve(self) -> 'SubstitutionNS':
+        if self.ns is None:
+            self.ns = SubstitutionNS(_nosubst_=self.nosubst, _name_=self.name, **self.mapping)
+            self.mapping = None
+        return self.ns
+
+    def __repr__(self):
+        return repr(self.ns if self.ns is not None else self.mapping)
+
+
 class SubstitutionNS(OrderedDict):
     """Implements a namespace for {}-substitutions"""
 
@@ -84,10 +108,38 @@ class SubstitutionNS(OrderedDict):
         newcopy = SubstitutionNS()
         OrderedDict.__setattr__(newcopy, "_name_", self._name_)
         OrderedDict.__setattr__(newcopy, "_nosubst_", set())
-        for key, value in self.items():
+        for key, value in OrderedDict.items(self):
             OrderedDict.__setitem__(newcopy, key, value)
         return newcopy
 
+    def _resolve_(self, name: str, value: Any):
+        """Converts a placeholder for a nested mapping into a SubstitutionNS, returns the latter"""
+        if type(value) is _LazyNS:
+            value = value.resolve()
+            OrderedDict.__setitem__(self, name, value)
+        return value
+
+    def items(self):
+        for name, value in OrderedDict.items(self):
+            yield name, SubstitutionNS._resolve_(self, name, value)
+
+    def values(self):
+        for _, value in SubstitutionNS.items(self):
+            yield value
+
+    def __reduce__(self):
+        # keeps placeholders as they are, and drops the evaluation memo
+        state = {key: value for key, value in self.__dict__.items() if key != "_memo_"}
+        return (SubstitutionNS, (), state, None, iter(list(OrderedDict.items(self))))
+
+    def _evaluation_memo_(self) -> Dict[Any, Any]:
+        """Returns dict for memoizing evaluations done against this namespace (see Evaluator)"""
+        memo = self.__dict__.get("_memo_")
+        if memo is None:
+            memo = {}
+            OrderedDict.__setattr__(self, "_memo_", memo)
+        return memo
+
     def _update_(self, **kw):
         """Updates items in the namespace using _add_()"""
         for name, value in kw.items():
@@ -99,7 +151,9 @@ class SubstitutionNS(OrderedDict):
             if name not in self:
                 SubstitutionNS._add_(self, name, value)
             else:
-                old_value = super().get(name)
+                old_value = SubstitutionNS._resolve_(self, name, super().get(name))
+                if type(value) is _LazyNS:
+                    value = value.resolve()
                 if isinstance(old_value, SubstitutionNS) and \
                     isinstance(value, (dict, OrderedDict, SubstitutionNS, DictConfig)):
                     old_value._merge_(value)
@@ -118,7 +172,7 @@ class SubstitutionNS(OrderedDict):
         if '.' in name:
             subns_name, key = name.split('.', 1)
             if subns_name in self:
-                subns = super().__getitem__(subns_name)
+                subns = SubstitutionNS._resolve_(self, subns_name, super().__getitem__(subns_name))
                 if type(subns) is not SubstitutionNS:
                     raise TypeError(f"can't insert '{name}': {subns_name} is not a nested namespace")
             else:
@@ -126,9 +180,12 @@ class SubstitutionNS(OrderedDict):
             subns._add_(key, value)
             super().__setitem__(subns_name, subns)
         else:
-            # a nested dict value becomes a substitution namespace automatically
+            # a nested dict value becomes a substitution namespace automatically (when first looked up).
+            # Dicts are copied, so that later changes to them are not seen
             if type(value) in (dict, OrderedDict, DictConfig):
-                value = SubstitutionNS(_nosubst_=nosubst or self._nosubst_, _name_=self._name_ + [name], **value)
+                if type(value) is not DictConfig:
+                    value = value.copy()
+                value = _LazyNS(value, nosubst or self._nosubst_, self._name_ + [name])
             # if isinstance(value, SubstitutionNS):
             #     OrderedDict.__setattr__(v, "_props_", props)
             super().__setitem__(name, value)
@@ -156,17 +213,22 @@ class SubstitutionNS(OrderedDict):
                 names = sorted(fnmatch.filter(super().keys(), name))
                 if names:
                     name = names[-1]
+                if context:
+                    context.record_untrackable()
             # now look up again
             if name in self:
-                value = super().get(name)
+                value = SubstitutionNS._resolve_(self, name, super().get(name))
                 if context:
+                    context.record_read(self, name, value)
                     if context.raise_errors and type(value) is Unresolved:
                         raise SubstitutionError(f"unresolved substitution for {name} ({value})")
                     if subst and not self._nosubst_:
                         # recursive=False will invoke substitution on strings, but will return containers as is
                         value = context.evaluate(value, location=nestloc, recursive=False)
                 return value
-            elif default in (KeyError, AttributeError):
+            if context:
+                context.record_read(self, name)
+            if default in (KeyError, AttributeError):
                 raise default(name)
             else:
                 return default
@@ -208,6 +270,33 @@ class SubstitutionFormatter(string.Formatter):
         return self.context.get_value(key, args, kwargs)
 
 
+# Strings are split into literal and field segments once, and the result is cached, since the same strings
+# (log names, output filename templates, etc.) are substituted over and over.
+TEMPLATE_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(value: str):
+    """Splits a format string into a tuple of (literal, field) segments, where field is None or a tuple of
+    (name, [(is_attr, key), ...], conversion, format_spec). Returns None if the string can't be handled this way
+    (it is malformed, or uses positional fields or nested format specs), in which case it should be given
+    to a string.Formatter."""
+    segments = []
+    try:
+        for literal, field_name, format_spec, conversion in _string.formatter_parser(value):
+            if field_name is None:
+                segments.append((literal, None))
+                continue
+            if not field_name or "{" in format_spec:
+                return None
+            first, rest = _string.formatter_field_name_split(field_name)
+            if type(first) is int:
+                return None
+            segments.append((literal, (first, tuple(rest), conversion, format_spec)))
+    except ValueError:
+        return None
+    return tuple(segments)
+
+
 @dataclass
 class SubstitutionContext(object):
     ns: Optional[SubstitutionNS]
@@ -225,9 +314,21 @@ class SubstitutionContext(object):
         # list of erros and list of forgiven errors
         self.errors = []
         self.forgivens = []
+        # if not None, namespace lookups are recorded here, as (namespace, name, value) tuples
+        self.reads = None
 
     _current_contexts = {}
 
+    def record_read(self, ns: SubstitutionNS, name: str, value: Any = _MISSING):
+        """Records the (raw) value found by a namespace lookup, if lookups are being recorded"""
+        if self.reads is not None:
+            self.reads.append((ns, name, list(value) if type(value) is list else value))
+
+    def record_untrackable(self):
+        """Records a lookup that reads_unchanged() can't check (e.g. a wildcard, or a file system lookup)"""
+        if self.reads is not None:
+            self.reads.append((None, None, None))
+
     @staticmethod
     def current() -> 'SubstitutionContext':
         return SubstitutionContext._current_contexts.get(threading.get_ident())
@@ -246,6 +347,10 @@ class SubstitutionContext(object):
         if not recursive and isinstance(value, (list, tuple, dict, OrderedDict)):
             return value
 
+        # fast path for strings with nothing to substitute
+        if isinstance(value, str) and ("{" not in value or isinstance(value, Error)):
+            return value
+
         # not a string, or an Error, or no "{" symbol -- return as is
         if self.ns is not None and isinstance(value, (str, list, tuple, dict, OrderedDict)):
 
@@ -293,7 +398,7 @@ class SubstitutionContext(object):
             # if we're doing a nested substitution, protect "{{" and "}}" from getting converted to a single brace by pre-replacing them
             if nesting:
                 newvalue = multireplace(value, {"{{": "\u00AB", "}}": "\u00BB"})
-            newvalue = self.formatter.format(value)
+            newvalue = self._format(value)
             if nesting:
                 newvalue = multireplace(newvalue, {"\u00AB": "{{", "\u00BB": "}}"})
         except Exception as exc:
@@ -331,7 +436,25 @@ class SubstitutionContext(object):
             self.forgivens.append(name)
         return newvalue
 
-            
+    def _format(self, value: str):
+        """Equivalent to self.formatter.format(value), using a precompiled template"""
+        template = compile_template(value)
+        if template is None:
+            return self.formatter.format(value)
+        output = []
+        for literal, field in template:
+            if literal:
+                output.append(literal)
+            if field is not None:
+                name, rest, conversion, format_spec = field
+                obj = self.get_value(name, (), {})
+                for is_attr, key in rest:
+                    obj = getattr(obj, key) if is_attr else obj[key]
+                if conversion is not None:
+                    obj = self.formatter.convert_field(obj, conversion)
+                output.append(format(obj, format_spec))
+        return "".join(output)
+
     def get_value(self, key, args, kwargs):
         """Implements get_value for string formatter"""
         if type(key) is int:
@@ -350,6 +473,22 @@ class SubstitutionContext(object):
             return self.ns.get(key, KeyError)
 
 
+def reads_unchanged(reads: List[tuple]) -> bool:
+    """Checks that namespace lookups recorded by SubstitutionContext.record_read() would find the same values now"""
+    for ns, name, value in reads:
+        if ns is None:
+            return False
+        current = OrderedDict.get(ns, name, _MISSING)
+        if type(current) is _LazyNS and current.ns is not None:
+            current = current.ns
+        if current is value:
+            continue
+        # namespaces and other objects must be the same, plain values must be equal
+        if type(current) is not type(value) or type(value) not in (str, int, float, bool, list) or current != value:
+            return False
+    return True
+
+
 @contextmanager
 def substitutions_from(ns: Optional[SubstitutionNS], raise_errors=False, forgive_errors: dict={}):
     thread = threading.get_ident()
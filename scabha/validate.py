@@ -36,9 +36,12 @@ def evaluate_and_substitute(inputs: Dict[str, Any],
                             corresponding_ns: SubstitutionNS,
                             defaults: Dict[str, Any] = {},
                             ignore_subst_errors: bool = False, 
-                            location: List[str] = []):
+                            location: List[str] = [],
+                            memoize: bool = False):
+    # memoized results are kept with the namespace, and reused while the lookups they depend on are unchanged 
+    memo = subst._evaluation_memo_() if memoize else None
     with substitutions_from(subst, raise_errors=True) as context:
-        evaltor = Evaluator(subst, context, location=location, allow_unresolved=True)
+        evaltor = Evaluator(subst, context, location=location, allow_unresolved=True, memo=memo)
         inputs = evaltor.evaluate_dict(inputs, corresponding_ns=corresponding_ns, defaults=defaults,
                                         raise_substitution_errors=False)
         # collect errors
@@ -254,8 +254,11 @@ def cleanup(backend: 'stimela.backend.StimelaBackendOptions', log: logging.Logge
 def run(cab: 'stimela.kitchen.cab.Cab', params: Dict[str, Any], fqname: str,
         backend: 'stimela.backend.StimelaBackendOptions',
         log: logging.Logger, subst: Optional[Dict[str, Any]] = None,
-        wrapper: Optional['stimela.backends.runner.BackendWrapper'] = None):
+        wrapper: Optional['stimela.backends.runner.BackendWrapper'] = None,
+        timeout: Optional[float] = None, idle_output_timeout: Optional[float] = None):
     from . import run_kube
+    if timeout or idle_output_timeout:
+        log.warning("timeout settings are not enforced by the kube backend, ignoring")
     return run_kube.run(cab=cab, params=params, fqname=fqname, backend=backend, log=log, subst=subst)
 
 _kube_client = _kube_config = _kube_context = _kube_namespace = None 
@@ -26,9 +26,10 @@ class BackendRunner(object):
     wrapper: Any
 
     def run(self, cab: 'stimela.kitchen.cab.Cab', params: Dict[str, Any], fqname: str,
-            log: logging.Logger, subst: Optional[Dict[str, Any]] = None):
+            log: logging.Logger, subst: Optional[Dict[str, Any]] = None,
+            timeout: Optional[float] = None, idle_output_timeout: Optional[float] = None):
         return self.backend.run(cab, params, fqname=fqname, backend=self.opts, log=log, subst=subst, 
-                                wrapper=self.wrapper)
+                                wrapper=self.wrapper, timeout=timeout, idle_output_timeout=idle_output_timeout)
         
     def build(self, cab: 'stimela.kitchen.cab.Cab', log: logging.Logger, rebuild=False):
         if not hasattr(self.backend, 'build'):
@@ -226,7 +226,8 @@ def build(cab: 'stimela.kitchen.cab.Cab', backend: 'stimela.backend.StimelaBacke
 def run(cab: 'stimela.kitchen.cab.Cab', params: Dict[str, Any], fqname: str,
         backend: 'stimela.backend.StimelaBackendOptions',
         log: logging.Logger, subst: Optional[Dict[str, Any]] = None,
-        wrapper: Optional['stimela.backends.runner.BackendWrapper'] = None):
+        wrapper: Optional['stimela.backends.runner.BackendWrapper'] = None,
+        timeout: Optional[float] = None, idle_output_timeout: Optional[float] = None):
 
     """Runs cab contents
 
@@ -293,7 +294,8 @@ def run(cab: 'stimela.kitchen.cab.Cab', params: Dict[str, Any], fqname: str,
                 return_errcode=True, command_name=command_name, 
                 gentle_ctrl_c=True,
                 log_command=True if cab.flavour.log_full_command else command_name, 
-                log_result=False)
+                log_result=False,
+                timeout=timeout, idle_output_timeout=idle_output_timeout)
 
     # check if output marked it as a fail
     if cabstat.success is False:
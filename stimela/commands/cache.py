@@ -0,0 +1,122 @@
+import re
+import sys
+import click
+import datetime
+from typing import List
+
+from stimela import logger
+from stimela.main import cli
+from scabha.configuratt import cache as config_cache
+
+from .run import load_recipe_files, resolve_recipe_file
+
+_SIZE_UNITS = dict(k=2**10, m=2**20, g=2**30, t=2**40)
+
+def parse_size(value: str) -> int:
+    """Parses a size given as a number of bytes, optionally with a K/M/G/T suffix"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*([kmgt]?)i?b?\s*", value.lower())
+    if not match:
+        raise click.BadParameter(f"invalid size '{value}'")
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS.get(unit, 1))
+
+
+def format_size(size: int) -> str:
+    for unit in "TGMk":
+        if size >= _SIZE_UNITS[unit.lower()]:
+            return f"{size/_SIZE_UNITS[unit.lower()]:.1f}{unit}B"
+    return f"{size}B"
+
+
+@cli.group("cache",
+    help="""
+    Manage the configuration cache.
+    """)
+def cache():
+    pass
+
+
+@cache.command("stats",
+    help="""
+    Print statistics of the configuration cache.
+    """)
+def stats():
+    log = logger()
+    for label, cachedir in ("private", config_cache.CACHEDIR), ("shared", config_cache.SHARED_CACHEDIR):
+        if not cachedir:
+            continue
+        entries = config_cache.list_entries(cachedir)
+        total = sum(entry.size for entry in entries)
+        log.info(f"{label} cache {cachedir}: {len(entries)} entries, {format_size(total)}")
+        if entries:
+            oldest = datetime.datetime.fromtimestamp(entries[0].atime).strftime('%c')
+            newest = datetime.datetime.fromtimestamp(entries[-1].atime).strftime('%c')
+            log.info(f"  least recently used on {oldest}, most recently used on {newest}")
+    if config_cache.CACHE_MAX_SIZE:
+        log.info(f"private cache size limit is {format_size(config_cache.CACHE_MAX_SIZE)}")
+    else:
+        log.info("private cache size is not limited")
+
+
+@cache.command("prune",
+    help="""
+    Evict least recently used entries from the private configuration cache, to bring it under a given size.
+    """)
+@click.option("-m", "--max-size", metavar="SIZE", default=None,
+                help="""Maximum cache size, in bytes. K/M/G/T suffixes may be used. Default is the configured
+                size limit. Use 0 to clear the cache.""")
+def prune(max_size=None):
+    log = logger()
+    max_size = parse_size(max_size) if max_size is not None else config_cache.CACHE_MAX_SIZE
+    nremoved, nfreed = config_cache.prune_cache(max_size, log=log)
+    if not nremoved:
+        log.info(f"cache is already under {format_size(max_size)}, nothing to prune")
+
+
+@cache.command("warm",
+    help="""
+    Load recipe or config file(s), populating the configuration cache with them and everything they include.
+    """)
+@click.option("-s", "--shared", is_flag=True,
+                help="""Save new entries to the shared configuration cache rather than the private one. Only entries 
+                made of plain containers can be shared, the rest are saved to the private cache.""")
+@click.argument("items", nargs=-1, metavar="filename.yml...", required=True)
+def warm(items: List[str] = [], shared=False):
+    log = logger()
+    if shared:
+        if not config_cache.SHARED_CACHEDIR:
+            log.error("no shared cache is configured (see STIMELA_SHARED_CONFIG_CACHE)")
+            sys.exit(2)
+        config_cache.PUBLISH_TO_SHARED_CACHE = True
+    filenames = []
+    for item in items:
+        try:
+            filename = resolve_recipe_file(item)
+        except FileNotFoundError as exc:
+            log.error(f"{exc}")
+            sys.exit(2)
+        if not filename:
+            log.error(f"'{item}' is not a recipe or config file")
+            sys.exit(2)
+        filenames.append(filename)
+    stats_before = config_cache.CACHE_STATS.copy()
+    recipe_names = load_recipe_files(filenames)
+    stats = config_cache.CACHE_STATS - stats_before
+    log.info(f"loaded {len(recipe_names)} recipe(s): {stats['hits']} cache hit(s), {stats['misses']} miss(es), "
+             f"{stats['writes']} new entries")
+
+
+@cache.command("verify",
+    help="""
+    Check that entries of the private configuration cache are readable, and up to date with the files they depend on.
+    """)
+@click.option("-r", "--remove", is_flag=True,
+                help="""Remove entries that fail the check.""")
+def verify(remove=False):
+    log = logger()
+    nvalid, invalid = config_cache.verify_cache(remove=remove, log=log)
+    for path, reason in invalid:
+        log.warning(f"{path}: {reason}")
+    log.info(f"{nvalid} valid entries, {len(invalid)} invalid{' (removed)' if remove and invalid else ''}")
+    if invalid and not remove:
+        sys.exit(1)
@@ -89,9 +89,12 @@ def doc(what: List[str] = [], do_list=False, implicit=False, obscure=False, all=
     if errcode:
         sys.exit(errcode)
     
-    log.info(f"loaded {len(stimela.CONFIG.cabs)} cab definition(s) and {len(stimela.CONFIG.lib.recipes)} recipe(s)")
+    # cabs are listed from the index, and only looked up if they are to be documented
+    cab_names = stimela.config.cab_names()
 
-    if not stimela.CONFIG.lib.recipes and not stimela.CONFIG.cabs:
+    log.info(f"loaded {len(cab_names)} cab definition(s) and {len(stimela.CONFIG.lib.recipes)} recipe(s)")
+
+    if not stimela.CONFIG.lib.recipes and not cab_names:
         log.error(f"Nothing to document")
         sys.exit(2)
 
@@ -100,20 +103,20 @@ def doc(what: List[str] = [], do_list=False, implicit=False, obscure=False, all=
 
     for item in names_to_document:
         recipe_names = fnmatch.filter(stimela.CONFIG.lib.recipes.keys(), item)
-        cab_names = fnmatch.filter(stimela.CONFIG.cabs.keys(), item)
-        if not recipe_names and not cab_names:
+        matching_cab_names = fnmatch.filter(cab_names, item)
+        if not recipe_names and not matching_cab_names:
             log.error(f"'{item}' does not match any recipe or cab names. Try -l/--list")
             sys.exit(2)
         recipes_to_document.update(recipe_names)
-        cabs_to_document.update(cab_names)
+        cabs_to_document.update(matching_cab_names)
 
     # if nothing was specified, and only one cab/only one recipe is defined, print that
     if not names_to_document:
         if len(top_level_recipes) == 1:
             recipes_to_document.update(top_level_recipes)
             log.info("a single top-level recipe is defined, documenting it by default. Use -l to list all defined recipes/cabs")
-        elif len(stimela.CONFIG.cabs) == 1 and not top_level_recipes:
-            cabs_to_document.update(stimela.CONFIG.cabs.keys())
+        elif len(cab_names) == 1 and not top_level_recipes:
+            cabs_to_document.update(cab_names)
 
     if recipes_to_document or cabs_to_document:
         for name in recipes_to_document:
@@ -123,7 +126,7 @@ def doc(what: List[str] = [], do_list=False, implicit=False, obscure=False, all=
         
         for name in cabs_to_document:
             try:
-                cab = Cab(**stimela.CONFIG.cabs[name])
+                cab = Cab(**stimela.config.get_cab_config(name))
                 cab.finalize(config=stimela.CONFIG)
             except Exception as exc:
                 if not isinstance(exc, CabValidationError):
@@ -142,11 +145,11 @@ def doc(what: List[str] = [], do_list=False, implicit=False, obscure=False, all=
                 table.add_row(f"[bold]{name}[/bold]", getattr(recipe, 'info', ''))
             subtree.add(table)
 
-        if stimela.CONFIG.cabs:
+        if cab_names:
             subtree = top_tree.add("Cabs:")
             table = Table.grid("", "", padding=(0,2))
-            for name, cab in stimela.CONFIG.cabs.items():
-                table.add_row(f"[bold]{name}[/bold]", getattr(cab, 'info', ''))
+            for name in cab_names:
+                table.add_row(f"[bold]{name}[/bold]", stimela.config.cab_info(name) or '')
             subtree.add(table)            
         
     rich_print(top_tree)
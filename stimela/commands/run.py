@@ -16,7 +16,7 @@ from omegaconf.omegaconf import OmegaConf, OmegaConfBaseException
 import stimela
 from scabha import configuratt
 from scabha.basetypes import UNSET
-from scabha.exceptions import ScabhaBaseException
+from scabha.exceptions import ScabhaBaseException, ConfigError
 from scabha.substitutions import SubstitutionNS
 from stimela import stimelogging
 import stimela.config
@@ -25,6 +25,7 @@ from stimela import logger, log_exception
 from stimela.exceptions import RecipeValidationError, StimelaRuntimeError, StepSelectionError, StepValidationError
 from stimela.main import cli
 from stimela.kitchen.recipe import Recipe, Step, RecipeSchema, join_quote
+from stimela.kitchen import scatter, journal, recipe_cache
 from stimela import task_stats
 import stimela.backends
 
@@ -125,11 +126,13 @@ def load_recipe_files(filenames: List[str]):
 
     # split content into config sections, and recipes:
     # config secions are merged into the config namespace, while recipes go under
-    # lib.recipes
+    # lib.recipes. Cab definitions are indexed, and only merged into the config when used.
     recipe_names = []
     update_conf = OmegaConf.create()
     for name, value in full_conf.items():
-        if name in stimela.CONFIG:
+        if name == "cabs":
+            stimela.config.register_cabs(value, source=', '.join(filenames))
+        elif name in stimela.CONFIG:
             update_conf[name] = value
         else:
             try:
@@ -195,8 +198,17 @@ def load_recipe_files(filenames: List[str]):
                 help="""Enables the slurm backend wrapper (shortcut for -C backend.slurm.enable=True)""")
 @click.option("-dc", "--dump-config", is_flag=True,
                 help="""Dump the equivalent stimela config to a file""")
+@click.option("--resume", "resume", metavar="[JOURNAL]", is_flag=False, flag_value="", default=None,
+                help="""Resumes a previous run of the recipe, skipping steps and scattered loop iterations that
+                it has completed. Optionally, give the log directory or journal file of the run to resume (use
+                --resume=JOURNAL), else the most recent run found next to the new log directory is resumed.""")
+@click.option("--recipe-cache/--no-recipe-cache", "use_recipe_cache", default=True,
+                help="""Reuses the recipe as loaded and finalized by a previous run with the same recipe files, config
+                and settings (default), or forces it to be reloaded.""")
 @click.argument("parameters", nargs=-1, metavar="filename.yml ... [recipe or cab name] [PARAM=VALUE] ...", required=True)
 def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = False, last_recipe: bool = False, profile: Optional[int] = None,
+    resume: Optional[str] = None,
+    use_recipe_cache: bool = True,
     assign: List[Tuple[str, str]] = [],
     config_equals: List[str] = [],
     config_assign: List[Tuple[str, str]] = [],
@@ -214,6 +226,11 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
     recipe_or_cab = None
     files_to_load = []
 
+    # "--resume recipe.yml" is parsed as a resume argument, so give it back to the parameters
+    if resume and os.path.splitext(resume)[1] in _yaml_extensions:
+        parameters = (resume,) + tuple(parameters)
+        resume = ""
+
     def convert_value(value):
         if value == "=UNSET":
             return UNSET
@@ -259,22 +276,32 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
     if errcode:
         sys.exit(errcode)
 
-    # load config and recipes from all given files
-    if files_to_load:
+    # look for a compiled recipe from a previous run, else load config and recipes from all given files
+    compiled = None
+    if files_to_load and use_recipe_cache:
+        recipe_cache_keys = ["compiled-recipe", str(recipe_or_cab), str(last_recipe), 
+                             recipe_cache.config_digest(stimela.CONFIG), *configuratt.PATH, 
+                             *config_equals, *itertools.chain(*config_assign), 
+                             str((enable_native, enable_singularity, enable_kube, enable_slurm))]
+        compiled = recipe_cache.load_compiled_recipe(files_to_load, recipe_cache_keys, log)
+    if compiled is not None:
+        available_recipes = compiled.recipe_names
+    elif files_to_load:
         available_recipes = load_recipe_files(files_to_load)
+        log.debug(f"config cache: {dict(configuratt.cache.CACHE_STATS)}")
     else:
         available_recipes = []
 
     # load config settigs from --config arguments
     try:
-        stimela.CONFIG.merge_with(OmegaConf.from_dotlist(config_equals))
-    except OmegaConfBaseException as exc:
+        stimela.config.merge_config_settings(stimela.CONFIG, OmegaConf.from_dotlist(config_equals))
+    except (OmegaConfBaseException, ConfigError) as exc:
         log_exception(f"error loading -c/--config assignments", exc)
         sys.exit(2)
     try:
         dotlist = [f"{key}={value}" for key, value in config_assign]
-        stimela.CONFIG.merge_with(OmegaConf.from_dotlist(dotlist))
-    except OmegaConfBaseException as exc:
+        stimela.config.merge_config_settings(stimela.CONFIG, OmegaConf.from_dotlist(dotlist))
+    except (OmegaConfBaseException, ConfigError) as exc:
         log_exception(f"error loading -C/--config-assign assignments", exc)
         sys.exit(2)
 
@@ -296,8 +323,9 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
         """Helper function to list available recipes or cabs"""
         if available_recipes:
             log.info(f"available recipes: {' '.join(available_recipes)}")
-        if stimela.CONFIG.cabs:
-            log.info(f"available cabs: {' '.join(stimela.CONFIG.cabs.keys())}")
+        cab_names = stimela.config.cab_names()
+        if cab_names:
+            log.info(f"available cabs: {' '.join(cab_names)}")
 
     # figure out what we're running, recipe or cab
     recipe_name = cab_name = None
@@ -315,8 +343,8 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
         elif len(available_recipes) == 1:
             recipe_name = available_recipes[0]
             log.info(f"found single recipe '{recipe_name}', selecting it implicitly")
-        elif len(stimela.CONFIG.cabs) == 1 and not available_recipes:
-            cab_name = next(iter(stimela.CONFIG.cabs))
+        elif len(stimela.config.cab_names()) == 1 and not available_recipes:
+            cab_name = stimela.config.cab_names()[0]
             log.info(f"found single cab '{cab_name}', selecting it implicitly")
         else:
             log.error("found multiple recipes or cabs, please specify one on the command line")
@@ -326,11 +354,11 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
     elif recipe_or_cab in available_recipes:
         recipe_name = recipe_or_cab
         log.info(f"selected recipe is '{recipe_name}'")
-    elif recipe_or_cab in stimela.CONFIG.cabs:
+    elif stimela.config.has_cab(recipe_or_cab):
         cab_name = recipe_or_cab
         log.info(f"selected cab is '{cab_name}'")
     else:
-        if not available_recipes and not stimela.CONFIG.cabs:
+        if not available_recipes and not stimela.config.cab_names():
             log.error("no valid recipes or cabs were loaded")
         else:
             log.error(f"'{recipe_or_cab}' does not refer to a recipe or a cab")
@@ -372,6 +400,8 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
                 sys.exit(1)
 
     # else run a recipe
+    elif compiled is not None and compiled.recipe_name == recipe_name:
+        recipe = compiled.recipe
     else:
         # create recipe object from the config
         kwargs = dict(**stimela.CONFIG.lib.recipes[recipe_name])
@@ -397,6 +427,14 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
                 log.debug(line)
             sys.exit(1)
 
+        # cache the finalized recipe, before any parameters are assigned
+        if files_to_load and use_recipe_cache:
+            recipe_cache.save_compiled_recipe(files_to_load, recipe_cache_keys, 
+                recipe_cache.CompiledRecipe(config=stimela.CONFIG, cab_index=stimela.config.CAB_INDEX.copy(),
+                                            recipe_names=available_recipes, recipe_name=recipe_name, recipe=recipe),
+                log)
+
+    if cab_name is None:
         for key, value in params.items():
             try:
                 recipe.assign_value(key, value, override=True)
@@ -456,6 +494,30 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
         log.info("dry run was requested, exiting")
         sys.exit(0)
 
+    # set up the run journal, loading the previous one first if we're resuming
+    if cab_name is None and not build:
+        if resume is not None:
+            resume_path = journal.find_journal(resume) if resume else journal.find_previous_journal(logdir)
+            if resume_path is None:
+                log.error(f"--resume: no journal found {'at ' + resume if resume else 'next to ' + logdir}")
+                sys.exit(2)
+            try:
+                nsteps, niter = journal.load_journal(resume_path)
+            except OSError as exc:
+                log_exception(f"error reading journal {resume_path}", exc)
+                sys.exit(2)
+            log.info(f"resuming from {resume_path}: {nsteps} step(s) and {niter} scattered iteration(s) were completed")
+        journal.init_journal(logdir)
+    elif resume is not None:
+        log.warning("--resume only applies to recipes, ignoring")
+
+    # set up the worker budget shared by all scattered loops. This must happen before any worker processes are started
+    try:
+        scatter.init_worker_budget(int(stimela.CONFIG.opts.runtime.get('max_workers', 0) or 0))
+    except ValueError as exc:
+        log_exception("invalid opts.runtime.max_workers setting", exc)
+        sys.exit(2)
+
     start_time = datetime.now()
     def elapsed():
         return str(datetime.now() - start_time).split('.', 1)[0]
@@ -508,6 +570,7 @@ def run(parameters: List[str] = [], dump_config: bool = False, dry_run: bool = F
             outer_step.log.info(f"run successful after {elapsed()}")
 
     stimela.backends.close_backends(log)
+    scatter.shutdown_process_pool()
 
     if not build:
         task_stats.save_profiling_stats(outer_step.log,
@@ -2,7 +2,7 @@ import importlib
 import os, os.path, time, platform, traceback
 from typing import Any, List, Dict, Optional
 from dataclasses import dataclass, field
-from omegaconf.omegaconf import OmegaConf
+from omegaconf.omegaconf import OmegaConf, DictConfig
 from omegaconf.errors import OmegaConfBaseException
 from collections import OrderedDict
 import psutil
@@ -13,6 +13,7 @@ from stimela.exceptions import *
 from stimela import log_exception
 
 from scabha import configuratt
+from scabha.configuratt.common import pop_conf
 from scabha.basetypes import EmptyDictDefault, EmptyListDefault, EmptyClassDefault
 from stimela.backends import StimelaBackendOptions
 
@@ -87,13 +88,68 @@ CONFIG_DEPS = None
 STIMELA_DIR = os.path.dirname(stimela.__file__)
 
 
-def merge_extra_config(conf, newconf):
+# Cab definitions are not merged into the config (and checked against the Cab schema) as they're loaded, since
+# a recipe typically uses a handful out of all the cabs available. Instead, their (untyped) sections are indexed
+# by cab name, and merged into config.cabs when the cab is first looked up via get_cab_config(). 
+# This is a dict of cab_name: list of (source, section) tuples.
+CAB_INDEX = OrderedDict()
+
+
+def register_cabs(cabs: Dict[str, DictConfig], source: str):
+    """Adds cab definitions to the index. Later definitions of the same cab are merged on top of earlier ones."""
+    for name, section in (cabs.items_ex(resolve=False) if isinstance(cabs, DictConfig) else cabs.items()):
+        CAB_INDEX.setdefault(name, []).append((source, section))
+
+
+def get_cab_config(name: str, conf: Optional[DictConfig] = None) -> Optional[DictConfig]:
+    """Returns config section of the named cab (or None if there isn't one), merging any pending 
+    definitions from the index into conf.cabs (default is stimela.CONFIG) first"""
+    conf = stimela.CONFIG if conf is None else conf
+    for source, section in CAB_INDEX.pop(name, []):
+        try:
+            conf.cabs.merge_with({name: section})
+        except OmegaConfBaseException as exc:
+            raise ConfigError(f"error in definition of cab '{name}' (from {source})", exc)
+    return conf.cabs.get(name)
+
+
+def cab_names(conf: Optional[DictConfig] = None) -> List[str]:
+    """Returns names of all defined cabs, including those not yet looked up"""
+    conf = stimela.CONFIG if conf is None else conf
+    return list(conf.cabs.keys()) + [name for name in CAB_INDEX if name not in conf.cabs]
+
+
+def has_cab(name: str, conf: Optional[DictConfig] = None) -> bool:
+    conf = stimela.CONFIG if conf is None else conf
+    return name in CAB_INDEX or name in conf.cabs
+
+
+def cab_info(name: str, conf: Optional[DictConfig] = None) -> str:
+    """Returns the info string of the named cab, without having to look it up"""
+    conf = stimela.CONFIG if conf is None else conf
+    for _, section in reversed(CAB_INDEX.get(name, [])):
+        if section.get('info'):
+            return section.info
+    return conf.cabs[name].info if name in conf.cabs else ''
+
+
+def merge_config_settings(conf: DictConfig, update: DictConfig):
+    """Merges settings (e.g. from the command line) into the config, in place. Any cabs referred to are 
+    looked up first, so that the settings apply on top of the cab definitions."""
+    if 'cabs' in update:
+        for name in update.cabs:
+            get_cab_config(name, conf)
+    conf.merge_with(update)
+
+
+def merge_extra_config(conf, newconf, source: str = "config"):
     from stimela import logger
 
     if 'cabs' in newconf:
         for cab in newconf.cabs:
-            if cab in conf.cabs:
+            if has_cab(cab, conf):
                 logger().warning(f"changing definition of cab '{cab}'")
+        register_cabs(pop_conf(newconf, 'cabs'), source=source)
     return OmegaConf.unsafe_merge(conf, newconf)
 
 
@@ -181,16 +237,21 @@ def load_config(extra_configs: List[str], extra_dotlist: List[str] = [], include
 
     all_configs = base_configs + lib_configs + cab_configs + sys_configs + list(extra_configs)
 
-    conf, dependencies = configuratt.load_cache(all_configs, extra_keys=extra_cache_keys, verbose=verbose) 
+    # cache entries contain the config, along with the index of cabs that it defines. These are pickled, 
+    # so they're kept in the private cache
+    cached, dependencies = configuratt.load_cache(all_configs, extra_keys=extra_cache_keys, verbose=verbose,
+                                                  shared=False)
 
-    if conf is not None:
+    CAB_INDEX.clear()
+    if cached is not None:
+        conf, cab_index = cached
+        CAB_INDEX.update(cab_index)
         log.info("loaded full configuration from cache")
     else:
         log.info("loading configuration")
         dependencies = get_initial_deps()
 
         # start with empty structured config containing schema
-        cab_schema = OmegaConf.structured(Cab)
         opts_schema = OmegaConf.structured(StimelaOptions)
 
         StimelaConfigSchema = OmegaConf.structured(StimelaConfig)
@@ -208,11 +269,12 @@ def load_config(extra_configs: List[str], extra_dotlist: List[str] = [], include
             log_exception(ConfigError("error loading lib.params configuration", exc))
             return None
 
-        # merge all cab/*/*yaml files into the config, under cab.taskname
+        # index all cab/*/*yaml files by cab name, they are merged into conf.cabs on first use
         try:
-            conf.cabs, deps = configuratt.load_nested(cab_configs, use_sources=[conf], structured=cab_schema, 
-                                                        nameattr='name', include_path='_path', location='cabs', 
-                                                        use_cache=False, verbose=verbose)
+            cabs, deps = configuratt.load_nested(cab_configs, use_sources=[conf], 
+                                                    nameattr='name', include_path='_path', location='cabs', 
+                                                    use_cache=False, verbose=verbose)
+            register_cabs(cabs, source="cab library")
             dependencies.update(deps)
         except Exception as exc:
             if verbose:
@@ -228,7 +290,7 @@ def load_config(extra_configs: List[str], extra_dotlist: List[str] = [], include
             try:
                 newconf, deps = configuratt.load(config_file, use_sources=[conf], verbose=verbose, use_cache=False)
                 dependencies.update(deps)
-                conf = merge_extra_config(conf, newconf)
+                conf = merge_extra_config(conf, newconf, source=config_file)
                 if not CONFIG_LOADED:
                     CONFIG_LOADED = config_file
             except ConfigExceptionTypes as exc:
@@ -250,13 +312,14 @@ def load_config(extra_configs: List[str], extra_dotlist: List[str] = [], include
 
         # dependencies.replace((base_configs_glob, cab_configs_glob, lib_configs_glob), STIMELA_DIR)
 
-        configuratt.save_cache(all_configs, conf, dependencies, extra_keys=extra_cache_keys, verbose=verbose)
+        configuratt.save_cache(all_configs, (conf, CAB_INDEX.copy()), dependencies, extra_keys=extra_cache_keys, 
+                               verbose=verbose, shared=False)
 
     # add dotlist settings
     if extra_dotlist:
         try:
             dotlist_conf = OmegaConf.from_dotlist(extra_dotlist)
-            conf = OmegaConf.unsafe_merge(conf, dotlist_conf)
+            merge_config_settings(conf, dotlist_conf)
         except Exception as exc:
             if verbose:
                 traceback.print_exc()
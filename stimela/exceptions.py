@@ -51,6 +51,9 @@ class StimelaRuntimeError(StimelaBaseException):
 class StimelaCabRuntimeError(StimelaBaseException):
     pass
 
+class StimelaCabTimeoutError(StimelaCabRuntimeError):
+    pass
+
 class StimelaCabOutputError(StimelaBaseException):
     pass
 
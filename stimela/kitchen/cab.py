@@ -28,6 +28,11 @@ class CabManagement(object):        # defines common cab management behaviours
     cleanup: Optional[Dict[str, ListOrString]]     = EmptyDictDefault()   
     wranglers: Optional[Dict[str, ListOrString]]   = EmptyDictDefault()   
 
+@dataclass
+class ResourceRequirements(object):     # expected (peak) resource usage on the local node, used to admit scattered iterations
+    cores: Optional[float] = None       # number of CPU cores
+    mem_gb: Optional[float] = None      # memory, in GB
+
 @dataclass
 class ImageInfo(object):
     name: Optional[str] = None          # image name
@@ -111,6 +116,16 @@ class Cab(Cargo):
     # default parameter conversion policies
     policies: ParameterPolicies = EmptyClassDefault(ParameterPolicies)
 
+    # expected resource usage of the cab, used to decide how many scattered iterations can run at once
+    resources: ResourceRequirements = EmptyClassDefault(ResourceRequirements)
+
+    # wall-clock time limit (in seconds) for the command. If exceeded, the command is interrupted 
+    # (SIGINT, then SIGTERM and SIGKILL if it doesn't exit) and the step fails
+    timeout: Optional[float] = None
+
+    # likewise, but the command is interrupted if it goes this many seconds without producing any output
+    idle_output_timeout: Optional[float] = None
+
     def __post_init__ (self):
         Cargo.__post_init__(self)
         for param in self.inputs.keys():
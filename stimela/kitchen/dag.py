@@ -0,0 +1,213 @@
+import os.path, re, sys, pickle
+from typing import Any, Tuple, List, Set
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from omegaconf import ListConfig
+
+from stimela import task_stats
+from stimela.kitchen import scatter
+from stimela.exceptions import *
+from scabha.validate import evaluate_and_substitute, Unresolved
+from scabha.basetypes import MS, UNSET
+
+# scheduling modes for recipe steps
+SCHEDULE_SEQUENTIAL = "sequential"
+SCHEDULE_DAG = "dag"
+
+# matches references to step results (steps.label, recipe.steps.label) in substitutions and formulas
+_steps_ref = re.compile(r"\bsteps\.([\w-]+)")
+# matches references to the previous step
+_previous_ref = re.compile(r"\bprevious\b")
+
+
+def find_step_references(obj: Any, labels: List[str]) -> Tuple[Set[str], bool]:
+    """Scans (nested) strings in obj for references to step results.
+
+    Args:
+        obj (Any): object to scan (string, or mapping or sequence thereof)
+        labels (List[str]): known step labels
+
+    Returns:
+        Tuple[Set[str], bool]: set of referenced step labels, and True if "previous" is referenced
+    """
+    refs = set()
+    previous = False
+    if isinstance(obj, str):
+        for match in _steps_ref.finditer(obj):
+            token = match.group(1)
+            # labels may contain "-", which can also be a minus sign in a formula, so match on prefixes too
+            refs.update(label for label in labels
+                        if token == label or (token.startswith(label) and token[len(label)] == "-"))
+        previous = bool(_previous_ref.search(obj))
+    elif isinstance(obj, Mapping):
+        for value in obj.values():
+            refs1, previous1 = find_step_references(value, labels)
+            refs |= refs1
+            previous = previous or previous1
+    elif isinstance(obj, (list, tuple, ListConfig)):
+        for value in obj:
+            refs1, previous1 = find_step_references(value, labels)
+            refs |= refs1
+            previous = previous or previous1
+    return refs, previous
+
+
+def _normalize_path(path: str):
+    return os.path.normpath(os.path.abspath(os.path.expanduser(path)))
+
+
+def _paths_overlap(a: Set[str], b: Set[str]):
+    """True if any path in a is the same as, or is nested in, a path in b (or vice versa)"""
+    for x in a:
+        for y in b:
+            if x == y or x.startswith(y + os.sep) or y.startswith(x + os.sep):
+                return True
+    return False
+
+
+@dataclass
+class StepFiles(object):
+    """Describes the files read and written by a step"""
+    reads: Set[str]
+    writes: Set[str]
+    # if False, file usage could not be determined, so the step is treated as depending on everything
+    known: bool = True
+
+
+def resolve_step_files(step, subst) -> StepFiles:
+    """Resolves the file-type parameters of a step, in preparation for running it.
+
+    Uses the current values of the substitution namespace (as set up for the step by the recipe),
+    so this must be called at the point where the step would otherwise be run.
+
+    Args:
+        step (Step): step object
+        subst (SubstitutionNS): substitution namespace
+
+    Returns:
+        StepFiles: file usage of the step
+    """
+    params = step.params.copy()
+    if step.validated_params:
+        params.update([(key, value) for key, value in step.validated_params.items() if key not in params])
+    # add implicit parameters, since these are often how output products are named
+    file_params = OrderedDict()
+    for name, schema in step.inputs_outputs.items():
+        if schema.is_file_type or schema.is_file_list_type:
+            if type(schema.implicit) is str:
+                file_params[name] = schema.implicit
+            elif name in params:
+                file_params[name] = params[name]
+    try:
+        file_params = evaluate_and_substitute(file_params, subst, None,
+                                              location=[step.fqname], ignore_subst_errors=True)
+    except Exception:
+        return StepFiles(set(), set(), known=False)
+
+    reads, writes = set(), set()
+    for name, value in file_params.items():
+        schema = step.inputs_outputs[name]
+        if value is UNSET or value is None:
+            continue
+        values = value if schema.is_file_list_type else [value]
+        if isinstance(values, Unresolved) or not isinstance(values, (list, tuple)) or \
+                not all(type(x) is not Unresolved and isinstance(x, str) for x in values):
+            return StepFiles(set(), set(), known=False)
+        paths = set(_normalize_path(x) for x in values)
+        # outputs and writable inputs are treated as writes. MSs are routinely modified in place
+        # (flagging, calibration) without being marked as such, so treat them as writes too
+        if schema.is_output or schema.writable or schema._dtype in (MS, List[MS]):
+            writes.update(paths)
+        else:
+            reads.update(paths)
+    return StepFiles(reads, writes)
+
+
+class StepGraph(object):
+    """Tracks dependencies between the steps of a recipe, for concurrent scheduling.
+
+    There are two kinds of dependencies:
+
+    * "prep" dependencies must have completed before a step can be prepared for running (i.e. before its
+      assignments are evaluated, and its parameters resolved). These arise from explicit references to
+      other steps ("steps.X" and "previous"), and from assignments, which act as barriers since they
+      have side effects on the recipe namespace.
+
+    * "file" dependencies must have completed before a prepared step can run. These are determined from
+      the resolved file-type parameters: a step depends on any earlier step that writes something it reads,
+      reads something it writes, or writes the same thing.
+
+    Steps are always prepared in recipe order, so dependencies are only ever on earlier steps.
+    """
+    def __init__(self, recipe):
+        self.labels = list(recipe.steps.keys())
+        self.files = OrderedDict()
+        self.prep_deps = OrderedDict()
+        # recipe-level assignments are re-evaluated before every step, so anything they refer to
+        # becomes a dependency of every subsequent step
+        recipe_refs, recipe_previous = find_step_references([recipe.assign, recipe.assign_based_on], self.labels)
+        barriers = set()
+        for num, (label, step) in enumerate(recipe.steps.items()):
+            earlier = self.labels[:num]
+            refs, previous = find_step_references([step.params, step.skip, step.assign, step.assign_based_on],
+                                                  self.labels)
+            refs |= recipe_refs
+            if (previous or recipe_previous) and earlier:
+                refs.add(earlier[-1])
+            # steps with their own assignments wait for everything before them, and everything after waits for them
+            if step.assign or step.assign_based_on:
+                refs.update(earlier)
+            refs.update(barriers)
+            if step.assign or step.assign_based_on:
+                barriers.add(label)
+            # forward references can't be honoured in any case, so ignore them
+            self.prep_deps[label] = refs.intersection(earlier)
+
+    def add_files(self, label: str, files: StepFiles):
+        """Records the resolved file usage of a step"""
+        self.files[label] = files
+
+    def file_deps(self, label: str) -> Set[str]:
+        """Returns set of earlier steps which must complete before the given step can run.
+        The given step, and all steps before it, must have been added via add_files()."""
+        files = self.files[label]
+        deps = set()
+        for other in self.labels[:self.labels.index(label)]:
+            other_files = self.files[other]
+            if not files.known or not other_files.known or \
+                    _paths_overlap(files.reads, other_files.writes) or \
+                    _paths_overlap(files.writes, other_files.reads) or \
+                    _paths_overlap(files.writes, other_files.writes):
+                deps.add(other)
+        return deps
+
+
+def run_step_worker(payload: bytes, thread_state, subprocess_id: str, held: bool = False):
+    """Runs a step inside a (possibly reused) worker process. The payload is a pickle of the step, backend settings,
+    substitution namespace and parent logger, made at the time the step was dispatched. thread_state is the
+    result of task_stats.get_thread_state(picklable=True), as called by the parent. If held is True,
+    the recipe is running inside a scatter iteration, so the step may use its worker slot (see scatter.py).
+
+    Returns tuple of step parameters, (task stats, task outcomes), exception, traceback.
+    """
+    task_stats.init_worker_process(thread_state[0], subprocess_id, thread_state[2])
+    scatter.set_holds_slot(held)
+    return _run_step_payload(payload, subprocess_id)
+
+
+def run_step_thread(payload: bytes, thread_state, subprocess_id: str, held: bool = False):
+    """Like run_step_worker(), but runs the step inside a worker thread. This is used when the recipe 
+    is itself running in a worker thread (see scatter.py), since forking a multi-threaded process is unsafe."""
+    with scatter.worker_thread_context(thread_state, subprocess_id, held=held):
+        return _run_step_payload(payload, subprocess_id)
+
+
+def _run_step_payload(payload: bytes, subprocess_id: str):
+    step, backend, subst, parent_log = pickle.loads(payload)
+    subst.info.subprocess = subprocess_id
+    try:
+        params = step.run(backend=backend, subst=subst, parent_log=parent_log)
+    except Exception as exc:
+        return None, (task_stats.collect_stats(), task_stats.collect_outcomes()), exc, FormattedTraceback(sys.exc_info()[2])
+    return params, (task_stats.collect_stats(), task_stats.collect_outcomes()), None, None
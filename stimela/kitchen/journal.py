@@ -0,0 +1,119 @@
+import os, os.path, glob, json, time, threading
+from typing import Any, Dict, Optional
+
+# The run journal is an append-only file in the log directory, with one JSON record per line. It records every
+# step that completes (keyed by task name, e.g. "recipe.3.step", which includes the loop iteration), along with
+# its parameters, and the outcome of every scattered loop iteration. A subsequent "stimela run --resume" reads
+# the journal back, restores the parameters of completed steps rather than re-running them, and skips
+# scattered iterations that have already completed.
+#
+# Records are written by whichever process completes the step (worker processes included), by opening the file
+# in append mode and writing each record in one go, so no further coordination between processes is needed.
+
+JOURNAL_FILENAME = "stimela.journal"
+
+_journal_path = None
+_journal_lock = threading.Lock()
+
+# records loaded from a previous run's journal, when resuming
+_resumed_steps = {}
+_resumed_iterations = {}
+
+
+def find_journal(path: str) -> Optional[str]:
+    """Resolves path (a journal file, or a log directory containing one) to a journal file, or None"""
+    if os.path.isdir(path):
+        path = os.path.join(path, JOURNAL_FILENAME)
+    return path if os.path.isfile(path) else None
+
+
+def find_previous_journal(logdir: str) -> Optional[str]:
+    """Finds the most recent journal in this log directory or its sibling directories (log directories
+    are usually named by date and time), or None if there isn't one"""
+    logdir = logdir.rstrip("/") or "."
+    candidates = [os.path.join(logdir, JOURNAL_FILENAME)]
+    candidates += glob.glob(os.path.join(os.path.dirname(logdir) or ".", "*", JOURNAL_FILENAME))
+    candidates = [path for path in candidates if os.path.isfile(path)]
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)
+
+
+def load_journal(path: str):
+    """Loads the records of a previous run's journal, for resuming. Unparseable lines (e.g. one
+    left incomplete by a crash) are ignored. Returns number of completed steps and iterations found."""
+    _resumed_steps.clear()
+    _resumed_iterations.clear()
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") == "step":
+                _resumed_steps[record["task"]] = record["params"]
+            elif record.get("event") == "iteration":
+                completed = _resumed_iterations.setdefault(record["task"], {})
+                if record["success"]:
+                    completed[record["index"]] = record.get("outputs", {})
+                else:
+                    completed.pop(record["index"], None)
+    return len(_resumed_steps), sum(len(completed) for completed in _resumed_iterations.values())
+
+
+def init_journal(logdir: str):
+    """Starts a new journal in the given log directory. Any existing journal there is truncated, so
+    a previous journal that is to be resumed from must be loaded first."""
+    global _journal_path
+    os.makedirs(logdir, exist_ok=True)
+    _journal_path = os.path.join(logdir, JOURNAL_FILENAME)
+    open(_journal_path, "w").close()
+    return _journal_path
+
+
+def _write_record(**record):
+    if _journal_path is None:
+        return
+    record["time"] = time.time()
+    line = json.dumps(record) + "\n"
+    with _journal_lock:
+        fd = os.open(_journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+
+def _jsonable(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns those parameters that can be stored in the journal as-is. Placeholders for
+    unset or skipped values are dropped."""
+    result = {}
+    for name, value in params.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        result[name] = value
+    return result
+
+
+def record_step(taskname: str, params: Dict[str, Any]):
+    """Records a completed step"""
+    _write_record(event="step", task=taskname, params=_jsonable(params))
+
+
+def record_iteration(taskname: str, index: int, success: bool, outputs: Dict[str, Any] = {}):
+    """Records the outcome of a scattered loop iteration, along with its outputs"""
+    _write_record(event="iteration", task=taskname, index=index, success=success, outputs=_jsonable(outputs))
+
+
+def completed_step(taskname: str) -> Optional[Dict[str, Any]]:
+    """If we're resuming, and the step was completed by the previous run, returns its parameters, else None"""
+    params = _resumed_steps.get(taskname)
+    return None if params is None else dict(params)
+
+
+def completed_iterations(taskname: str) -> Dict[int, Dict[str, Any]]:
+    """If we're resuming, returns the scattered loop iterations completed by the previous run,
+    as a dict of index: outputs"""
+    return _resumed_iterations.get(taskname, {})
@@ -1,4 +1,4 @@
-import os, os.path, re, fnmatch, copy, traceback, logging
+import os, os.path, re, fnmatch, copy, traceback, logging, time
 from typing import Any, Tuple, List, Dict, Optional, Union
 from dataclasses import dataclass
 from omegaconf import MISSING, OmegaConf, DictConfig, ListConfig
@@ -7,12 +7,13 @@ from collections import OrderedDict
 from collections.abc import Mapping
 import rich.table
 
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import pickle
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, BrokenExecutor
 
 from stimela.config import EmptyDictDefault, EmptyListDefault
 import stimela
 from stimela import log_exception, stimelogging
-from stimela.stimelogging import log_rich_payload
+from stimela.stimelogging import log_rich_payload, log_option_unchanged
 from stimela.exceptions import *
 
 from scabha.validate import evaluate_and_substitute, evaluate_and_substitute_object, Unresolved, join_quote
@@ -26,6 +27,10 @@ from stimela import task_stats
 from stimela import backends
 from stimela.backends import StimelaBackendSchema
 from stimela.kitchen.utils import keys_from_sel_string
+from stimela.kitchen import dag, scatter, journal
+from stimela.kitchen.dag import SCHEDULE_SEQUENTIAL, SCHEDULE_DAG
+from stimela.kitchen.scatter import ScatterExecutor, LoopAdmission, SCATTER_PROCESS, SCATTER_ENGINES, \
+                                    ON_FAILURE_CONTINUE, ON_FAILURE_FAIL_FAST, ON_FAILURE_POLICIES
 
 
 class DeferredAlias(Unresolved):
@@ -42,14 +47,41 @@ class ForLoopClause(object):
     # If !=0 , this is a scatter not a loop -- things may be evaluated in parallel using this many workers
     # (use -1 to scatter to unlimited number of workers)
     scatter: int = 0
+    # How scattered iterations are run: "process" (in worker processes), "thread" (in worker threads), 
+    # or "asyncio" (as coroutines on an event loop)
+    engine: str = SCATTER_PROCESS
+    # Number of consecutive scattered iterations to run per worker task (0 picks a chunk size automatically).
+    # Larger chunks cut down on per-task overheads when there are many short iterations.
+    chunk_size: int = 1
+    # What to do when a scattered iteration fails: "continue" runs the remaining iterations regardless (the loop 
+    # then fails at the end), "fail_fast" cancels queued iterations and interrupts running ones
+    on_failure: str = ON_FAILURE_CONTINUE
+    # Number of times a failed scattered iteration is retried before it counts as failed
+    retry: int = 0
+    # Delay before the first retry of an iteration, in seconds. Subsequent retries double the delay.
+    retry_backoff: float = 10
     # How to indicate the status of the loop on the console.
     # Default is "i/N", where i is the current index plus 1, and N is the total number of loops. 
     # A format string can be supplied instead.
     display_status: Optional[str] = None
 
+@dataclass
+class ScheduleClause(object):
+    # "sequential" runs steps one after the other, in order. "dag" infers dependencies between steps from
+    # their file-type parameters and from references to other steps, and runs independent steps concurrently
+    mode: str = SCHEDULE_SEQUENTIAL
+    # Max number of steps to run concurrently in "dag" mode (use -1 for no limit)
+    workers: int = -1
+
 def IterantPlaceholder(name: str):
     return name
 
+def _is_timeout(exc: Exception) -> bool:
+    """True if the exception was caused by a cab exceeding its time limits"""
+    if isinstance(exc, StimelaCabTimeoutError):
+        return True
+    return any(_is_timeout(nested) for nested in getattr(exc, 'nested', None) or [] if isinstance(nested, Exception))
+
 @dataclass
 class Recipe(Cargo):
     """Represents a sequence of steps.
@@ -76,6 +108,9 @@ class Recipe(Cargo):
     # make recipe a for_loop-gather (i.e. parallel for loop)
     for_loop: Optional[ForLoopClause] = None
 
+    # how steps are scheduled (sequentially by default)
+    schedule: Optional[ScheduleClause] = None
+
     def __post_init__ (self):
         Cargo.__post_init__(self)
         # flatten aliases and assignments
@@ -117,11 +152,24 @@ class Recipe(Cargo):
             for io, io_label in [(self.inputs, "input"), (self.outputs, "output")]:
                 if self.for_loop.var in io:
                     raise RecipeValidationError(f"recipe '{self.name}': for_loop.var={self.for_loop.var} clashes with an {io_label} parameter")
+            if self.for_loop.engine not in SCATTER_ENGINES:
+                raise RecipeValidationError(f"recipe '{self.name}': invalid for_loop.engine={self.for_loop.engine}")
+            if self.for_loop.chunk_size < 0:
+                raise RecipeValidationError(f"recipe '{self.name}': invalid for_loop.chunk_size={self.for_loop.chunk_size}")
+            if self.for_loop.on_failure not in ON_FAILURE_POLICIES:
+                raise RecipeValidationError(f"recipe '{self.name}': invalid for_loop.on_failure={self.for_loop.on_failure}")
+            if self.for_loop.retry < 0 or self.for_loop.retry_backoff < 0:
+                raise RecipeValidationError(f"recipe '{self.name}': invalid for_loop.retry={self.for_loop.retry} "
+                                            f"or for_loop.retry_backoff={self.for_loop.retry_backoff}")
+        # check scheduling mode
+        if self.schedule and self.schedule.mode not in (SCHEDULE_SEQUENTIAL, SCHEDULE_DAG):
+            raise RecipeValidationError(f"recipe '{self.name}': invalid schedule.mode={self.schedule.mode}")
         # marked when finalized
         self._alias_map  = None
         # set of keys protected from assignment
         self._protected_from_assign = set()
-        self._for_loop_values = self._for_loop_scatter = None
+        self._for_loop_values = self._for_loop_scatter = self._for_loop_engine = self._for_loop_chunk_size = None
+        self._for_loop_on_failure = self._for_loop_retry = self._for_loop_retry_backoff = None
         # process pool used to run for-loops
         self._loop_pool = None
 
@@ -186,7 +234,8 @@ class Recipe(Cargo):
             subst.recipe._merge_(flattened)
             # perform substitutions
             try:
-                flattened = evaluate_and_substitute(flattened, subst, subst.recipe, location=[whose.fqname], ignore_subst_errors=True)
+                flattened = evaluate_and_substitute(flattened, subst, subst.recipe, location=[whose.fqname], ignore_subst_errors=True,
+                                                    memoize=True)
             except Exception as exc:
                 raise AssignmentError(f"{whose.fqname}: error evaluating assignments", exc)
             assign.update(flattened)
@@ -240,7 +289,8 @@ class Recipe(Cargo):
 
         # do final round of substitutions
         try:
-            assign = evaluate_and_substitute(assign, subst, subst.recipe, location=[whose.fqname], ignore_subst_errors=ignore_subst_errors)
+            assign = evaluate_and_substitute(assign, subst, subst.recipe, location=[whose.fqname], ignore_subst_errors=ignore_subst_errors,
+                                             memoize=True)
         except Exception as exc:
             raise AssignmentError(f"{whose.fqname}: error evaluating assignments", exc)
         # dispatch and reassign, since substitutions may have been performed
@@ -307,6 +357,9 @@ class Recipe(Cargo):
 
     def update_log_options(self, **options):
         for setting, value in options.items():
+            # assignments are re-evaluated for every step, so most of the time the setting is unchanged
+            if log_option_unchanged(self.logopts, setting, value):
+                continue
             try:
                 self.logopts[setting] = value
             except Exception as exc:
@@ -709,6 +762,19 @@ class Recipe(Cargo):
                 # if self.for_loop.var not in self.assign:
                 #     self.assign[self.for_loop.var] = ""
 
+    def restore_loggers(self, toplevel=True):
+        """Re-establishes logger settings of a finalized recipe that has been unpickled (see recipe_cache), 
+        since loggers are pickled by name only. This repeats what finalize() does to the loggers of the recipe
+        and its steps."""
+        if toplevel:
+            self.log.propagate = True
+        logsubst = SubstitutionNS(config=self.config, info=dict(fqname=self.fqname, taskname=self.fqname))
+        stimelogging.update_file_logger(self.log, self.logopts, nesting=self.nesting, subst=logsubst, location=[self.fqname])
+        for step in self.steps.values():
+            step.log.propagate = False
+            if isinstance(step.cargo, Recipe):
+                step.cargo.restore_loggers(toplevel=False)
+
     def _prep_step(self, label, step, subst):
         parts = label.split("-")
         info = subst.info
@@ -912,6 +978,32 @@ class Recipe(Cargo):
                 raise ParameterValidationError(f"for_loop.scattter={scatter}: bool or int expected")
             self._for_loop_scatter = scatter
 
+            # get scatter engine
+            engine = params.get('for_loop.engine', self.for_loop.engine)
+            if engine not in SCATTER_ENGINES:
+                raise ParameterValidationError(f"for_loop.engine={engine}: one of {', '.join(SCATTER_ENGINES)} expected")
+            self._for_loop_engine = engine
+
+            # get chunk size
+            chunk_size = params.get('for_loop.chunk_size', self.for_loop.chunk_size)
+            if type(chunk_size) is not int or chunk_size < 0:
+                raise ParameterValidationError(f"for_loop.chunk_size={chunk_size}: non-negative int expected")
+            self._for_loop_chunk_size = chunk_size
+
+            # get failure policy and number of retries
+            on_failure = params.get('for_loop.on_failure', self.for_loop.on_failure)
+            if on_failure not in ON_FAILURE_POLICIES:
+                raise ParameterValidationError(f"for_loop.on_failure={on_failure}: one of {', '.join(ON_FAILURE_POLICIES)} expected")
+            self._for_loop_on_failure = on_failure
+            retry = params.get('for_loop.retry', self.for_loop.retry)
+            if type(retry) is not int or retry < 0:
+                raise ParameterValidationError(f"for_loop.retry={retry}: non-negative int expected")
+            self._for_loop_retry = retry
+            retry_backoff = params.get('for_loop.retry_backoff', self.for_loop.retry_backoff)
+            if type(retry_backoff) not in (int, float) or retry_backoff < 0:
+                raise ParameterValidationError(f"for_loop.retry_backoff={retry_backoff}: non-negative number expected")
+            self._for_loop_retry_backoff = retry_backoff
+
             # the over list can be in the for_loop clause, or in inputs
             if 'for_loop.over' in params:
                 values = params['for_loop.over']
@@ -1052,6 +1144,214 @@ class Recipe(Cargo):
                 alias.step.update_parameter(alias.param, value)
 
 
+    def _pre_step(self, label, step, subst, params, taskname):
+        """Prepares the namespace and assignments for running a step"""
+        # update step info
+        self._prep_step(label, step, subst)
+        subst.info.taskname = f"{taskname}.{label}"
+        # reevaluate recipe level assignments (info.fqname etc. have changed)
+        self.update_assignments(subst, params=params)
+        # evaluate step-level assignments
+        self.update_assignments(subst, whose=step, params=params)
+        # step logger may have changed
+        stimelogging.update_file_logger(step.log, step.logopts, nesting=step.nesting, subst=subst, location=[step.fqname])
+        # set our info back temporarily to update log assignments
+
+        ## OMS: note to self, I had this here but not sure why. Seems like a no-op. Something with logname fiddling.
+        ## Leave as a puzzle to future self for a bit. Remove info from args.
+        # info_step = subst.info
+        # subst.info = info.copy()
+        # subst.info = info_step
+
+        if step.skip is True:
+            self.log.debug(f"step '{label}' will be explicitly skipped")
+        else:
+            self.log.info(f"processing step '{label}'")
+            if step.info:
+                self.log.info(f"  ({step.info})", extra=dict(color="GREEN", boldface=True))
+
+    def _step_failed(self, step, exc):
+        """Wraps up exception raised by a step"""
+        newexc = StimelaStepExecutionError(f"step '{step.fqname}' has failed, aborting the recipe", exc)
+        if not exc.logged:
+            log_exception(newexc, log=step.log)
+        return newexc
+
+    def _run_step(self, step, backend_settings, subst):
+        """Runs a step that has been prepared by _pre_step(). If we're resuming a run, and the step
+        was completed previously, its parameters are restored from the journal instead."""
+        taskname = subst.info.taskname
+        explicit_skip = step.skip is True or step._skip is True
+        if not explicit_skip:
+            step_params = journal.completed_step(taskname)
+            if step_params is not None:
+                self.log.info(f"step '{step.name}' was completed by a previous run, restoring its parameters")
+                if step.validated_params is not None:
+                    step.validated_params.update(**step_params)
+                journal.record_step(taskname, step_params)
+                return step_params
+        # don't start anything new if a loop we're running under has been cancelled
+        if task_stats.is_cancelled():
+            raise StimelaRuntimeError(f"step '{step.name}' not started, since the loop was cancelled")
+        try:
+            #step_params = step.run(subst=subst.copy(), batch=batch)  # make a copy of the subst dict since recipe might modify
+            step_params = step.run(backend=backend_settings, subst=subst.copy(), parent_log=self.log)  # make a copy of the subst dict since recipe might modify
+        except ScabhaBaseException as exc:
+            raise self._step_failed(step, exc)
+        if not explicit_skip:
+            journal.record_step(taskname, step_params)
+        return step_params
+
+    def _post_step(self, label, step, step_params, subst, params, outputs):
+        """Updates namespace and output aliases after a step has been run"""
+        # put step parameters into previous and steps[label] again, as they may have changed based on outputs)
+        subst.previous = step_params
+        subst.steps[label] = subst.previous
+        # revert to recipe level assignments
+
+        # now check for output aliases that need to be propagated down from steps
+        self.update_assignments(subst, whose=self, params=params)
+        for name, aliases in self._alias_list.items():
+            for alias in aliases:
+                if alias.from_step and alias.step is step:
+                    # if step was skipped, mark output as not required
+                    if alias.step._skip:
+                        self.outputs[name].required = False
+                    # if step output is validated, add it to our output 
+                    # if alias.param in alias.step.validated_params:
+                    #     outputs[name] = alias.step.validated_params[alias.param]
+                    if alias.param in step_params:
+                        outputs[name] = step_params[alias.param]
+
+    def get_resources(self):
+        """Returns expected peak (cores, mem_gb) usage of one iteration of the recipe, based on the
+        resources declared by its steps"""
+        # steps run one at a time, unless they're scheduled concurrently
+        concurrent = self.schedule is not None and self.schedule.mode == SCHEDULE_DAG
+        cores = mem_gb = 0
+        for step in self.steps.values():
+            if step._skip is True:
+                continue
+            step_cores, step_mem_gb = step.get_resources()
+            if concurrent:
+                cores, mem_gb = cores + step_cores, mem_gb + step_mem_gb
+            else:
+                cores, mem_gb = max(cores, step_cores), max(mem_gb, step_mem_gb)
+        return cores, mem_gb
+
+    def _run_steps_dag(self, params, subst, backend_settings, taskname, outputs):
+        """Runs steps concurrently, as permitted by the dependency graph.
+
+        Steps are prepared (see _pre_step()) in recipe order, as soon as the steps they refer to have completed.
+        Each prepared step is then dispatched to a worker process once the steps it shares files with have completed,
+        and the session-wide worker budget admits it (see scatter.py). Explicitly skipped steps are run directly.
+        """
+        graph = dag.StepGraph(self)
+        labels = list(self.steps.keys())
+        nsteps = len(labels)
+        num_workers = self.schedule.workers if self.schedule.workers > 0 else nsteps
+        subprocess_id = task_stats.get_subprocess_id()
+
+        done = set()
+        waiting = OrderedDict()     # label -> (payload, dependencies) for steps prepared but not yet dispatched
+        running = {}                # future -> label for steps dispatched to workers
+        errors = []
+        cursor = 0
+
+        def report_status():
+            status = f"[green]{len(done)}[/green]/{nsteps} steps complete, {len(running)} running"
+            if errors:
+                status = f"{status}, [red]{len(errors)}[/red] failed"
+            task_stats.declare_subtask_status(status)
+
+        # steps may run scatters of their own, which can make use of our worker slot, if we have one
+        held = scatter.holds_slot()
+        num_workers = min(num_workers, nsteps)
+        # worker threads (see scatter.py) can't safely fork, so they run steps in threads
+        if task_stats.in_worker_thread():
+            pool = ThreadPoolExecutor(num_workers)
+            submit = lambda payload, subprocess_id: pool.submit(dag.run_step_thread, payload, 
+                                                                task_stats.get_thread_state(), subprocess_id, held)
+        # else steps go to the session-wide process pool, same as scattered loops
+        else:
+            pool = None
+            submit = lambda payload, subprocess_id: scatter.get_process_pool(num_workers).submit(dag.run_step_worker, 
+                                            payload, task_stats.get_thread_state(picklable=True), subprocess_id, held)
+
+        try:
+            with scatter.LoopAdmission(num_workers) as admission:
+                while True:
+                    # prepare steps in order, for as long as their prep dependencies are satisfied
+                    while not errors and cursor < nsteps and graph.prep_deps[labels[cursor]] <= done:
+                        label = labels[cursor]
+                        step = self.steps[label]
+                        # previous step may not have been run yet (if we don't depend on it), in which case
+                        # this gives its prevalidated parameters
+                        if cursor:
+                            subst.previous = subst.steps[labels[cursor - 1]]
+                        self._pre_step(label, step, subst, params, taskname)
+                        # explicitly skipped steps don't touch any files, and neither do steps completed by a
+                        # previous run that we're resuming, so run them directly
+                        if step.skip is True or step._skip is True or journal.completed_step(subst.info.taskname) is not None:
+                            graph.add_files(label, dag.StepFiles(set(), set()))
+                            step_params = self._run_step(step, backend_settings, subst)
+                            self._post_step(label, step, step_params, subst, params, outputs)
+                            done.add(label)
+                        else:
+                            graph.add_files(label, dag.resolve_step_files(step, subst))
+                            # pickle the current state, since the namespace will be modified by subsequent steps
+                            payload = pickle.dumps((step, backend_settings, subst.copy(), self.log))
+                            waiting[label] = payload, graph.file_deps(label)
+                        cursor += 1
+                    # dispatch steps whose dependencies have completed, as and when the worker budget admits them
+                    ready = [] if errors else [label for label, (_, deps) in waiting.items() if deps <= done]
+                    while ready and admission.try_admit():
+                        label = ready.pop(0)
+                        self.log.debug(f"dispatching step '{label}'")
+                        payload, _ = waiting.pop(label)
+                        running[submit(payload, f"{subprocess_id}.{labels.index(label)}")] = label
+                    report_status()
+                    if not running and not ready:
+                        break
+                    # wait for something to complete, checking back periodically if anything is waiting for admission
+                    completed, _ = wait(running, return_when=FIRST_COMPLETED, 
+                                        timeout=admission.poll_interval if ready else None)
+                    for future in completed:
+                        admission.release()
+                        label = running.pop(future)
+                        step = self.steps[label]
+                        try:
+                            step_params, stats, exc, tb = future.result()
+                        except Exception as exc1:
+                            # the worker process died (e.g. was OOM-killed), breaking the pool, which
+                            # scatter.get_process_pool() will replace when next called
+                            step_params, stats, exc, tb = None, ({}, {}), exc1, FormattedTraceback(exc1.__traceback__)
+                        task_stats.add_missing_stats(*stats)
+                        if exc is not None:
+                            if isinstance(exc, ScabhaBaseException):
+                                errors.append(self._step_failed(step, exc))
+                            else:
+                                errors.append(StimelaStepExecutionError(f"step '{step.fqname}' has failed, aborting the recipe", 
+                                                                        [exc, tb], log=step.log))
+                            continue
+                        if step.validated_params is not None:
+                            step.validated_params.update(**step_params)
+                        journal.record_step(f"{taskname}.{label}", step_params)
+                        self._post_step(label, step, step_params, subst, params, outputs)
+                        done.add(label)
+                        self.log.debug(f"step '{label}' has completed")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if errors:
+            raise errors[0]
+        # this shouldn't happen, since steps only ever depend on earlier steps, but just in case
+        if len(done) != nsteps:
+            raise StimelaRuntimeError(f"recipe '{self.name}': {nsteps - len(done)} steps could not be scheduled")
+        # leave the namespace in the same state as after a sequential run
+        subst.previous = subst.steps[labels[-1]]
+
     def _iterate_loop_worker(self, params, subst, backend_settings, count, iter_var, subprocess=False, raise_exc=True):
         """"
         Needed for concurrency
@@ -1100,57 +1400,13 @@ class Recipe(Cargo):
                 from contextlib import nullcontext
                 context = nullcontext()
             with context: 
-                for label, step in self.steps.items():
-                    # update step info
-                    self._prep_step(label, step, subst)
-                    subst.info.taskname = f"{taskname}.{label}"
-                    # reevaluate recipe level assignments (info.fqname etc. have changed)
-                    self.update_assignments(subst, params=params)
-                    # evaluate step-level assignments
-                    self.update_assignments(subst, whose=step, params=params)
-                    # step logger may have changed
-                    stimelogging.update_file_logger(step.log, step.logopts, nesting=step.nesting, subst=subst, location=[step.fqname])
-                    # set our info back temporarily to update log assignments
-
-                    ## OMS: note to self, I had this here but not sure why. Seems like a no-op. Something with logname fiddling.
-                    ## Leave as a puzzle to future self for a bit. Remove info from args.
-                    # info_step = subst.info
-                    # subst.info = info.copy()
-                    # subst.info = info_step
-
-                    if step.skip is True:
-                        self.log.debug(f"step '{label}' will be explicitly skipped")
-                    else:
-                        self.log.info(f"processing step '{label}'")
-                        if step.info:
-                            self.log.info(f"  ({step.info})", extra=dict(color="GREEN", boldface=True))
-                    try:
-                        #step_params = step.run(subst=subst.copy(), batch=batch)  # make a copy of the subst dict since recipe might modify
-                        step_params = step.run(backend=backend_settings, subst=subst.copy(), parent_log=self.log)  # make a copy of the subst dict since recipe might modify
-                    except ScabhaBaseException as exc:
-                        newexc = StimelaStepExecutionError(f"step '{step.fqname}' has failed, aborting the recipe", exc)
-                        if not exc.logged:
-                            log_exception(newexc, log=step.log)
-                        raise newexc
-
-                    # put step parameters into previous and steps[label] again, as they may have changed based on outputs)
-                    subst.previous = step_params
-                    subst.steps[label] = subst.previous
-                    # revert to recipe level assignments
-
-                    # now check for output aliases that need to be propagated down from steps
-                    self.update_assignments(subst, whose=self, params=params)
-                    for name, aliases in self._alias_list.items():
-                        for alias in aliases:
-                            if alias.from_step and alias.step is step:
-                                # if step was skipped, mark output as not required
-                                if alias.step._skip:
-                                    self.outputs[name].required = False
-                                # if step output is validated, add it to our output 
-                                # if alias.param in alias.step.validated_params:
-                                #     outputs[name] = alias.step.validated_params[alias.param]
-                                if alias.param in step_params:
-                                    outputs[name] = step_params[alias.param]
+                if self.schedule and self.schedule.mode == SCHEDULE_DAG:
+                    self._run_steps_dag(params, subst, backend_settings, taskname, outputs)
+                else:
+                    for label, step in self.steps.items():
+                        self._pre_step(label, step, subst, params, taskname)
+                        step_params = self._run_step(step, backend_settings, subst)
+                        self._post_step(label, step, step_params, subst, params, outputs)
 
         except Exception as exc:
             # raise exception up if asked to
@@ -1160,7 +1416,10 @@ class Recipe(Cargo):
             exception = exc
             tb = FormattedTraceback(sys.exc_info()[2])
 
-        return task_attrs, task_kwattrs, task_stats.collect_stats(), outputs, exception, tb
+        # worker processes pass their stats back to the parent, while threads and sequential iterations
+        # update the parent's stats directly
+        stats = (task_stats.collect_stats(), task_stats.collect_outcomes()) if subprocess else ({}, {})
+        return task_attrs, task_kwattrs, stats, outputs, exception, tb
 
     def build(self, backend={}, rebuild=False, build_skips=False, log: Optional[logging.Logger] = None):
         # set up backend
@@ -1249,45 +1508,166 @@ class Recipe(Cargo):
             loop_worker_args = []
             for count, iter_var in enumerate(self._for_loop_values):
                 loop_worker_args.append((params, subst, backend, count, iter_var))
+            # outputs of the last iteration to run (there may be none, if all were completed by a resumed run)
+            outputs = {}
 
-            # if scatter is enabled, use a process pool
+            # if scatter is enabled, use a pool of workers
             if self._for_loop_scatter:
                 nloop = len(loop_worker_args)
+                # if resuming, skip iterations completed by the previous run
+                resumed = journal.completed_iterations(taskname)
+                if resumed:
+                    self.log.info(f"{len(resumed)}/{nloop} iterations were completed by a previous run, skipping them")
+                    for count, iter_outputs in sorted(resumed.items()):
+                        journal.record_iteration(taskname, count, True, iter_outputs)
+                        task_stats.record_outcome(f"({count})", "resumed", 0)
+                    loop_worker_args = [args for args in loop_worker_args if args[3] not in resumed]
+                    outputs = resumed[max(resumed)]
                 if self._for_loop_scatter < 0:
                     num_workers = nloop
                 else:
                     num_workers = min(self._for_loop_scatter, nloop) 
+                # group consecutive iterations into chunks, each one run as a single task
+                chunk_size = self._for_loop_chunk_size
+                if not chunk_size:
+                    # automatic: aim for a few chunks per worker, so the load is still spread evenly
+                    chunk_size = max(1, len(loop_worker_args) // (num_workers * 4))
+                chunks = [loop_worker_args[i:i + chunk_size] for i in range(0, len(loop_worker_args), chunk_size)]
+                if chunk_size > 1:
+                    self.log.info(f"running {len(loop_worker_args)} iterations in {len(chunks)} chunk(s) of up to {chunk_size}")
+                    num_workers = max(1, min(num_workers, len(chunks)))
                 inital_task_status = f"0/{nloop} complete, {num_workers} workers"
                 task_stats.declare_subtask_status(inital_task_status)
-                with ProcessPoolExecutor(num_workers) as pool:
-                    # submit each iterant to pool
-                    futures = [pool.submit(self._iterate_loop_worker, *args, subprocess=True, raise_exc=False) for args in loop_worker_args]
+                # iterations are admitted as long as their declared resources fit on the node
+                cores, mem_gb = self.get_resources()
+                if cores or mem_gb:
+                    self.log.info(f"each iteration is expected to use {cores} core(s) and {mem_gb} GB of memory")
+                # failed iterations may be retried, after a delay that doubles with each attempt
+                args_by_count = {args[3]: args for args in loop_worker_args}
+                attempts = {count: 0 for count in args_by_count}
+                retries, backoff = self._for_loop_retry, self._for_loop_retry_backoff
+                fail_fast = self._for_loop_on_failure == ON_FAILURE_FAIL_FAST
+                with ScatterExecutor(self._for_loop_engine, num_workers) as pool, \
+                        LoopAdmission(num_workers, cores=cores, mem_gb=mem_gb) as admission:
                     # update task stats, since they're recorded independently within each step, as well
                     # as get any exceptions from the nesting
                     errors = []
-                    nfail = ncomplete = 0
-                    for f in as_completed(futures):
-                        attrs, kwattrs, stats, outputs, exc, tb = f.result()
-                        task_stats.declare_subtask_attributes(*attrs, **kwattrs)
-                        task_stats.add_missing_stats(stats)
-                        if exc is not None:
-                            errors.append(exc)
-                            if not isinstance(exc, ScabhaBaseException):
-                                errors.append(tb)
-                            nfail += 1
-                        else:
-                            ncomplete += 1
+                    nfail = ncomplete = ncancelled = 0
+                    cancelled = False
+                    # chunks are submitted to the pool as and when the session-wide worker budget admits them
+                    pending = chunks
+                    # iterations waiting to be retried, as list of (time of next attempt, count)
+                    retry_queue = []
+                    futures = set()
+                    future_counts = {}
+                    ncomplete = len(resumed)
+
+                    def cancel_iterations(counts):
+                        nonlocal ncancelled
+                        for count in counts:
+                            journal.record_iteration(taskname, count, False)
+                            task_stats.record_outcome(f"({count})", "cancelled", attempts[count])
+                        ncancelled += len(counts)
+
+                    while pending or futures or retry_queue:
+                        # iterations whose retry delay has expired go to the front of the queue
+                        now = time.time()
+                        for entry in sorted(retry_queue):
+                            if entry[0] <= now:
+                                retry_queue.remove(entry)
+                                pending.insert(0, [args_by_count[entry[1]]])
+                        nsubmitted = 0
+                        while pending and admission.try_admit():
+                            chunk = pending.pop(0)
+                            future = pool.submit(self, chunk)
+                            future_counts[future] = [args[3] for args in chunk]
+                            for count in future_counts[future]:
+                                attempts[count] += 1
+                            futures.add(future)
+                            nsubmitted += 1
+                        # if anything is waiting for admission or a retry, check back periodically
+                        timeout = admission.poll_interval if pending else None
+                        if retry_queue:
+                            retry_wait = max(0, min(retry_queue)[0] - now)
+                            timeout = retry_wait if timeout is None else min(timeout, retry_wait)
+                        completed, futures = wait(futures, return_when=FIRST_COMPLETED, timeout=timeout)
+                        if not completed and not nsubmitted:
+                            continue
+                        for f in completed:
+                            admission.release()
+                            counts = future_counts.pop(f)
+                            # chunk was cancelled before it started
+                            if f.cancelled():
+                                cancel_iterations(counts)
+                                continue
+                            # each chunk reports back the results of its individual iterations
+                            try:
+                                results = f.result()
+                            except Exception as exc:
+                                # the chunk never reported back, e.g. because its worker process was killed,
+                                # which breaks the process pool. Count this as a failed attempt of each of its
+                                # iterations, and make sure retries go to a working pool
+                                if isinstance(exc, BrokenExecutor):
+                                    pool.renew()
+                                results = [None] * len(counts)
+                                chunk_exc, chunk_tb = exc, FormattedTraceback(exc.__traceback__)
+                            for count, result in zip(counts, results):
+                                if result is None:
+                                    outputs, exc, tb = {}, chunk_exc, chunk_tb
+                                else:
+                                    attrs, kwattrs, stats, outputs, exc, tb = result
+                                    task_stats.declare_subtask_attributes(*attrs, **kwattrs)
+                                    task_stats.add_missing_stats(*stats)
+                                if exc is None:
+                                    journal.record_iteration(taskname, count, True, outputs)
+                                    task_stats.record_outcome(f"({count})", "success", attempts[count])
+                                    ncomplete += 1
+                                # failures after a cancellation are most likely due to the cancellation itself
+                                elif cancelled:
+                                    cancel_iterations([count])
+                                elif attempts[count] <= retries:
+                                    delay = backoff * 2**(attempts[count] - 1)
+                                    self.log.warning(f"iteration {count} failed (attempt {attempts[count]}/{retries + 1}): {exc}")
+                                    self.log.warning(f"retrying iteration {count} in {delay:g}s")
+                                    # the retry will record its own stats
+                                    task_stats.discard_subtask_stats(f"({count})")
+                                    retry_queue.append((time.time() + delay, count))
+                                else:
+                                    journal.record_iteration(taskname, count, False, outputs)
+                                    task_stats.record_outcome(f"({count})", "timeout" if _is_timeout(exc) else "failed", 
+                                                              attempts[count])
+                                    errors.append(exc)
+                                    if not isinstance(exc, ScabhaBaseException):
+                                        errors.append(tb)
+                                    nfail += 1
+                                    if fail_fast:
+                                        self.log.error(f"iteration {count} has failed, cancelling remaining iterations")
+                                        cancelled = True
+                                        pool.cancel()
+                                        for future in futures:
+                                            future.cancel()
+                                        cancel_iterations([args[3] for chunk in pending for args in chunk] + 
+                                                          [count for _, count in retry_queue])
+                                        pending, retry_queue = [], []
                         if ncomplete:
                             status = f"[green]{ncomplete}[/green]/{nloop} complete"
                         else:
                             status = f"0/{nloop} complete"
                         if nfail:
                             status = f"{status}, [red]{nfail}[/red] failed"
+                        if ncancelled:
+                            status = f"{status}, {ncancelled} cancelled"
                         status = f"{status}, {num_workers} workers"
+                        if pending and len(futures) < num_workers:
+                            status = f"{status}, {sum(len(chunk) for chunk in pending)} queued"
+                        if retry_queue:
+                            status = f"{status}, {len(retry_queue)} awaiting retry"
                         task_stats.declare_subtask_status(status)
                     if errors:
-                        pool.shutdown()
-                        raise StimelaRuntimeError(f"{nfail}/{nloop} jobs have failed", errors)
+                        message = f"{nfail}/{nloop} jobs have failed"
+                        if ncancelled:
+                            message += f", {ncancelled} cancelled"
+                        raise StimelaRuntimeError(message, errors)
                 # drop a rendering of the progress bar onto the console, to overwrite previous garbage if it's there
                 task_stats.restate_progress()
             # else just iterate directly
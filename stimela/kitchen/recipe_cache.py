@@ -0,0 +1,66 @@
+import hashlib, logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from omegaconf import OmegaConf, DictConfig
+
+import stimela
+import stimela.config
+from scabha import configuratt
+
+# "stimela run" spends most of its startup time loading recipe files, and finalizing the recipe (which instantiates
+# all its cabs and builds its alias maps). When the same recipe is run over and over with different parameters, this
+# work is the same every time. So the finalized recipe, along with the config it was finalized against, is stored
+# in the configuratt cache. Entries are keyed on the contents of the recipe files, a digest of the config, and the
+# command-line settings that affect the outcome, and they are invalidated when anything the recipe files include
+# changes. The recipe is cached before any parameters are assigned to it. Compiled recipes are pickled, so they are
+# only ever kept in the private cache, never in the shared one.
+
+@dataclass
+class CompiledRecipe(object):
+    config: DictConfig                    # full config after loading the recipe files
+    cab_index: Dict[str, Any]             # cabs defined, but not yet looked up
+    recipe_names: List[str]               # names of recipes defined in the recipe files
+    recipe_name: str                      # name of the recipe that was finalized
+    recipe: Any                           # finalized Recipe object
+
+
+def config_digest(config: DictConfig) -> str:
+    """Returns a digest of the config, excluding the runtime section (which changes with every run),
+    and including the definitions of cabs that haven't been looked up yet"""
+    hasher = hashlib.sha256()
+    for name in config.keys():
+        if name != "run":
+            hasher.update(f"{name}: {OmegaConf.to_yaml(config[name])}".encode())
+    for name, sections in stimela.config.CAB_INDEX.items():
+        for source, section in sections:
+            hasher.update(f"cabs.{name}: {OmegaConf.to_yaml(section)}".encode())
+    return hasher.hexdigest()
+
+
+def load_compiled_recipe(filenames: List[str], extra_keys: List[str],
+                         log: logging.Logger) -> Optional[CompiledRecipe]:
+    """Looks up a compiled recipe for the given recipe files. If found, it is installed: it becomes the global
+    config (keeping the runtime section of the current one), its cab index and dependencies are restored,
+    and the recipe's loggers are set up. Returns the CompiledRecipe, or None if not found."""
+    compiled, deps = configuratt.load_cache(filenames, extra_keys=extra_keys, shared=False)
+    if not isinstance(compiled, CompiledRecipe):
+        return None
+    compiled.config.run = stimela.CONFIG.run
+    stimela.CONFIG = compiled.config
+    stimela.config.CAB_INDEX.clear()
+    stimela.config.CAB_INDEX.update(compiled.cab_index)
+    stimela.config.CONFIG_DEPS.update(deps)
+    compiled.recipe.restore_loggers()
+    log.info(f"loaded compiled recipe '{compiled.recipe_name}' from cache")
+    return compiled
+
+
+def save_compiled_recipe(filenames: List[str], extra_keys: List[str], compiled: CompiledRecipe,
+                         log: logging.Logger):
+    """Stores a compiled recipe for the given recipe files. Failure to do so is not an error."""
+    deps = configuratt.ConfigDependencies()
+    deps.update(stimela.config.CONFIG_DEPS)
+    try:
+        configuratt.save_cache(filenames, compiled, deps, extra_keys=extra_keys, shared=False)
+    except Exception as exc:
+        log.debug(f"can't cache compiled recipe: {exc}")
@@ -0,0 +1,358 @@
+import asyncio, copy, math, multiprocessing, multiprocessing.util, os, tempfile, threading, uuid
+from collections import OrderedDict
+from contextlib import contextmanager, suppress
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+
+from stimela import task_stats, stimelogging
+
+# engines for running scattered for-loop iterations
+SCATTER_PROCESS = "process"
+SCATTER_THREAD = "thread"
+SCATTER_ASYNCIO = "asyncio"
+SCATTER_ENGINES = (SCATTER_PROCESS, SCATTER_THREAD, SCATTER_ASYNCIO)
+
+# what to do when a scattered iteration fails (after any retries)
+ON_FAILURE_CONTINUE = "continue"
+ON_FAILURE_FAIL_FAST = "fail_fast"
+ON_FAILURE_POLICIES = (ON_FAILURE_CONTINUE, ON_FAILURE_FAIL_FAST)
+
+
+class WorkerBudget(object):
+    """Session-wide budget of concurrently running scatter iterations, shared by all scattered loops
+    at every nesting level. The counters live in shared memory, so worker processes forked after the
+    budget is created draw from the same budget.
+
+    Each iteration holds a slot while it runs. A loop nested inside an iteration gets to use its
+    parent's slot for free (so nested loops can always make progress, and can't deadlock waiting
+    on their parents), and draws any additional slots from the budget. To keep things fair, a loop
+    may hold no more than its share of the budget, i.e. max_workers divided by the number of active loops.
+    """
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._free = multiprocessing.Value('i', max_workers)
+        self._loops = multiprocessing.Value('i', 0)
+
+    def add_loop(self, delta: int):
+        with self._loops.get_lock():
+            self._loops.value += delta
+
+    def try_acquire(self, held: int) -> bool:
+        """Tries to acquire a slot on behalf of a loop currently holding the given number of slots"""
+        with self._free.get_lock():
+            share = max(1, math.ceil(self.max_workers / max(self._loops.value, 1)))
+            if self._free.value > 0 and held < share:
+                self._free.value -= 1
+                return True
+            return False
+
+    def release(self):
+        with self._free.get_lock():
+            self._free.value += 1
+
+
+class ResourceLedger(object):
+    """Keeps track of the cores and memory reserved by running scatter iterations on the local node,
+    based on the resources declared by their cabs and steps. Like the WorkerBudget, this lives
+    in shared memory, so that loops running in worker processes see each other's reservations.
+    """
+    def __init__(self):
+        self._lock = multiprocessing.Lock()
+        self._cores = multiprocessing.RawValue('d', 0)
+        self._mem_gb = multiprocessing.RawValue('d', 0)
+
+    def try_reserve(self, cores: float, mem_gb: float, force: bool = False) -> bool:
+        """Reserves resources for an iteration, if they fit in what the node has available.
+        Load and free memory come from the psutil samples of task_stats, and already include the
+        usage of running iterations, so these are checked against the reservations and the new request.
+        If force is True, the reservation is made regardless."""
+        with self._lock:
+            if not force and (self._cores.value or self._mem_gb.value):
+                ncpu, load, mem_avail, mem_total = task_stats.get_system_resources()
+                if cores:
+                    if max(load, self._cores.value) + cores > ncpu:
+                        return False
+                if mem_gb:
+                    if self._mem_gb.value + mem_gb > mem_total or mem_gb > mem_avail:
+                        return False
+            self._cores.value += cores
+            self._mem_gb.value += mem_gb
+            return True
+
+    def release(self, cores: float, mem_gb: float):
+        with self._lock:
+            self._cores.value = max(self._cores.value - cores, 0)
+            self._mem_gb.value = max(self._mem_gb.value - mem_gb, 0)
+
+
+_budget = None
+_ledger = None
+
+def init_worker_budget(max_workers: int):
+    """Sets up the session-wide worker budget (max_workers<=0 means no limit), and the ledger of reserved
+    resources. This should be called before any worker processes are started, so that they all share the same
+    budget and ledger."""
+    global _budget, _ledger
+    _budget = WorkerBudget(max_workers) if max_workers > 0 else None
+    _ledger = ResourceLedger()
+
+def get_resource_ledger():
+    """Returns the session-wide resource ledger, creating one if init_worker_budget() hasn't been called"""
+    global _ledger
+    if _ledger is None:
+        _ledger = ResourceLedger()
+    return _ledger
+
+
+# set in threads running a scatter iteration (which therefore holds a slot of the budget)
+_slot_state = threading.local()
+
+def holds_slot():
+    """True if the current thread is running a scatter iteration"""
+    return getattr(_slot_state, "held", False)
+
+def set_holds_slot(held: bool):
+    _slot_state.held = held
+
+
+class LoopAdmission(object):
+    """Admits the iterations of one scattered loop, within its own limit of num_workers, within the
+    session-wide budget, and as long as the resources declared for each iteration (cores, mem_gb)
+    fit on the node. Used as a context manager while the loop is running."""
+    # how often a loop waiting for admission re-checks the budget, in seconds
+    poll_interval = 0.1
+
+    def __init__(self, num_workers: int, cores: float = 0, mem_gb: float = 0):
+        self.num_workers = num_workers
+        self.budget = _budget
+        self.cores, self.mem_gb = cores, mem_gb
+        self.ledger = get_resource_ledger() if cores or mem_gb else None
+        # the slot of our parent iteration, if we're in one
+        self.inherited = 1 if holds_slot() else 0
+        self.nrunning = self.nacquired = 0
+
+    def __enter__(self):
+        if self.budget is not None:
+            self.budget.add_loop(1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.budget is not None:
+            for _ in range(self.nacquired):
+                self.budget.release()
+            self.nacquired = 0
+            self.budget.add_loop(-1)
+        if self.ledger is not None:
+            self.ledger.release(self.cores * self.nrunning, self.mem_gb * self.nrunning)
+        return False
+
+    def try_admit(self) -> bool:
+        """Returns True if another iteration can be started now"""
+        if self.nrunning >= self.num_workers:
+            return False
+        # a loop with nothing running always gets to start an iteration, so it can't be starved
+        if self.ledger is not None:
+            if not self.ledger.try_reserve(self.cores, self.mem_gb, force=not self.nrunning):
+                return False
+        if self.budget is not None and self.nrunning >= self.inherited + self.nacquired:
+            if not self.budget.try_acquire(self.inherited + self.nacquired):
+                if self.ledger is not None:
+                    self.ledger.release(self.cores, self.mem_gb)
+                return False
+            self.nacquired += 1
+        self.nrunning += 1
+        return True
+
+    def release(self):
+        """Called when an iteration completes. Slots acquired from the budget are handed back right away."""
+        self.nrunning -= 1
+        if self.ledger is not None:
+            self.ledger.release(self.cores, self.mem_gb)
+        if self.budget is not None and self.nacquired:
+            self.budget.release()
+            self.nacquired -= 1
+
+
+# session-wide process pool, reused between loops. Each process maintains its own (for nested loops),
+# so keep track of which process the pool belongs to
+_process_pool = _process_pool_pid = None
+_process_pool_size = 0
+_process_pool_lock = threading.Lock()
+
+def get_process_pool(num_workers: int) -> ProcessPoolExecutor:
+    """Returns the process pool of this process, making sure it has at least num_workers workers (or as many
+    as the worker budget allows, since no more will ever be busy). If the pool needs to grow, or is broken 
+    (i.e. a worker process has died), it is replaced."""
+    global _process_pool, _process_pool_pid, _process_pool_size
+    if _budget is not None:
+        num_workers = min(num_workers, _budget.max_workers)
+    with _process_pool_lock:
+        pool = _process_pool if _process_pool_pid == os.getpid() else None
+        if pool is None or _process_pool_size < num_workers or getattr(pool, "_broken", False):
+            # loops already running on an old pool will complete as normal
+            if pool is not None:
+                pool.shutdown(wait=False)
+            # worker processes don't run atexit handlers, and would wait forever on the workers of 
+            # their own pool when exiting, so make sure the pool is shut down first (and before
+            # the pool's queues are closed by their own finalizers)
+            if _process_pool_pid != os.getpid() and multiprocessing.parent_process() is not None:
+                multiprocessing.util.Finalize(None, shutdown_process_pool, exitpriority=100)
+            _process_pool = ProcessPoolExecutor(num_workers)
+            _process_pool_pid = os.getpid()
+            _process_pool_size = num_workers
+        return _process_pool
+
+def shutdown_process_pool():
+    """Shuts down the process pool of this process, if any"""
+    global _process_pool, _process_pool_pid, _process_pool_size
+    with _process_pool_lock:
+        if _process_pool is not None and _process_pool_pid == os.getpid():
+            _process_pool.shutdown()
+        _process_pool = _process_pool_pid = None
+        _process_pool_size = 0
+
+
+def run_iteration_process(recipe, thread_state, params, subst, backend, count, iter_var):
+    """Runs one loop iteration in a (possibly reused) worker process.
+    Returns the same tuple as Recipe._iterate_loop_worker()."""
+    task_stats.init_worker_process(*thread_state)
+    set_holds_slot(True)
+    return recipe._iterate_loop_worker(params, subst, backend, count, iter_var, subprocess=True, raise_exc=False)
+
+
+def run_chunk_process(recipe, thread_state, chunk):
+    """Runs a chunk of consecutive loop iterations in a worker process. chunk is a list of argument tuples
+    (params, subst, backend, count, iter_var). Returns list of per-iteration results."""
+    return [run_iteration_process(recipe, thread_state, *args) for args in chunk]
+
+
+def _copy_iteration_state(recipe, params, subst):
+    """Makes a per-iteration copy of the recipe and its state, so that iterations running in threads
+    can't step on each other's toes (worker processes get a copy for free, by way of pickling).
+    The config object is global, so it is shared rather than copied."""
+    memo = {id(recipe.config): recipe.config}
+    config_ns = OrderedDict.get(subst, 'config')
+    if config_ns is not None:
+        memo[id(config_ns)] = config_ns
+    return copy.deepcopy((recipe, params, subst), memo)
+
+
+@contextmanager
+def worker_thread_context(thread_state, subprocess_id: str, held: bool = False):
+    """Sets up a worker thread to run recipe steps. thread_state is the result of task_stats.get_thread_state(),
+    as called by the parent thread. If held is True, the thread is taken to hold a slot of the worker budget."""
+    task_stats.init_thread_state(thread_state[0], subprocess_id, thread_state[2])
+    set_holds_slot(held)
+    # each thread sets up its own log files
+    stimelogging.set_log_scope(subprocess_id)
+    # xrun needs an event loop for the cab subprocess
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        yield
+    finally:
+        stimelogging.close_log_scope(subprocess_id)
+        stimelogging.set_log_scope(None)
+        set_holds_slot(False)
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def run_iteration_thread(recipe, thread_state, params, subst, backend, count, iter_var):
+    """Runs one loop iteration in a worker thread, on a copy of the recipe state.
+    Returns the same tuple as Recipe._iterate_loop_worker()."""
+    with worker_thread_context(thread_state, f"{thread_state[1]}.{count}", held=True):
+        recipe, params, subst = _copy_iteration_state(recipe, params, subst)
+        return recipe._iterate_loop_worker(params, subst, backend, count, iter_var, subprocess=False, raise_exc=False)
+
+
+def run_chunk_thread(recipe, thread_state, chunk):
+    """Runs a chunk of consecutive loop iterations in a worker thread. Returns list of per-iteration results."""
+    task_stack, subprocess_id, cancel_tokens = thread_state
+    # each iteration gets a fresh copy of the task stack
+    return [run_iteration_thread(recipe, ([copy.copy(ti) for ti in task_stack], subprocess_id, cancel_tokens), *args) 
+            for args in chunk]
+
+
+class ScatterExecutor(object):
+    """Runs scattered for-loop iterations using one of several engines:
+
+    * "process": each iteration runs in a worker process (the default). Worker processes come from
+      a session-wide pool, and are reused between loops. Loops nested inside a worker thread use
+      "thread" instead, since forking a multi-threaded process is unsafe.
+    * "thread": each iteration runs in a worker thread, on its own copy of the recipe state
+    * "asyncio": each iteration is scheduled as a coroutine on an event loop running in a background thread.
+      Since cabs are run in a blocking way, the coroutines hand the actual work off to worker threads,
+      so this mainly differs from "thread" in how iterations are queued and admitted.
+
+    Used as a context manager. submit() runs a chunk of consecutive iterations as a single task (which saves
+    on per-task overheads when iterations are many and short), and returns a concurrent.futures.Future for
+    a list of Recipe._iterate_loop_worker() results, one per iteration.
+
+    cancel() signals all submitted iterations to stop. This creates a token file, which running iterations 
+    (and any loops nested in them) check for before starting a step, and while running a cab (see xrun), 
+    so this works the same across threads and processes. Tasks that haven't started yet should be
+    cancelled via their futures.
+    """
+    def __init__(self, engine: str, num_workers: int):
+        if engine not in SCATTER_ENGINES:
+            raise ValueError(f"unknown scatter engine '{engine}'")
+        # forking a multi-threaded process is asking for deadlocks, so worker threads scatter to threads
+        if engine == SCATTER_PROCESS and task_stats.in_worker_thread():
+            engine = SCATTER_THREAD
+        self.engine = engine
+        self.num_workers = num_workers
+        self.cancel_token = os.path.join(tempfile.gettempdir(), f"stimela-cancel-{uuid.uuid4().hex}")
+        self._loop = self._loop_thread = self._semaphore = None
+        if engine == SCATTER_PROCESS:
+            self._pool = get_process_pool(num_workers)
+        else:
+            self._pool = ThreadPoolExecutor(num_workers)
+            if engine == SCATTER_ASYNCIO:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._loop_thread.start()
+                self._semaphore = asyncio.run_coroutine_threadsafe(self._make_semaphore(), self._loop).result()
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.num_workers)
+
+    async def _run_coroutine(self, func, *args):
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    def submit(self, recipe, chunk) -> Future:
+        task_stack, subprocess_id, cancel_tokens = task_stats.get_thread_state(picklable=self.engine == SCATTER_PROCESS)
+        thread_args = (recipe, (task_stack, subprocess_id, cancel_tokens + (self.cancel_token,)), chunk)
+        if self.engine == SCATTER_PROCESS:
+            return self._pool.submit(run_chunk_process, *thread_args)
+        if self.engine == SCATTER_THREAD:
+            return self._pool.submit(run_chunk_thread, *thread_args)
+        return asyncio.run_coroutine_threadsafe(self._run_coroutine(run_chunk_thread, *thread_args), self._loop)
+
+    def renew(self):
+        """Switches to a fresh process pool if the current one is broken (i.e. a worker process has died),
+        so that iterations can be resubmitted. Tasks already submitted to the broken pool fail regardless."""
+        if self.engine == SCATTER_PROCESS:
+            self._pool = get_process_pool(self.num_workers)
+
+    def cancel(self):
+        open(self.cancel_token, "w").close()
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = None
+        # the process pool is shared, so leave it running
+        if self.engine != SCATTER_PROCESS:
+            self._pool.shutdown()
+        with suppress(FileNotFoundError):
+            os.unlink(self.cancel_token)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
@@ -10,7 +10,7 @@ from rich.markup import escape
 from stimela.config import EmptyDictDefault, EmptyListDefault
 import stimela
 from stimela import log_exception, stimelogging, task_stats
-from stimela.stimelogging import log_rich_payload
+from stimela.stimelogging import log_rich_payload, log_option_unchanged
 from stimela.backends import StimelaBackendSchema, runner
 from stimela.exceptions import *
 import scabha.exceptions
@@ -18,7 +18,9 @@ from scabha.exceptions import SubstitutionError, SubstitutionErrorList
 from scabha.validate import evaluate_and_substitute, evaluate_and_substitute_object, Unresolved, join_quote
 from scabha.substitutions import SubstitutionNS, substitutions_from 
 from scabha.basetypes import UNSET, Placeholder, MS, File, Directory, SkippedOutput
-from .cab import Cab, get_cab_schema
+from .cab import Cab, ResourceRequirements, get_cab_schema
+from .step_cache import StepCache, get_cache_dir
+from . import tree_scan
 
 Conditional = Optional[str]
 
@@ -47,6 +49,7 @@ def resolve_dotted_reference(key, base, current, context):
 
 OUTPUTS_EXISTS = "exist"
 OUTPUTS_FRESH = "fresh"
+OUTPUTS_CACHED = "cached"
 
 @dataclass
 class Step:
@@ -56,7 +59,7 @@ class Step:
     params: Dict[str, Any] = EmptyDictDefault()     # assigns parameter values
     info: Optional[str] = None                      # comment or info string
     skip: Optional[str] = None                      # if this evaluates to True, step is skipped.  
-    skip_if_outputs: Optional[str] = None           # skip if outputs "exist' or "fresh"
+    skip_if_outputs: Optional[str] = None           # skip if outputs "exist', "fresh", or "cached" (from an identical previous run)
     tags: List[str] = EmptyListDefault()
 
     name: str = ''                                  # step's internal name
@@ -70,6 +73,13 @@ class Step:
     # optional backend settings
     backend: Optional[Dict[str, Any]] = None
 
+    # expected resource usage of the step, overrides that of the cab (or nested recipe)
+    resources: Optional[ResourceRequirements] = None
+
+    # time limits (in seconds) for the cab's command, override those of the cab
+    timeout: Optional[float] = None
+    idle_output_timeout: Optional[float] = None
+
     def __post_init__(self):
         self.fqname = self.fqname or self.name
         if not bool(self.cab) and not bool(self.recipe):
@@ -91,7 +101,7 @@ class Step:
         self.validated_params = None
         # parameters protected from assignment (because they've been set on the command line, presumably)
         self._assignment_overrides = set()
-        if self.skip_if_outputs and self.skip_if_outputs not in (OUTPUTS_EXISTS, OUTPUTS_FRESH):
+        if self.skip_if_outputs and self.skip_if_outputs not in (OUTPUTS_EXISTS, OUTPUTS_FRESH, OUTPUTS_CACHED):
             raise StepValidationError(f"step '{self.name}': invalid 'skip_if_outputs={self.skip_if_outputs}' setting")
         # the "skip" attribute is reevaluated at runtime since it may contain substitutions, but if it's set to a bool
         # constant, self._skip will be preset already
@@ -117,6 +127,36 @@ class Step:
     def finalized(self):
         return self.cargo is not None
 
+    def get_resources(self):
+        """Returns expected (cores, mem_gb) usage of the step. Settings in the step's resources section
+        override those of the cab. For nested recipes, this is worked out from the recipe's steps."""
+        if type(self.cargo) is Cab:
+            cores, mem_gb = self.cargo.resources.cores, self.cargo.resources.mem_gb
+        elif self.cargo is not None:
+            # a scattered sub-recipe admits its own iterations, so counts as nothing here
+            for_loop = self.cargo.for_loop
+            if for_loop is not None and (self.cargo._for_loop_scatter if self.cargo._for_loop_scatter is not None
+                                         else for_loop.scatter):
+                cores = mem_gb = None
+            else:
+                cores, mem_gb = self.cargo.get_resources()
+        else:
+            cores = mem_gb = None
+        if self.resources is not None:
+            if self.resources.cores is not None:
+                cores = self.resources.cores
+            if self.resources.mem_gb is not None:
+                mem_gb = self.resources.mem_gb
+        return cores or 0, mem_gb or 0
+
+    def get_timeouts(self):
+        """Returns (timeout, idle_output_timeout) for the step's cab, in seconds, or None for no limit.
+        Settings of the step override those of the cab."""
+        timeout = self.timeout if self.timeout is not None else self.cargo.timeout
+        idle_output_timeout = self.idle_output_timeout if self.idle_output_timeout is not None \
+                              else self.cargo.idle_output_timeout
+        return timeout, idle_output_timeout
+
     @property
     def missing_params(self):
         return OrderedDict([(name, schema) for name, schema in self.cargo.inputs_outputs.items() 
@@ -167,6 +207,8 @@ class Step:
     def update_log_options(self, **options):
         from .recipe import Recipe
         for setting, value in options.items():
+            if log_option_unchanged(self.logopts, setting, value):
+                continue
             try:
                 self.logopts[setting] = value
             except Exception as exc:
@@ -216,10 +258,15 @@ class Step:
                     if self.cab in self._instantiated_cabs:
                         self.cargo = copy.copy(self._instantiated_cabs[self.cab])
                     else:
-                        if self.cab not in self.config.cabs:
+                        # cab definitions are merged into the config on first lookup
+                        try:
+                            cab_config = stimela.config.get_cab_config(self.cab, config)
+                        except Exception as exc:
+                            raise StepValidationError(f"error in cab '{self.cab}'", exc)
+                        if cab_config is None:
                             raise StepValidationError(f"unknown cab '{self.cab}'")
                         try:
-                            self._instantiated_cabs[self.cab] = Cab(**config.cabs[self.cab])
+                            self._instantiated_cabs[self.cab] = Cab(**cab_config)
                             self.cargo = copy.copy(self._instantiated_cabs[self.cab])
                         except Exception as exc:
                             raise StepValidationError(f"error in cab '{self.cab}'", exc)
@@ -488,9 +535,16 @@ class Step:
 
             ## check if we need to skip based on existing/fresh file outputs
             ## if skip on fresh outputs is in effect, find mtime of most recent input 
-            if not backend_runner.is_remote_fs and not skip and self.skip_if_outputs:
+            if not backend_runner.is_remote_fs and not skip and self.skip_if_outputs in (OUTPUTS_EXISTS, OUTPUTS_FRESH):
                 # max_mtime will remain 0 if we're not echecking for freshness, or if there are no file-type inputs
                 max_mtime, max_mtime_path = 0, None
+                # by default, the mtime of a directory (or MS) is that of the directory itself. Scanning the whole
+                # tree catches files rewritten inside it, but can be costly, so it must be enabled explicitly
+                if self.config is not None and "opts" in self.config and \
+                        self.config.opts.runtime.get("deep_freshness", False):
+                    get_mtime = tree_scan.newest_mtime
+                else:
+                    get_mtime = lambda path: (os.path.getmtime(path), path)
                 if self.skip_if_outputs == OUTPUTS_FRESH:
                     parent_log_info("checking if file-type outputs of step are fresh")
                     for name, value in params.items():
@@ -504,10 +558,10 @@ class Step:
                                 continue
                             for filename in values:
                                 if type(filename) is str and os.path.exists(filename):
-                                    mtime = os.path.getmtime(filename)
+                                    mtime, mtime_path = get_mtime(filename)
                                     if mtime > max_mtime:
                                         max_mtime = mtime
-                                        max_mtime_path = filename
+                                        max_mtime_path = mtime_path
                     if max_mtime:
                         parent_log_info(f"  most recently modified input is {max_mtime_path} ({time.ctime(max_mtime)})")
                 else:
@@ -549,7 +603,7 @@ class Step:
                                     if schema.skip_freshness_checks:
                                         messages.append(f"{label} = {value} marked as skipped from freshness checks")
                                     else:
-                                        mtime = os.path.getmtime(value)
+                                        mtime, _ = get_mtime(value)
                                         if mtime < max_mtime:
                                             parent_log_info(f"{label} = {value} is not fresh")
                                             all_exist = False
@@ -576,6 +630,22 @@ class Step:
                     parent_log_info("all required outputs are OK, skipping this step")
                     skip = True
 
+            ## check if an identical invocation has been cached by a previous run
+            step_cache = cache_key = None
+            if not skip and self.skip_if_outputs == OUTPUTS_CACHED:
+                if backend_runner.is_remote_fs or type(self.cargo) is not Cab:
+                    parent_log_info("skip_if_outputs=cached only applies to cabs running on the local filesystem, ignoring")
+                else:
+                    parent_log_info("checking for cached outputs of step")
+                    step_cache = StepCache(get_cache_dir(self.config))
+                    cache_key = step_cache.step_key(self.cargo, params)
+                    cached_outputs = step_cache.lookup(cache_key, log=parent_log)
+                    if cached_outputs is not None:
+                        parent_log_info("outputs of an identical invocation are cached and unchanged, skipping this step")
+                        params.update(**cached_outputs)
+                        skip = True
+                        step_cache = None
+
             if not skip:
                 # check for outputs that need removal
                 if not backend_runner.is_remote_fs:
@@ -591,7 +661,9 @@ class Step:
                 if type(self.cargo) is Recipe:
                     self.cargo._run(params, subst, backend=backend)
                 elif type(self.cargo) is Cab:
-                    cabstat = backend_runner.run(self.cargo, params=params, log=self.log, subst=subst, fqname=self.fqname)
+                    timeout, idle_output_timeout = self.get_timeouts()
+                    cabstat = backend_runner.run(self.cargo, params=params, log=self.log, subst=subst, fqname=self.fqname,
+                                                 timeout=timeout, idle_output_timeout=idle_output_timeout)
                     # check for runstate
                     if cabstat.success is False:
                         raise StimelaCabRuntimeError(f"error running cab '{self.cargo.name}'", cabstat.errors)
@@ -653,5 +725,9 @@ class Step:
                     parent_log_warning(f"invalid outputs: {join_quote(invalid)}")
                     parent_log_warning("since some sub-steps were skipped, this is not treated as an error for now, but may cause errors downstream")
 
+            # record outputs of a successful run for next time
+            if step_cache is not None and validated and not invalid:
+                step_cache.store(cache_key, self.cargo, params, fqname=self.fqname, log=self.log)
+
         return params
 
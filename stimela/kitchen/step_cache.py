@@ -0,0 +1,129 @@
+import os, os.path, json, hashlib, dataclasses, enum, tempfile, time, logging
+from collections.abc import Mapping
+from typing import Any, Dict, Optional
+
+from .tree_scan import tree_digest
+
+# bump this when the key or entry layout changes, to invalidate old entries
+CACHE_FORMAT_VERSION = 2
+
+DEFAULT_CACHE_DIR = "~/.cache/stimela-steps"
+
+# dataclass fields that don't affect what a cab does
+_IGNORED_FIELDS = {"fqname", "timeout", "idle_output_timeout"}
+
+
+def get_cache_dir(config) -> str:
+    """Returns the step cache directory, as given by opts.runtime.step_cache_dir, or the default"""
+    cache_dir = None
+    if config is not None and "opts" in config:
+        cache_dir = config.opts.runtime.get("step_cache_dir")
+    return os.path.expanduser(cache_dir or DEFAULT_CACHE_DIR)
+
+
+def _canonicalize(obj: Any) -> Any:
+    """Turns a cab definition (or a parameter value) into plain JSON-able containers, in a reproducible way"""
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {field.name: _canonicalize(getattr(obj, field.name)) for field in dataclasses.fields(obj)
+                if field.name not in _IGNORED_FIELDS}
+    if isinstance(obj, enum.Enum):
+        return obj.name
+    if isinstance(obj, Mapping):
+        return {str(key): _canonicalize(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple, set)):
+        items = [_canonicalize(value) for value in obj]
+        return sorted(items, key=repr) if isinstance(obj, set) else items
+    if obj is None or isinstance(obj, (bool, int, float)):
+        return obj
+    return str(obj)
+
+
+def _file_values(schema, value):
+    """Returns list of filenames contained in a parameter value, if it is of a file type"""
+    if schema.is_file_type:
+        values = [value]
+    elif schema.is_file_list_type:
+        values = value or []
+    else:
+        return []
+    return [value for value in values if isinstance(value, str)]
+
+
+class StepCache(object):
+    """Content-addressed store of step results. An entry is keyed on a digest of the cab definition
+    (which includes its image and version), the parameter values, and the contents of all file-type inputs.
+    It records the step's outputs, and the digests of its file-type outputs at the time they were produced."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def step_key(self, cab, params: Dict[str, Any]) -> str:
+        """Computes the cache key of a cab invocation with the given (validated) parameters"""
+        input_hashes = {}
+        for name, value in params.items():
+            schema = cab.inputs_outputs.get(name)
+            if schema is not None and schema.is_input:
+                for path in _file_values(schema, value):
+                    input_hashes[path] = tree_digest(path)
+        payload = dict(version=CACHE_FORMAT_VERSION,
+                       cab=_canonicalize(cab),
+                       params=_canonicalize(params),
+                       inputs=input_hashes)
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def lookup(self, key: str, log: Optional[logging.Logger] = None) -> Optional[Dict[str, Any]]:
+        """Looks up the given key. Returns dict of cached outputs if an entry is found, and all of its
+        file-type outputs are still there with the same contents. Else returns None."""
+        try:
+            with open(self._entry_path(key)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            if log is not None:
+                log.warning(f"ignoring unreadable step cache entry {self._entry_path(key)}: {exc}")
+            return None
+        if entry.get("version") != CACHE_FORMAT_VERSION:
+            return None
+        for path, digest in entry["files"].items():
+            if tree_digest(path) != digest:
+                if log is not None:
+                    log.info(f"  {path} has changed since it was cached")
+                return None
+        return entry["outputs"]
+
+    def store(self, key: str, cab, params: Dict[str, Any], fqname: str = "",
+              log: Optional[logging.Logger] = None):
+        """Records the outputs of a successful cab invocation under the given key"""
+        outputs, files = {}, {}
+        for name, schema in cab.outputs.items():
+            if name not in params:
+                continue
+            value = params[name]
+            try:
+                json.dumps(value)
+            except (TypeError, ValueError):
+                if log is not None:
+                    log.debug(f"output {name} can't be cached, step won't be memoized")
+                return
+            outputs[name] = value
+            for path in _file_values(schema, value):
+                digest = tree_digest(path)
+                if digest is not None:
+                    files[path] = digest
+        entry = dict(version=CACHE_FORMAT_VERSION, step=fqname, cab=cab.name, time=time.time(),
+                     outputs=outputs, files=files)
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to temporary file and rename, so that concurrent readers never see a partial entry
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmpname, path)
+        except OSError as exc:
+            if log is not None:
+                log.warning(f"failed to write step cache entry {path}: {exc}")
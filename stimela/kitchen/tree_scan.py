@@ -0,0 +1,152 @@
+import os, os.path, hashlib, stat, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Tuple, List
+
+# Directory-type parameters (MS, Directory) are only meaningfully checked by looking at everything inside them,
+# since rewriting a table file doesn't touch the mtime of the top-level directory. Trees like MSs can contain
+# many hundreds of files, so directories are scanned in parallel (stat calls release the GIL, and on network
+# filesystems are mostly latency), and results are cached for the session:
+#
+# * directory listings, keyed by (device, inode), and valid as long as the directory mtime is unchanged
+#   (adding, removing or renaming entries updates the mtime of the directory)
+# * file content digests, keyed by (device, inode, size, mtime)
+
+_CHUNK_SIZE = 1 << 20
+
+_listing_cache = {}
+_digest_cache = {}
+_cache_lock = threading.Lock()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Returns the scanner thread pool of this process (worker processes make their own)"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(min(32, (os.cpu_count() or 1) + 4), thread_name_prefix="tree_scan")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def clear_cache():
+    """Clears the session's stat cache"""
+    with _cache_lock:
+        _listing_cache.clear()
+        _digest_cache.clear()
+
+
+def _list_dir(path: str, st: os.stat_result) -> Tuple[List[str], List[str]]:
+    """Returns sorted lists of subdirectory and other entry names in a directory"""
+    key = (st.st_dev, st.st_ino)
+    with _cache_lock:
+        cached = _listing_cache.get(key)
+    if cached is not None and cached[0] == st.st_mtime_ns:
+        return cached[1], cached[2]
+    subdirs, files = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # don't follow symlinks to directories, to avoid loops
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    subdirs.sort()
+    files.sort()
+    with _cache_lock:
+        _listing_cache[key] = st.st_mtime_ns, subdirs, files
+    return subdirs, files
+
+
+def _scan_dir(path: str):
+    """Scans one directory. Returns its path, its stat, list of subdirectory paths, and list of (path, stat)
+    for other entries"""
+    try:
+        st = os.stat(path)
+        subdirs, files = _list_dir(path, st)
+    except (FileNotFoundError, NotADirectoryError):
+        return path, None, [], []
+    file_stats = []
+    for name in files:
+        filepath = os.path.join(path, name)
+        try:
+            file_stats.append((filepath, os.stat(filepath)))
+        except FileNotFoundError:    # dangling symlink, or removed under our feet
+            pass
+    return path, st, [os.path.join(path, name) for name in subdirs], file_stats
+
+
+def walk_tree(path: str):
+    """Walks a directory tree, scanning subdirectories in parallel. Yields (path, stat, is_dir) tuples
+    for the directory itself and everything under it, in no particular order."""
+    executor = _get_executor()
+    futures = {executor.submit(_scan_dir, path)}
+    while futures:
+        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            dirpath, st, subdirs, file_stats = future.result()
+            if st is None:
+                continue
+            yield dirpath, st, True
+            for filepath, filest in file_stats:
+                yield filepath, filest, False
+            futures.update(executor.submit(_scan_dir, subdir) for subdir in subdirs)
+
+
+def newest_mtime(path: str) -> Tuple[float, Optional[str]]:
+    """Returns the modification time of a file, or the newest modification time found anywhere in a directory tree,
+    along with the path that has it. Returns 0, None if path doesn't exist."""
+    if not os.path.isdir(path):
+        try:
+            return os.path.getmtime(path), path
+        except OSError:
+            return 0, None
+    max_mtime, max_path = 0, None
+    for entry_path, st, _ in walk_tree(path):
+        if st.st_mtime > max_mtime:
+            max_mtime, max_path = st.st_mtime, entry_path
+    return max_mtime, max_path
+
+
+def file_digest(path: str, st: Optional[os.stat_result] = None) -> str:
+    """Returns a digest of the contents of a file, reusing the digest computed earlier in the session
+    if the file is unchanged"""
+    st = st or os.stat(path)
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        digest = _digest_cache.get(key)
+    if digest is None:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        with _cache_lock:
+            _digest_cache[key] = digest
+    return digest
+
+
+def tree_digest(path: str) -> Optional[str]:
+    """Returns a digest of the contents of a file or directory tree, or None if path doesn't exist.
+    Directories are hashed by the relative names and contents of everything in them."""
+    if not os.path.isdir(path):
+        try:
+            return file_digest(path)
+        except FileNotFoundError:
+            return None
+    entries = sorted(((os.path.relpath(entry_path, path), st) for entry_path, st, _ in walk_tree(path)),
+                     key=lambda entry: entry[0])
+    # only regular files have contents to speak of -- everything else is hashed by name only
+    def digest_entry(entry):
+        relpath, st = entry
+        if stat.S_ISREG(st.st_mode):
+            return f"f {relpath} {file_digest(os.path.join(path, relpath), st)}\n"
+        return f"{'d' if stat.S_ISDIR(st.st_mode) else 'o'} {relpath}\n"
+    hasher = hashlib.sha256()
+    for line in _get_executor().map(digest_entry, entries):
+        hasher.update(line.encode())
+    return hasher.hexdigest()
+
@@ -52,13 +52,16 @@ class RunExecGroup(click.Group):
                 help="Add directory to _include paths. Can be given multiple times.")
 @click.option('--clear-cache', '-C', is_flag=True, 
                 help="Reset the configuration cache. First thing to try in case of strange configuration errors.")
+@click.option('--trust-cache', is_flag=True, 
+                help="""Use cached configs without checking whether the files they include have changed. Saves time 
+                on slow filesystems, when configs are known not to change.""")
 @click.option('--boring', '-B', is_flag=True, 
                 help="Disables progress bar and any other fancy console outputs.")
 @click.option('--verbose', '-v', is_flag=True, 
               help='Be extra verbose in output.')
 @click.version_option(str(stimela.__version__))
 def cli(config_files=[], config_dotlist=[], include=[], backend=None, 
-        verbose=False, no_sys_config=False, clear_cache=False, boring=False):
+        verbose=False, no_sys_config=False, clear_cache=False, trust_cache=False, boring=False):
     global log
     log = stimela.logger(loglevel=logging.DEBUG if verbose else logging.INFO, boring=boring)
     log.info(f"starting")        # remove this eventually, but it's handy for timing things right now
@@ -74,10 +77,17 @@ def cli(config_files=[], config_dotlist=[], include=[], backend=None,
         scabha.exceptions.ALWAYS_REPORT_TRACEBACK = True
 
     import scabha.configuratt.cache
-    scabha.configuratt.cache.set_cache_dir(os.path.expanduser("~/.cache/stimela-configs"))
+    # a cache directory shared between users (e.g. on a cluster) can be given via the environment
+    scabha.configuratt.cache.set_cache_dir(os.path.expanduser("~/.cache/stimela-configs"),
+                                           shared_cachedir=os.environ.get("STIMELA_SHARED_CONFIG_CACHE"))
+    # parsed formulas are cached alongside the configs
+    import scabha.evaluator
+    scabha.evaluator.set_formula_cache_dir(scabha.configuratt.cache.CACHEDIR, version=f"stimela=={stimela.__version__}")
     # clear cache if requested
     if clear_cache:
         scabha.configuratt.cache.clear_cache(log)
+    if trust_cache:
+        scabha.configuratt.cache.TRUST_CACHE = True
 
     # load config files
     stimela.CONFIG = config.load_config(extra_configs=config_files, extra_dotlist=config_dotlist, include_paths=include,
@@ -88,6 +98,7 @@ def cli(config_files=[], config_dotlist=[], include=[], backend=None,
 
     if config.CONFIG_LOADED:
         log.info(f"loaded config from {config.CONFIG_LOADED}") 
+    log.debug(f"config cache: {dict(scabha.configuratt.cache.CACHE_STATS)}")
 
     # select backend, passing it any config options that have been set up
     if backend:
@@ -118,7 +129,7 @@ def cli(config_files=[], config_dotlist=[], include=[], backend=None,
 
 
 # import commands
-from stimela.commands import doc, run, build, save_config, cleanup
+from stimela.commands import doc, run, build, save_config, cleanup, cache
 
 ## These one needs to be reimplemented, current backed auto-pulls and auto-builds:
 # images, pull, build, clean
@@ -3,6 +3,7 @@ import  re
 import logging
 import traceback
 import copy
+import threading
 from types import TracebackType
 from typing import Optional, OrderedDict, Union, Any
 from omegaconf import DictConfig
@@ -172,29 +173,73 @@ def logger(name="STIMELA", propagate=False, boring=False, loglevel="INFO"):
 
     return _logger
 
+# file handlers are keyed by (logger name, log scope). Scopes allow loggers to be set up independently
+# by worker threads (see set_log_scope() below). The main thread uses a scope of None.
 _logger_file_handlers = {}
 _logger_console_handlers = {}
 
 # keep track of all log files opened
 _previous_logfiles = set()
 
+_log_scope = threading.local()
+_logfile_lock = threading.Lock()
+
+
+def get_log_scope():
+    """Returns log scope of current thread"""
+    return getattr(_log_scope, "scope", None)
+
+
+def set_log_scope(scope: Optional[str]):
+    """Sets log scope of current thread. Worker threads running e.g. scattered loop iterations set up 
+    their own scopes, so that the log files they set up are distinct from those set up by other threads.
+    Scopes are hierarchical: "0.1" inherits the file loggers of "0" and of the main thread, unless it
+    sets up its own.
+    """
+    _log_scope.scope = scope
+
+
+def close_log_scope(scope: str):
+    """Closes all file handlers set up within the given log scope"""
+    for (name, scope1), (_, fh) in list(_logger_file_handlers.items()):
+        if scope1 == scope:
+            fh.close()
+            logging.getLogger(name).removeHandler(fh)
+            del _logger_file_handlers[name, scope1]
+
+
+def _get_file_handler(log: logging.Logger, scope="current"):
+    """Returns (logfile, handler) tuple for given logger, in given scope (default is the current thread's scope)"""
+    return _logger_file_handlers.get((log.name, get_log_scope() if scope == "current" else scope), (None, None))
+
+
+def _effective_log_scope(logname: str):
+    """Returns nearest scope (in the current thread's scope hierarchy) with a file handler for the named logger"""
+    scope = get_log_scope()
+    while scope is not None:
+        if (logname, scope) in _logger_file_handlers:
+            return scope
+        scope = scope.rsplit(".", 1)[0] if "." in scope else None
+    return None
+
 
 def has_file_logger(log: logging.Logger):
-    return log.name in _logger_file_handlers
+    return _get_file_handler(log)[1] is not None
 
 
 def disable_file_logger(log: logging.Logger):
-    current_logfile, fh = _logger_file_handlers.get(log.name, (None, None))
+    current_logfile, fh = _get_file_handler(log)
     if fh is not None:
         fh.close()
         log.removeHandler(fh)
-        del _logger_file_handlers[log.name]
+        del _logger_file_handlers[log.name, get_log_scope()]
 
 
 class DelayedFileHandler(logging.FileHandler):
     """A version of FileHandler that also handles directory and symlink creation in a delayed way"""
-    def __init__(self, logfile, symlink, mode):
+    def __init__(self, logfile, symlink, mode, logname=None, scope=None):
         self.symlink, self.logfile = symlink, logfile
+        self.logname, self.scope = logname, scope
         self.is_open = False
         super().__init__(logfile, mode, delay=True)
 
@@ -204,7 +249,7 @@ class DelayedFileHandler(logging.FileHandler):
             self.is_open = True
             logdir = os.path.dirname(self.logfile)
             if logdir and not os.path.exists(logdir):            
-                os.makedirs(logdir)
+                os.makedirs(logdir, exist_ok=True)
                 if self.symlink:
                     symlink_path = os.path.join(os.path.dirname(logdir.rstrip("/")) or ".", self.symlink)
                     # remove existing symlink
@@ -215,6 +260,29 @@ class DelayedFileHandler(logging.FileHandler):
                         os.symlink(os.path.basename(logdir), symlink_path)
         return os.path.dirname(self.logfile)
 
+    def switch_to_append(self):
+        """Opens the logfile (truncating it first, if in 'w' mode), and switches to append mode"""
+        self.get_logfile_dir()
+        self.acquire()
+        try:
+            if self.mode != 'a':
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.flush()
+                self.stream.close()
+                self.mode = 'a'
+                self.stream = self._open()
+            elif self.stream is None:
+                self.stream = self._open()
+        finally:
+            self.release()
+
+    def filter(self, record):
+        # only log records emitted by threads that fall within our scope
+        if self.logname is not None and _effective_log_scope(self.logname) != self.scope:
+            return False
+        return super().filter(record)
+
     def emit(self, record):
         self.get_logfile_dir()
         return super().emit(record)
@@ -232,7 +300,8 @@ def setup_file_logger(log: logging.Logger, logfile: str, level: Optional[Union[i
     Returns:
         [logging.Logger]: logger object
     """
-    current_logfile, fh = _logger_file_handlers.get(log.name, (None, None))
+    scope = get_log_scope()
+    current_logfile, fh = _get_file_handler(log, scope)
     
     # does the logger need a new FileHandler created
     if current_logfile != logfile:
@@ -241,18 +310,25 @@ def setup_file_logger(log: logging.Logger, logfile: str, level: Optional[Union[i
         if fh is not None:
             fh.close()
             log.removeHandler(fh)
-        # if file was previously open, append, else overwrite
-        if logfile in _previous_logfiles:
-            mode = 'a'
-        else:
-            mode = 'w'
-            _previous_logfiles.add(logfile)
-        # create new FH
-        fh = DelayedFileHandler(logfile, symlink, mode)
+        with _logfile_lock:
+            # if file was previously open, append, else overwrite
+            if logfile in _previous_logfiles:
+                mode = 'a'
+            else:
+                mode = 'w'
+                _previous_logfiles.add(logfile)
+            # create new FH
+            fh = DelayedFileHandler(logfile, symlink, mode, logname=log.name, scope=scope)
+            # worker threads may set up handlers for the same logfile concurrently, so make sure they all 
+            # append, rather than have a delayed 'w' truncate or overwrite what another thread has written
+            if scope is not None:
+                for other_logfile, other_fh in list(_logger_file_handlers.values()) + [(logfile, fh)]:
+                    if other_logfile == logfile:
+                        other_fh.switch_to_append()
         fh.setFormatter(_log_file_formatter)
         log.addHandler(fh)
 
-        _logger_file_handlers[log.name] = logfile, fh
+        _logger_file_handlers[log.name, scope] = logfile, fh
 
         # if logging to console, disable propagation from this sub-logger, and add a console handler
         # This ensures that parent loggers that log to files to not get repeated messages
@@ -272,6 +348,15 @@ def setup_file_logger(log: logging.Logger, logfile: str, level: Optional[Union[i
     return log
 
 
+def log_option_unchanged(logopts: DictConfig, setting: str, value: Any) -> bool:
+    """Returns True if a log option is already set to the given value"""
+    try:
+        current = logopts.get(setting)
+    except Exception:
+        return False
+    return type(current) is type(value) and current == value
+
+
 def update_file_logger(log: logging.Logger, logopts: DictConfig, nesting: int = 0, subst: Optional[SubstitutionNS] = None, location=[]):
     """Updates logfiles associated with given logger based on option settings
 
@@ -309,7 +394,7 @@ def update_file_logger(log: logging.Logger, logopts: DictConfig, nesting: int =
 
 def get_logfile_dir(log: logging.Logger):
     """Returns filename associated with the logger, or None if not logging to file"""
-    logfile, fh = _logger_file_handlers.get(log.name, (None, None))
+    logfile, fh = _get_file_handler(log, _effective_log_scope(log.name))
     if logfile is None:
         return None
     return fh.get_logfile_dir()
@@ -5,6 +5,8 @@ import os.path
 from datetime import datetime, timedelta
 import contextlib
 import asyncio
+import threading
+import copy
 from typing import OrderedDict, Any, List, Callable, Optional
 from scabha.basetypes import EmptyListDefault
 from omegaconf import OmegaConf
@@ -20,12 +22,66 @@ from stimela import stimelogging
 # this is "" for the main process, ".0", ".1", for subprocesses, ".0.0" for nested subprocesses
 _subprocess_identifier = ""
 
+# worker threads (see init_thread_state()) keep their own subprocess ID and task stack here
+_thread_state = threading.local()
+
 def get_subprocess_id():
-    return _subprocess_identifier
+    return getattr(_thread_state, "subprocess_id", _subprocess_identifier)
 
 def add_subprocess_id(num: int):
+    set_subprocess_id(get_subprocess_id() + f".{num}")
+
+def set_subprocess_id(identifier: str):
     global _subprocess_identifier
-    _subprocess_identifier += f".{num}"
+    if hasattr(_thread_state, "subprocess_id"):
+        _thread_state.subprocess_id = identifier
+    else:
+        _subprocess_identifier = identifier
+
+def in_worker_thread():
+    """True if called from a worker thread set up by init_thread_state()"""
+    return hasattr(_thread_state, "task_stack")
+
+# cancellation tokens of the scattered loops that the current task is running under (see scatter.py)
+_cancel_tokens = ()
+
+def get_cancel_tokens():
+    return getattr(_thread_state, "cancel_tokens", _cancel_tokens)
+
+def is_cancelled():
+    """True if any of the scattered loops that the current task is running under has been cancelled. 
+    A loop is cancelled by creating its token file, which works across threads and processes alike."""
+    return any(os.path.exists(token) for token in get_cancel_tokens())
+
+def get_thread_state(picklable=False):
+    """Returns state to be passed to init_thread_state() of a worker thread, or init_worker_process() of
+    a worker process (in which case picklable=True drops the status reporters)"""
+    task_stack = [copy.copy(ti) for ti in _get_task_stack()]
+    if picklable:
+        for ti in task_stack:
+            ti.status_reporter = None
+    return task_stack, get_subprocess_id(), get_cancel_tokens()
+
+def init_thread_state(task_stack, subprocess_id, cancel_tokens=()):
+    """Sets up a worker thread (e.g. a scattered loop iteration) with its own task stack and subprocess ID,
+    inherited from the parent thread. Worker threads do not update the progress bar, 
+    much like worker processes."""
+    _thread_state.task_stack = task_stack
+    _thread_state.subprocess_id = subprocess_id
+    _thread_state.cancel_tokens = tuple(cancel_tokens)
+
+def init_worker_process(task_stack, subprocess_id, cancel_tokens=()):
+    """Sets up a worker process to run a task on behalf of the parent. Worker processes may be reused 
+    between tasks, so this resets the task stack, subprocess ID and stats to a clean slate."""
+    global _subprocess_identifier, _cancel_tokens
+    _task_stack[:] = task_stack
+    _subprocess_identifier = subprocess_id
+    _cancel_tokens = tuple(cancel_tokens)
+    with _taskstats_lock:
+        _taskstats.clear()
+        _task_start_time.clear()
+        _task_outcomes.clear()
+    destroy_progress_bar()
 
 progress_bar = progress_task = None
 
@@ -57,6 +113,9 @@ class TaskInformation(object):
 # stack of task information -- most recent subtask is at the end
 _task_stack = []
 
+def _get_task_stack():
+    return getattr(_thread_state, "task_stack", _task_stack)
+
 def init_progress_bar(boring=False):
     global progress_console, progress_bar, progress_task
     progress_console = rich.console.Console(file=sys.stdout, highlight=False)
@@ -94,29 +153,30 @@ def restate_progress():
 
 @contextlib.contextmanager
 def declare_subtask(subtask_name, status_reporter=None, hide_local_metrics=False):
+    task_stack = _get_task_stack()
     task_names = []
-    if _task_stack:
-        task_names = _task_stack[-1].names + \
-                    (_task_stack[-1].task_attrs or [])
+    if task_stack:
+        task_names = task_stack[-1].names + \
+                    (task_stack[-1].task_attrs or [])
     task_names.append(subtask_name)
-    _task_stack.append(
+    task_stack.append(
         TaskInformation(task_names, status_reporter=status_reporter, hide_local_metrics=hide_local_metrics)
     )
     update_process_status()
     try:
         yield subtask_name
     finally:
-        _task_stack.pop(-1)
+        task_stack.pop(-1)
         update_process_status()
 
 
 def declare_subtask_status(status):
-    _task_stack[-1].status = status
+    _get_task_stack()[-1].status = status
     update_process_status()
 
 
 def declare_subtask_attributes(*args, **kw):
-    _task_stack[-1].task_attrs = [str(x) for x in args] + \
+    _get_task_stack()[-1].task_attrs = [str(x) for x in args] + \
                                  [f"{key} {value}" for key, value in kw.items()]
     update_process_status()
 
@@ -124,13 +184,13 @@ def declare_subtask_attributes(*args, **kw):
 class _CommandContext(object):
     def __init__(self, command):
         self.command = command
-        _task_stack[-1].command = command
+        _get_task_stack()[-1].command = command
         update_process_status()
     def ctrl_c(self):
-        _task_stack[-1].command = f"{self.command}(^C)"
+        _get_task_stack()[-1].command = f"{self.command}(^C)"
         update_process_status()
     def update_status(self, status):
-        _task_stack[-1].command = f"{self.command} ({status})"
+        _get_task_stack()[-1].command = f"{self.command} ({status})"
         update_process_status()
 
 
@@ -140,7 +200,7 @@ def declare_subcommand(command):
     try:
         yield _CommandContext(command)
     finally:
-        _task_stack[-1].command = None
+        _get_task_stack()[-1].command = None
         update_process_status()
 
 
@@ -194,6 +254,10 @@ _taskstats_sample_names = [f.name for f in fields(TaskStatsDatum)]
 
 _taskstats = OrderedDict()
 _task_start_time = OrderedDict()
+_taskstats_lock = threading.Lock()
+
+# outcomes of scattered loop iterations, as task key: (outcome, number of attempts)
+_task_outcomes = OrderedDict()
 
 
 def collect_stats():
@@ -209,11 +273,49 @@ def collect_stats():
     return _taskstats
 
 
-def add_missing_stats(stats):
-    """Adds stats that weren't recorded into dictionary"""
+def collect_outcomes():
+    """Returns dictionary of recorded task outcomes"""
+    return _task_outcomes
+
+
+def add_missing_stats(stats, outcomes={}):
+    """Adds stats (and outcomes) that weren't recorded into dictionary"""
     for key, value in stats.items():
         if key not in _taskstats:
             _taskstats[key] = value
+    for key, value in outcomes.items():
+        if key not in _task_outcomes:
+            _task_outcomes[key] = value
+
+
+def _current_task_key():
+    task_stack = _get_task_stack()
+    if not task_stack:
+        return ()
+    return tuple(task_stack[-1].names + (task_stack[-1].task_attrs or []))
+
+
+def record_outcome(subtask_name: str, outcome: str, attempts: int = 1):
+    """Records the outcome of a subtask of the current task (e.g. a scattered loop iteration)"""
+    with _taskstats_lock:
+        _task_outcomes[_current_task_key() + (subtask_name,)] = outcome, attempts
+
+
+def discard_subtask_stats(subtask_name: str):
+    """Discards the stats and outcomes recorded for a subtask of the current task and everything below it,
+    e.g. for a failed attempt at a loop iteration that is about to be retried"""
+    prefix = _current_task_key() + (subtask_name,)
+    with _taskstats_lock:
+        for records in _taskstats, _task_start_time, _task_outcomes:
+            for key in [key for key in records if key[:len(prefix)] == prefix]:
+                del records[key]
+
+
+def declare_subtask_outcome(outcome: str):
+    """Records the outcome of the current task, if it's anything other than plain success or failure
+    (e.g. a step that timed out)"""
+    with _taskstats_lock:
+        _task_outcomes[_current_task_key()] = outcome, 1
 
 
 def stats_field_names():
@@ -221,25 +323,42 @@ def stats_field_names():
 
 
 def update_stats(now: datetime, sample: TaskStatsDatum):
-    if _task_stack:
-        ti = _task_stack[-1]
+    task_stack = _get_task_stack()
+    if task_stack:
+        ti = task_stack[-1]
         keys = [tuple(ti.names)]
         if ti.task_attrs:
             keys.append(tuple(ti.names + ti.task_attrs))
     else:
         keys = [()]
 
-    for key in keys:
-        _, sum, peak = _taskstats.setdefault(key, [0, TaskStatsDatum(), TaskStatsDatum()])
-        sum.add(sample)
-        peak.peak(sample)
-        start = _task_start_time.setdefault(key, now)
-        _taskstats[key][0] = (now - start).total_seconds()
+    # stats may be updated from multiple worker threads
+    with _taskstats_lock:
+        for key in keys:
+            _, sum, peak = _taskstats.setdefault(key, [0, TaskStatsDatum(), TaskStatsDatum()])
+            sum.add(sample)
+            peak.peak(sample)
+            start = _task_start_time.setdefault(key, now)
+            _taskstats[key][0] = (now - start).total_seconds()
+
+
+# most recent (time, load, available memory GB, total memory GB) seen by update_process_status()
+_system_sample = None
+
+def get_system_resources(max_age: float = 1.0):
+    """Returns (number of CPUs, load, available memory GB, total memory GB) for the local node.
+    Reuses the most recent sample taken by update_process_status() if it is younger than max_age seconds."""
+    sample = _system_sample
+    if sample is None or (datetime.now() - sample[0]).total_seconds() > max_age:
+        mem = psutil.virtual_memory()
+        sample = datetime.now(), psutil.getloadavg()[0], mem.available / 2**30, mem.total / 2**30
+    return (psutil.cpu_count() or 1,) + sample[1:]
 
 
 def update_process_status():
     # current subtask info
-    ti = _task_stack[-1] if _task_stack else None
+    task_stack = _get_task_stack()
+    ti = task_stack[-1] if task_stack else None
 
     # elapsed time since start
     now = datetime.now()
@@ -254,6 +373,8 @@ def update_process_status():
     s.mem_total = round(mem.total / 2**30)
     # load
     s.load, _, _ = psutil.getloadavg()
+    global _system_sample
+    _system_sample = now, s.load, mem.available / 2**30, mem.total / 2**30
 
     # get disk I/O stats
     disk_io = psutil.disk_io_counters()
@@ -284,11 +405,11 @@ def update_process_status():
     else:
         extra_metrics = None
 
-    # if a progress bar exists, update it
-    if progress_bar is not None:
+    # if a progress bar exists, update it (but leave it to the main thread)
+    if progress_bar is not None and not in_worker_thread():
         cpu_info = []
         # add local metering, if not diabled by a task in the stack
-        if not any(t.hide_local_metrics for t in _task_stack):
+        if not any(t.hide_local_metrics for t in task_stack):
             cpu_info = [
                 f"CPU [green]{s.cpu:2.1f}%[/green]",
                 f"RAM [green]{round(s.mem_used):3}[/green]/[green]{round(s.mem_total)}[/green]G",
@@ -422,6 +543,14 @@ def save_profiling_stats(log, print_depth=2, unroll_loops=False):
 
             stats_dict[name] = dict(elapsed=elapsed, avg=davg, peak=dpeak, total=dsum)
 
+    # add outcomes of scattered iterations (iterations cancelled before they started have no other stats)
+    for name, (outcome, attempts) in _task_outcomes.items():
+        name = '.'.join(name)
+        if name not in stats_dict:
+            stats_dict[name] = {}
+        stats_dict[name].outcome = outcome
+        stats_dict[name].attempts = attempts
+
     OmegaConf.save(stats_dict, filename)
 
     log.info(f"saved full profiling stats to {filename}")
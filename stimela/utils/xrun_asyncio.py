@@ -1,5 +1,6 @@
 import traceback
 import os
+import contextlib
 import signal
 import datetime
 import asyncio
@@ -8,7 +9,7 @@ from rich.markup import escape
 
 from stimela import stimelogging, task_stats
 
-from stimela.exceptions import StimelaCabRuntimeError, StimelaProcessRuntimeError
+from stimela.exceptions import StimelaCabRuntimeError, StimelaCabTimeoutError, StimelaProcessRuntimeError
 
 DEBUG = 0
 
@@ -46,10 +47,28 @@ def dispatch_to_log(log, line, command_name, stream_name, output_wrangler, style
 
 
 
+async def wait_on_process(proc, log):
+    """Waits for a process that has been sent a SIGINT to exit, escalating to SIGTERM and then SIGKILL if it doesn't"""
+    for retry in range(10):
+        await asyncio.sleep(1)
+        if proc.returncode is not None:
+            log.info(f"Process {proc.pid} has exited with return code {proc.returncode}")
+            break
+        if retry == 5:
+            log.warning(f"Process {proc.pid} not exited after {retry} seconds, will try to terminate it")
+            proc.terminate()
+        else:
+            log.info(f"Process {proc.pid} not exited after {retry} seconds, waiting a bit longer...")
+    else:
+        log.warning(f"Killing process {proc.pid}")
+        proc.kill()
+
+
 def xrun(command, options, log=None, env=None, timeout=-1, kill_callback=None, output_wrangler=None, shell=True, 
             return_errcode=False, command_name=None, progress_bar=False, 
             gentle_ctrl_c=False,
-            log_command=True, log_result=True):
+            log_command=True, log_result=True,
+            idle_output_timeout=None):
     
     command_name = command_name or command
 
@@ -95,9 +114,12 @@ def xrun(command, options, log=None, env=None, timeout=-1, kill_callback=None, o
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE))
 
+        last_output = start_time
         async def stream_reader(stream, stream_name):
+            nonlocal last_output
             while not stream.at_eof():
                 line = await stream.readline()
+                last_output = datetime.datetime.now()
                 line = (line.decode('utf-8') if type(line) is bytes else line).rstrip()
                 if line or not stream.at_eof():
                     dispatch_to_log(log, line, command_name, stream_name, output_wrangler=output_wrangler)
@@ -107,14 +129,46 @@ def xrun(command, options, log=None, env=None, timeout=-1, kill_callback=None, o
             for task in cancellables:
                 task.cancel()
 
+        has_timeout = timeout is not None and timeout > 0
+        has_idle_timeout = idle_output_timeout is not None and idle_output_timeout > 0
+        # set by the watchdog to "cancelled" or "timed out" when it interrupts the process, with a message
+        interrupted = interrupt_message = None
+        async def watchdog(proc):
+            """Interrupts the process if it exceeds its time limits, or if a scattered loop that we're 
+            running under is cancelled"""
+            nonlocal interrupted, interrupt_message
+            with contextlib.suppress(asyncio.CancelledError):
+                while interrupted is None:
+                    await asyncio.sleep(1)
+                    now = datetime.datetime.now()
+                    if task_stats.is_cancelled():
+                        interrupted = "cancelled"
+                        interrupt_message = f"{command_name} was interrupted after {elapsed()}, since the loop was cancelled"
+                    elif has_timeout and (now - start_time).total_seconds() > timeout:
+                        interrupted = "timed out"
+                        interrupt_message = f"{command_name} has exceeded its timeout of {timeout:g}s"
+                    elif has_idle_timeout and (now - last_output).total_seconds() > idle_output_timeout:
+                        interrupted = "timed out"
+                        interrupt_message = f"{command_name} has produced no output for {idle_output_timeout:g}s"
+                command_context.update_status(interrupted)
+                log.warning(f"{interrupt_message}, interrupting process {proc.pid}")
+                with contextlib.suppress(ProcessLookupError):
+                    proc.send_signal(signal.SIGINT)
+                    await wait_on_process(proc, log)
+
         reporter = asyncio.Task(task_stats.run_process_status_update())
+        # only run a watchdog if there's anything for it to watch
+        watchers = []
+        if has_timeout or has_idle_timeout or task_stats.get_cancel_tokens():
+            watchers.append(asyncio.Task(watchdog(proc)))
         ctrl_c_caught = job_interrupted = False
         try:
             job = asyncio.gather(
-                proc_awaiter(proc, reporter),
+                proc_awaiter(proc, reporter, *watchers),
                 stream_reader(proc.stdout, "stdout"),
                 stream_reader(proc.stderr, "stderr"),
-                reporter
+                reporter,
+                *watchers
             )
             results = loop.run_until_complete(job)
             status = proc.returncode
@@ -145,23 +199,7 @@ def xrun(command, options, log=None, env=None, timeout=-1, kill_callback=None, o
                     log.warning(f"Ctrl+C caught after {elapsed()}, interrupting {command_name} process {proc.pid}")
                     job_interrupted = True
                     proc.send_signal(signal.SIGINT)
-
-                    async def wait_on_process(proc):
-                        for retry in range(10):
-                            await asyncio.sleep(1)
-                            if proc.returncode is not None:
-                                log.info(f"Process {proc.pid} has exited with return code {proc.returncode}")
-                                break
-                            if retry == 5:
-                                log.warning(f"Process {proc.pid} not exited after {retry} seconds, will try to terminate it")
-                                proc.terminate()
-                            else:
-                                log.info(f"Process {proc.pid} not exited after {retry} seconds, waiting a bit longer...")
-                        else:
-                            log.warning(f"Killing process {proc.pid}")
-                            proc.kill()
-                    
-                    loop.run_until_complete(wait_on_process(proc))
+                    loop.run_until_complete(wait_on_process(proc, log))
             if job_interrupted:
                 raise StimelaCabRuntimeError(f"{command_name} interrupted with Ctrl+C")
             else:
@@ -172,6 +210,11 @@ def xrun(command, options, log=None, env=None, timeout=-1, kill_callback=None, o
             traceback.print_exc()
             raise StimelaCabRuntimeError(f"{command_name} threw exception: {exc} after {elapsed()}'", log=log)
 
+        if interrupted == "cancelled":
+            raise StimelaCabRuntimeError(interrupt_message)
+        if interrupted:
+            task_stats.declare_subtask_outcome("timeout")
+            raise StimelaCabTimeoutError(interrupt_message)
         if status and not return_errcode:
             raise StimelaCabRuntimeError(f"{command_name} returns error code {status} after {elapsed()}")
     
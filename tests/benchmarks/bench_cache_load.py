@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Benchmarks warm loading of config cache entries for a cab library (by default, the cult-cargo package,
+if installed), comparing the current entry format (marshalled plain containers, columnar dependencies)
+with the dill pickles used previously, of plain containers and of OmegaConf containers.
+
+Usage: python bench_cache_load.py [-n REPEATS] [FILE_OR_DIR ...]
+
+This is a standalone script rather than a test, since timings are only meaningful on a quiet machine.
+"""
+import argparse
+import time
+
+import dill as pickle
+from omegaconf import OmegaConf
+from scabha import configuratt
+from scabha.configuratt import cache
+
+from bench_config_load import find_configs
+
+
+def legacy_deps(deps):
+    """Returns dependencies in the form they used to be pickled in, i.e. as OmegaConf containers"""
+    return (OmegaConf.create(deps.deps),
+            OmegaConf.create({name: OmegaConf.structured(fail) for name, fail in deps.fails.items()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repeats", type=int, default=5, help="number of repeats (best time is reported)")
+    parser.add_argument("paths", nargs="*", help="config files or directories of config files")
+    args = parser.parse_args()
+
+    configs = find_configs(args.paths)
+    entries = []
+    for path in configs:
+        try:
+            conf, deps = configuratt._load_plain(path, use_sources=[], use_cache=False)
+        except Exception:
+            continue
+        deps.add(cache.__file__, version=configuratt.PACKAGE_VERSION)
+        entries.append((conf, deps))
+    print(f"encoding cache entries for {len(entries)} config files")
+
+    formats = {
+        "dill, OmegaConf": [pickle.dumps((OmegaConf.create(conf), legacy_deps(deps)), 2) for conf, deps in entries],
+        "dill, plain": [pickle.dumps((conf, legacy_deps(deps)), 2) for conf, deps in entries],
+        "marshal": [cache._encode_entry(conf, deps) for conf, deps in entries],
+    }
+
+    def load_marshal(data):
+        deps, load_conf = cache._decode_entry(data)
+        return load_conf(), deps
+
+    loaders = {"dill, OmegaConf": pickle.loads, "dill, plain": pickle.loads, "marshal": load_marshal}
+
+    results = {}
+    for label, blobs in formats.items():
+        timings = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            for data in blobs:
+                loaders[label](data)
+            timings.append(time.perf_counter() - start)
+        results[label] = min(timings)
+        size = sum(len(data) for data in blobs)
+        print(f"  {label:16}: {results[label]*1000:8.1f} ms, {size/1024:8.1f} kB")
+
+    for label in "dill, OmegaConf", "dill, plain":
+        print(f"speedup over {label}: {results[label] / results['marshal']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Benchmarks cold loading of a cab library (by default, the cult-cargo package, if installed),
+comparing configuratt's plain-container front end with parsing into OmegaConf containers up front.
+
+Usage: python bench_config_load.py [-n REPEATS] [FILE_OR_DIR ...]
+
+This is a standalone script rather than a test, since timings are only meaningful on a quiet machine.
+"""
+import argparse
+import glob
+import os.path
+import sys
+import time
+
+from omegaconf import OmegaConf
+from scabha import configuratt
+from scabha.configuratt import yaml_loader
+
+
+def find_configs(paths):
+    if not paths:
+        try:
+            import cultcargo
+        except ImportError:
+            print("cult-cargo is not installed, please specify config files or directories to load")
+            sys.exit(1)
+        paths = [os.path.dirname(cultcargo.__file__)]
+    configs = []
+    for path in paths:
+        if os.path.isdir(path):
+            configs += sorted(glob.glob(os.path.join(path, "*.yml")))
+        else:
+            configs.append(path)
+    return configs
+
+
+def load_all(configs):
+    nfail = 0
+    for path in configs:
+        try:
+            configuratt.load(path, use_sources=[], use_cache=False)
+        except Exception:
+            nfail += 1
+    return nfail
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repeats", type=int, default=5, help="number of repeats (best time is reported)")
+    parser.add_argument("paths", nargs="*", help="config files or directories of config files")
+    args = parser.parse_args()
+
+    configs = find_configs(args.paths)
+    print(f"loading {len(configs)} config files, libyaml is {'' if yaml_loader.HAVE_LIBYAML else 'not '}available")
+
+    results = {}
+    # parsing into OmegaConf containers makes configuratt resolve everything on those, as it used to
+    for label, loader in (("OmegaConf", OmegaConf.load), ("plain", yaml_loader.load_yaml)):
+        configuratt.load_yaml = loader
+        timings = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            nfail = load_all(configs)
+            timings.append(time.perf_counter() - start)
+        results[label] = min(timings)
+        print(f"  {label:10}: {results[label]*1000:8.1f} ms ({nfail} configs failed to load)")
+    configuratt.load_yaml = yaml_loader.load_yaml
+
+    print(f"speedup: {results['OmegaConf'] / results['plain']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
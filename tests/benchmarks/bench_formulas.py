@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Benchmarks evaluation of formulas, comparing compiled formulas with walking the parse tree.
+
+Usage: python bench_formulas.py [-n REPEATS] [-i ITERATIONS]
+
+This is a standalone script rather than a test, since timings are only meaningful on a quiet machine.
+"""
+import argparse
+import time
+from collections import OrderedDict
+
+from scabha.substitutions import SubstitutionNS, substitutions_from
+from scabha.evaluator import Evaluator, parse_string, compile_formula
+
+FORMULAS = [
+    "previous.x",
+    "IFSET(previous.xx, SELF, 2)",
+    "IF((previous.x+1)*previous.x == 2, previous.x == 1, previous.y == 0)",
+    "-previous.x + 3 * previous.x - 1",
+    "LIST(previous.x, previous.y, current.a)",
+    "IF(previous.xx, 1, 2, UNSET)",
+    "not IFSET(current.a)",
+    "SORT(previous.l)",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repeats", type=int, default=5, help="number of repeats (best time is reported)")
+    parser.add_argument("-i", "--iterations", type=int, default=1000, help="number of evaluations of each formula")
+    args = parser.parse_args()
+
+    ns = SubstitutionNS(previous={})
+    ns.previous.x = 1
+    ns.previous.y = 'y'
+    ns.previous.l = [3, 1, 2]
+    ns._add_("current", OrderedDict(a=1))
+
+    with substitutions_from(ns, raise_errors=True) as context:
+        evaltor = Evaluator(ns, context, location=['bench'])
+        # parse and compile up front, so that only evaluation is timed
+        parsed = [parse_string(text) for text in FORMULAS]
+        compiled = [compile_formula(text) for text in FORMULAS]
+
+        methods = {
+            "tree walk": lambda: [evaltor._evaluate_result(result, allow_unset=True) for result in parsed],
+            "compiled": lambda: [formula(evaltor, True) for formula in compiled],
+        }
+
+        results = {}
+        for label, method in methods.items():
+            timings = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                for _ in range(args.iterations):
+                    method()
+                timings.append(time.perf_counter() - start)
+            results[label] = min(timings)
+            print(f"  {label:10}: {results[label]*1000:8.1f} ms for {args.iterations} x {len(FORMULAS)} formulas")
+
+    print(f"speedup: {results['tree walk'] / results['compiled']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
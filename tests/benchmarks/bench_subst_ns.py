@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Benchmarks the substitution namespace operations done by a for-loop recipe whose steps are sub-recipes:
+for each iteration and step, the step's namespace entries are set up, the namespace is copied, and the
+sub-recipe builds its own namespace (with the full config in it) and does a few substitutions.
+
+Compares lazy conversion of nested mappings into namespaces with converting them up front (emulated by
+looking up every nested namespace after it is added). Reports time and peak memory use.
+
+Usage: python bench_subst_ns.py [-i ITERATIONS] [-s STEPS]
+
+This is a standalone script rather than a test, since timings are only meaningful on a quiet machine.
+"""
+import argparse
+import time
+import tracemalloc
+
+import stimela
+from stimela import config
+from scabha.substitutions import SubstitutionNS, substitutions_from
+
+
+def convert_all(ns):
+    """Converts all nested mappings in a namespace, as SubstitutionNS used to do when they were added"""
+    for value in ns.values():
+        if isinstance(value, SubstitutionNS):
+            convert_all(value)
+    return ns
+
+
+def run_loop(conf, iterations, nsteps, eager):
+    convert = convert_all if eager else (lambda ns: ns)
+    subst = SubstitutionNS()
+    subst._add_('info', SubstitutionNS(fqname="loop", label='', label_parts=[], suffix='', taskname="loop"), nosubst=True)
+    subst._add_('config', conf, nosubst=True)
+    subst._add_('steps', {}, nosubst=True)
+    subst._add_('previous', {}, nosubst=True)
+    subst.recipe = SubstitutionNS(ms="test.ms", prefix="out", nested=dict(a=1, b=dict(c=2)))
+    convert(subst)
+    for count in range(iterations):
+        subst.info.taskname = f"loop.{count}"
+        for step in range(nsteps):
+            label = f"step{step}"
+            params = dict(ms="test.ms", index=count, opts=dict(niter=100, gain=0.1))
+            subst.current = params
+            subst.steps[label] = subst.current
+            convert(subst.current)
+            # the sub-recipe's namespace, see Recipe._run()
+            sub = subst.copy()
+            info = SubstitutionNS(fqname=f"loop.{label}", label='', label_parts=[], suffix='', taskname=f"loop.{count}.{label}")
+            sub._add_('info', info.copy(), nosubst=True)
+            sub._add_('config', conf, nosubst=True)
+            sub._add_('steps', {}, nosubst=True)
+            sub._add_('previous', {}, nosubst=True)
+            sub._add_('current', {}, nosubst=True)
+            sub.recipe = SubstitutionNS(**params)
+            sub.root = subst.recipe
+            convert(sub)
+            with substitutions_from(sub, raise_errors=True) as context:
+                context.evaluate("{root.prefix}-{info.taskname}-{recipe.index}-{recipe.opts.niter}.log")
+                context.evaluate("{config.opts.log.dir}/{config.opts.log.name}")
+            subst.previous = dict(params, output=f"out-{count}.ms")
+            subst.steps[label] = subst.previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-i", "--iterations", type=int, default=500, help="number of loop iterations")
+    parser.add_argument("-s", "--steps", type=int, default=3, help="number of steps per iteration")
+    args = parser.parse_args()
+
+    stimela.CONFIG = conf = config.load_config(extra_configs=[])
+
+    results = {}
+    for label, eager in ("up front", True), ("lazy", False):
+        tracemalloc.start()
+        start = time.perf_counter()
+        run_loop(conf, args.iterations, args.steps, eager)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[label] = elapsed
+        print(f"  {label:8}: {elapsed:8.2f} s, peak memory {peak/2**20:8.1f} MB")
+
+    print(f"speedup: {results['up front'] / results['lazy']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
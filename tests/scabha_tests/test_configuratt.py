@@ -1,5 +1,9 @@
 import sys
 import os.path
+import time
+import shutil
+import subprocess
+import importlib
 import pytest
 from scabha import configuratt
 from scabha.configuratt import ConfigurattError
@@ -52,5 +56,268 @@ def test_includes():
     print(f"Dependencies are: {deps.get_description()}")
 
 
+def test_cache(tmp_path, monkeypatch):
+    from scabha.configuratt import cache
+    old_dirs = cache.CACHEDIR, cache.SHARED_CACHEDIR
+    cache.set_cache_dir(str(tmp_path / "private"), shared_cachedir=str(tmp_path / "shared"))
+    try:
+        path = str(tmp_path / "conf.yml")
+        with open(path, "wt") as f:
+            f.write("x:\n  y: 1\n")
+        # loading populates the private cache only
+        conf, deps = configuratt.load(path, use_sources=[], verbose=True)
+        assert conf.x.y == 1
+        assert not os.path.exists(tmp_path / "shared")
+        assert configuratt.load_cache([path])[0] is not None
+        # the shared cache is only written to explicitly
+        monkeypatch.setattr(cache, "PUBLISH_TO_SHARED_CACHE", True)
+        configuratt.load(path, use_sources=[])
+        monkeypatch.setattr(cache, "PUBLISH_TO_SHARED_CACHE", False)
+        entry_name = cache._compute_hash([path], [])
+        assert os.path.exists(tmp_path / "shared" / entry_name)
+        os.unlink(tmp_path / "private" / entry_name)
+        assert configuratt.load_cache([path])[0] is not None
+        assert configuratt.load_cache([path], shared=False)[0] is None
+        # entries writable by others are not trusted
+        os.chmod(tmp_path / "shared" / entry_name, 0o666)
+        assert configuratt.load_cache([path])[0] is None
+        os.chmod(tmp_path / "shared" / entry_name, 0o644)
+        # and neither are pickled ones
+        with open(tmp_path / "shared" / entry_name, "wb") as f:
+            f.write(cache._encode_entry(OmegaConf.create(dict(x=1)), deps))
+        assert configuratt.load_cache([path])[0] is None
+        os.unlink(tmp_path / "shared" / entry_name)
+        configuratt.load(path, use_sources=[])
+        # touching the file doesn't invalidate the cache, since it is keyed on content
+        os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+        assert configuratt.load_cache([path])[0] is not None
+        # changing the content does
+        with open(path, "wt") as f:
+            f.write("x:\n  y: 2\n")
+        assert configuratt.load_cache([path])[0] is None
+        conf, deps = configuratt.load(path, use_sources=[], verbose=True)
+        assert conf.x.y == 2
+    finally:
+        cache.CACHEDIR, cache.SHARED_CACHEDIR = old_dirs
+
+
+
+
+def test_cache_format(tmp_path, monkeypatch):
+    from scabha.configuratt import cache
+    old_dirs = cache.CACHEDIR, cache.SHARED_CACHEDIR
+    cache.set_cache_dir(str(tmp_path / "cache"), shared_cachedir="")
+    try:
+        path = str(tmp_path / "conf.yml")
+        with open(path, "wt") as f:
+            f.write("_include: missing.yml[optional]\nx:\n  y: [1, 2]\n")
+        conf, deps = configuratt.load(path, use_sources=[])
+        # second load comes from the cache, which holds plain containers, and remembers the failed include
+        conf1, deps1 = configuratt.load(path, use_sources=[])
+        assert conf1 == conf
+        assert deps1.deps == deps.deps
+        assert list(deps1.fails) == ["missing.yml"]
+        entry, = cache.list_entries()
+        with open(entry.path, "rb") as f:
+            assert f.read(cache._ENTRY_HEADER.size)[-5] == cache._CODEC_MARSHAL
+        # the include appearing invalidates the entry
+        with open(str(tmp_path / "missing.yml"), "wt") as f:
+            f.write("z: 1\n")
+        assert configuratt.load_cache([path])[0] is None
+        # unless the cache is trusted
+        monkeypatch.setattr(cache, "TRUST_CACHE", True)
+        assert configuratt.load_cache([path])[0] == conf
+        monkeypatch.setattr(cache, "TRUST_CACHE", False)
+        # structured configs are pickled
+        structured, _ = configuratt.load_nested(["test_nest_a.yml"], typeinfo=Dict[str, Any], nameattr="_name")
+        structured1, _ = configuratt.load_nested(["test_nest_a.yml"], typeinfo=Dict[str, Any], nameattr="_name")
+        assert OmegaConf.to_container(structured1) == OmegaConf.to_container(structured)
+    finally:
+        cache.CACHEDIR, cache.SHARED_CACHEDIR = old_dirs
+
+
+def test_deps_check(tmp_path, monkeypatch):
+    from scabha.configuratt import deps as deps_module
+    deps = deps_module.ConfigDependencies()
+    for i in range(6):
+        subdir = tmp_path / f"dir{i}"
+        subdir.mkdir()
+        for j in range(3):
+            (subdir / f"conf{j}.yml").write_text(f"x: {j}\n")
+            deps.add(str(subdir / f"conf{j}.yml"))
+        deps.add(str(subdir))
+    mtime = max(os.path.getmtime(f) for f in deps.deps) + 60
+    for threshold in 100, 1:
+        monkeypatch.setattr(deps_module, "PARALLEL_CHECK_THRESHOLD", threshold)
+        assert not deps.have_deps_changed(mtime)
+    # touching a file doesn't count as a change, but changing its content does
+    path = tmp_path / "dir3" / "conf1.yml"
+    os.utime(path, (mtime + 10,) * 2)
+    assert not deps.have_deps_changed(mtime)
+    path.write_text("x: 2\n")
+    assert deps.have_deps_changed(mtime)
+    path.write_text("x: 1\n")
+    assert not deps.have_deps_changed(mtime)
+    # a file disappearing is a change, as is a directory being updated
+    (tmp_path / "dir5" / "conf2.yml").unlink()
+    assert deps.have_deps_changed(mtime)
+    (tmp_path / "dir5" / "conf2.yml").write_text("x: 2\n")
+    assert not deps.have_deps_changed(mtime)
+    assert deps.have_deps_changed(os.path.getmtime(tmp_path / "dir5") - 1)
+
+
+def test_include_index(tmp_path, monkeypatch):
+    from scabha.configuratt import include_index
+    import scabha
+    (tmp_path / "a.yml").write_text("x: 1\n")
+    os.symlink(str(tmp_path / "missing.yml"), str(tmp_path / "dangling.yml"))
+    os.utime(tmp_path, (time.time() - 100,) * 2)
+    with include_index.session():
+        assert include_index.exists(str(tmp_path / "a.yml"))
+        assert not include_index.exists(str(tmp_path / "b.yml"))
+        assert not include_index.exists(str(tmp_path / "dangling.yml"))
+        assert not include_index.exists(str(tmp_path / "nodir" / "a.yml"))
+        # within a session, the directory is not checked again
+        (tmp_path / "b.yml").write_text("x: 1\n")
+        assert not include_index.exists(str(tmp_path / "b.yml"))
+    # but the next session sees that it has changed
+    with include_index.session():
+        assert include_index.exists(str(tmp_path / "b.yml"))
+    assert include_index.module_root("scabha") == os.path.dirname(scabha.__file__)
+    for _ in range(2):
+        with pytest.raises(ImportError):
+            include_index.module_root("no_such_module_hopefully")
+    # failed imports are only remembered within a session
+    monkeypatch.syspath_prepend(str(tmp_path))
+    with include_index.session():
+        with pytest.raises(ImportError):
+            include_index.module_root("configuratt_late_module")
+        (tmp_path / "configuratt_late_module.py").write_text("")
+        importlib.invalidate_caches()
+        with pytest.raises(ImportError):
+            include_index.module_root("configuratt_late_module")
+    with include_index.session():
+        assert include_index.module_root("configuratt_late_module") == str(tmp_path)
+
+def test_cache_eviction(tmp_path):
+    from scabha.configuratt import cache
+    old_dirs = cache.CACHEDIR, cache.SHARED_CACHEDIR
+    cache.set_cache_dir(str(tmp_path / "cache"), shared_cachedir="")
+    try:
+        paths = []
+        for i in range(3):
+            path = str(tmp_path / f"conf{i}.yml")
+            with open(path, "wt") as f:
+                f.write(f"x: {i}\n")
+            configuratt.load(path, use_sources=[])
+            paths.append(path)
+        entries = cache.list_entries()
+        assert len(entries) == 3
+        # make entries progressively older, then use the oldest one, making the second one least recently used
+        for i, path in enumerate(paths):
+            entry_path = os.path.join(cache.CACHEDIR, cache._compute_hash([path], []))
+            os.utime(entry_path, (os.path.getmtime(entry_path) - 10*(3 - i),) * 2)
+        hits = cache.CACHE_STATS["hits"]
+        assert configuratt.load_cache([paths[0]])[0] == dict(x=0)
+        assert cache.CACHE_STATS["hits"] == hits + 1
+        nremoved, _ = cache.prune_cache(sum(entry.size for entry in entries) - 1)
+        assert nremoved == 1
+        assert configuratt.load_cache([paths[1]])[0] is None
+        # stale and unreadable entries fail verification
+        with open(str(tmp_path / "cache" / ("0" * 64)), "wb") as f:
+            f.write(b"junk")
+        assert cache.verify_cache()[0] == 2
+        nvalid, invalid = cache.verify_cache(remove=True)
+        assert nvalid == 2 and len(invalid) == 1
+        assert len(cache.list_entries()) == 2
+    finally:
+        cache.CACHEDIR, cache.SHARED_CACHEDIR = old_dirs
+
+def test_parallel_load(monkeypatch):
+    nested = ["test_nest_a.yml", "test_nest_b.yml", "test_nest_c.yml"] * 4
+    conf1, deps1 = configuratt.load_nested(nested, typeinfo=Dict[str, Any], nameattr="_name",
+                                            use_cache=False, parallel=False)
+    # force the process pool even for a handful of files
+    monkeypatch.setattr(configuratt, "PARALLEL_LOAD_THRESHOLD", 1)
+    monkeypatch.setattr(configuratt, "PARALLEL_LOAD_WORKERS", 2)
+    conf2, deps2 = configuratt.load_nested(nested, typeinfo=Dict[str, Any], nameattr="_name", use_cache=False)
+    assert OmegaConf.to_container(conf1) == OmegaConf.to_container(conf2)
+    assert list(conf1.keys()) == list(conf2.keys())
+    assert set(deps1.deps.keys()) == set(deps2.deps.keys())
+
+
+def test_plain_loading():
+    from scabha.configuratt.resolvers import _merge_plain
+    # plain front end parses the same way as OmegaConf
+    for path in ["testconf.yaml", "test_nest_a.yml"]:
+        assert OmegaConf.create(configuratt.load_yaml(path)) == OmegaConf.load(path)
+    # and merges the same way
+    base = dict(a=dict(x=1, y=[1, 2]), b="???", c=dict(z=1), d=None)
+    over = dict(a=dict(y=[3], w=2), b=dict(x=1), c="???", d=dict(e=1), e="${a.x}")
+    expected = OmegaConf.merge(OmegaConf.create(base), OmegaConf.create(over))
+    merged = _merge_plain({}, base, over)
+    assert OmegaConf.create(merged) == expected
+    assert list(merged.keys()) == list(expected.keys())
+    # sources are copied
+    merged["a"]["y"].append(4)
+    assert over["a"]["y"] == [3]
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+def test_git_info(tmp_path):
+    from scabha.configuratt import gitinfo
+    from scabha.configuratt.deps import ConfigDependencies
+
+    def git(*args):
+        return subprocess.check_output(["git", "-c", "user.name=test", "-c", "user.email=test@test",
+                                        *args], cwd=repo).decode().strip()
+
+    def describe(root):
+        gitinfo._repo_info.clear()
+        return gitinfo.read_git_info(root)
+
+    repo = tmp_path / "repo"
+    subdir = repo / "sub" / "dir"
+    subdir.mkdir(parents=True)
+    git("init", "-q", "-b", "main")
+    (subdir / "test.yml").write_text("x: 1\n")
+    git("add", ".")
+    git("commit", "-q", "-m", "initial")
+    git("remote", "add", "origin", "https://example.com/repo.git")
+    git("remote", "add", "fork", "git@example.com:fork/repo.git")
+    git("remote", "set-url", "--push", "fork", "git@example.com:fork/push.git")
+    git("config", "branch.main.remote", "origin")
+    git("config", "branch.main.merge", "refs/heads/main")
+
+    assert gitinfo.find_repo_root(str(subdir)) == str(repo)
+    assert gitinfo.find_repo_root(str(tmp_path)) is None
+    info = describe(str(repo))
+    sha = git("rev-parse", "HEAD")
+    assert info["describe"] == git("describe", "--abbrev=16", "--always", "--long", "--all")
+    assert info["remotes"] == git("remote", "-v").split("\n")
+    assert info["branch"] == f"main {sha[:7]} [origin/main]"
+    # packed refs give the same result
+    git("pack-refs", "--all")
+    assert describe(str(repo)) == info
+    # tags pointing at HEAD are preferred over the branch, annotated ones over lightweight ones
+    git("tag", "v1.0-light")
+    assert describe(str(repo))["describe"] == git("describe", "--abbrev=16", "--always", "--long", "--all")
+    git("tag", "-a", "-m", "release", "v1.0")
+    assert describe(str(repo))["describe"] == git("describe", "--abbrev=16", "--always", "--long", "--all")
+    git("pack-refs", "--all")
+    assert describe(str(repo))["describe"] == git("describe", "--abbrev=16", "--always", "--long", "--all")
+    # tagged detached HEAD
+    git("checkout", "-q", "--detach")
+    assert describe(str(repo))["describe"] == git("describe", "--abbrev=16", "--always", "--long", "--all")
+    # untagged detached HEAD is left to git
+    git("commit", "-q", "--allow-empty", "-m", "second")
+    with pytest.raises(gitinfo.UnsupportedGitLayout):
+        describe(str(repo))
+    ConfigDependencies._git_cache.clear()
+    assert ConfigDependencies()._get_git_info(str(subdir))["describe"] == \
+        git("describe", "--abbrev=16", "--always", "--long", "--all")
+    assert ConfigDependencies()._get_git_info(str(tmp_path)) is None
+
+
 if __name__ == "__main__":
-    test_includes()
\ No newline at end of file
+    test_includes()
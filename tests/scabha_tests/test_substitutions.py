@@ -1,9 +1,9 @@
 import pytest
 import traceback
-from scabha.exceptions import SubstitutionError
+from scabha.exceptions import SubstitutionError, ParserError
 from scabha.substitutions import *
 from omegaconf import OmegaConf 
-from scabha.evaluator import UNSET, Evaluator
+from scabha.evaluator import UNSET, Evaluator, parse_string, compile_formula
 from scabha.validate import Unresolved
 
 def test_subst():
@@ -101,7 +101,120 @@ def test_subst():
         print(f"Error as expected ({exc})")
 
 
-            
+
+
+def test_lazy_namespaces():
+    """Nested mappings are converted into namespaces on first lookup, with the same results as before"""
+    import pickle
+    from collections import OrderedDict
+    
+    conf = OmegaConf.create(dict(opts=dict(log=dict(dir="logs", name="{info.fqname}"))))
+    params = dict(a=1, b=dict(c="{recipe.a}"))
+    ns = SubstitutionNS()
+    ns._add_("config", conf, nosubst=True)
+    ns._add_("info", dict(fqname="x"), nosubst=True)
+    ns.recipe = params
+    # later changes to the dict are not seen
+    params["a"] = 2
+    # copies share nested namespaces
+    ns1 = ns.copy()
+    assert OrderedDict.__getitem__(ns, "recipe") is OrderedDict.__getitem__(ns1, "recipe")
+    ns1.recipe.d = 3
+    assert ns.recipe.d == 3
+    # dotted names and merges go into the nested namespace
+    ns._add_("config.opts.log.level", 1)
+    ns.recipe._merge_(dict(b=dict(e=4)))
+    assert isinstance(ns.config.opts.log, SubstitutionNS)
+    assert ns.config.opts.log._nosubst_
+    assert ns.config.opts.log.level == 1
+    assert list(ns.recipe.b.keys()) == ["c", "e"]
+
+    for ns2 in ns, pickle.loads(pickle.dumps(ns1)):
+        with substitutions_from(ns2, raise_errors=True) as context:
+            assert context.evaluate("{recipe.a}-{recipe.b.c}-{recipe.d}") == "1-1-3"
+            assert context.evaluate("{config.opts.log.dir}/{config.opts.log.name}") == "logs/{info.fqname}"
+        assert all(isinstance(value, SubstitutionNS) for value in ns2.values())
+
+
+def test_memoized_evaluation(monkeypatch):
+    """Memoized evaluations are reused until a namespace lookup they depend on changes"""
+    from scabha.validate import evaluate_and_substitute
+
+    evaluated = []
+    _evaluate = Evaluator._evaluate
+    def counting_evaluate(self, value, sublocation):
+        evaluated.append(sublocation[-1])
+        return _evaluate(self, value, sublocation)
+    monkeypatch.setattr(Evaluator, "_evaluate", counting_evaluate)
+
+    ns = SubstitutionNS()
+    ns._add_("info", dict(label="a"), nosubst=True)
+    ns.recipe = dict(x=1, y="{info.label}")
+    assign = dict(a="{info.label}-x", b="=recipe.x + 1", c="=GLOB('*.nonexistent')", 
+                  d="=IFSET(recipe.missing, 1, 2)", e="{recipe.y}", f="=LIST(recipe.x)")
+
+    def evaluate(memoize=True):
+        evaluated.clear()
+        return evaluate_and_substitute(assign, ns, ns.recipe, location=["test"], memoize=memoize)
+
+    results = evaluate()
+    assert results == dict(a="a-x", b=2, c=[], d=2, e="a", f=[1])
+    assert sorted(evaluated) == list("abcdef")
+    assert ns.recipe.a == "a-x"
+    # only the GLOB is redone
+    assert evaluate() == results
+    assert evaluated == ["c"]
+    # results are not shared
+    results["f"].append(2)
+    assert evaluate()["f"] == [1]
+    # changes are picked up, including of names that were missing
+    ns.info.label = "b"
+    ns.recipe.missing = True
+    results = evaluate()
+    assert results == dict(a="b-x", b=2, c=[], d=1, e="b", f=[1])
+    assert sorted(evaluated) == list("acde")
+    assert evaluate(memoize=False) == results
+    # a different namespace has its own memo
+    ns1 = ns.copy()
+    evaluated.clear()
+    evaluate_and_substitute(assign, ns1, ns1.recipe, location=["test"], memoize=True)
+    assert sorted(evaluated) == list("abcdef")
+
+
+def test_templates():
+    """Precompiled templates must give the same results and errors as string.Formatter"""
+    from scabha.substitutions import compile_template
+
+    ns = SubstitutionNS(foo={}, bar={})
+    ns.foo.a = 1
+    ns.foo.b = "{foo.a}{{}}"
+    ns.foo.l = [1, 2, 3]
+    ns.foo.x = 1.5
+    ns.bar.d = "{bar.d}"
+
+    strings = ["plain", "{foo.a}", "x{foo.a}y{foo.b}z", "{{escaped}} {foo.a}", "{foo.l[1]}", "{foo.x:.3f}",
+               "{foo.a!r}", "{foo.a:{foo.a}}", "{}", "{0}", "{foo.a", "}", "{foo.c}", "{foo.a.b}", "{bar.d}",
+               "{foo.a!z}", "{foo.a:xx}", "{foo*.a}"]
+    
+    assert compile_template("{foo.a:{foo.a}}") is None
+    assert compile_template("{0}") is None
+    assert compile_template("x{foo.l[1]}") == (("x", ("foo", ((True, "l"), (False, 1)), None, "")),)
+    assert compile_template("{foo.a}") is compile_template("{foo.a}")
+
+    for forgive in None, "XX":
+        results = []
+        for method in "_format", "formatter":
+            outputs = []
+            context_manager = forgiving_substitutions_from(ns, forgive) if forgive else substitutions_from(ns)
+            with context_manager as context:
+                if method == "formatter":
+                    context._format = context.formatter.format
+                for value in strings:
+                    outputs.append(context.evaluate(value, location=["test"]))
+                outputs += [str(err) for err in context.errors]
+            results.append(outputs)
+        assert results[0] == results[1]
+
         
 def test_formulas():
 
@@ -169,6 +282,87 @@ def test_formulas():
         assert r['r'] == False
         assert r['t'] == 'zz'
 
+
+def test_compiled_formulas():
+    """Compiled formulas must give the same results as walking the parse tree"""
+    ns = SubstitutionNS(previous={})
+    ns.previous.x = 1
+    ns.previous.y = 'y'
+    ns.previous.l = [3, 1, 2]
+    ns._add_("current", OrderedDict(a=1))
+
+    formulas = [
+        "previous.x", "previous.xx", "IFSET(previous.x)", "IFSET(previous.xx)", "IFSET(previous.x,SELF,2)",
+        "IFSET(previous.xx,SELF,2)", "IF(previous.xx, 1, 2, UNSET)", "not IFSET(previous.xx)",
+        "IF((previous.x+1)*previous.x == 2, previous.x == 1, previous.y == 0)", "-previous.x + 3 * 2",
+        "LIST(previous.x, 'a', UNSET)", "SORT(previous.l)", "previous.y + 1", "previous.xx + 1",
+        "GLOB('*.nonexistent')", "EMPTY",
+    ]
+    def outcome(func):
+        try:
+            value = func()
+        except Exception as exc:
+            return type(exc)
+        return UNSET if type(value) is UNSET else value
+
+    with substitutions_from(ns, raise_errors=True) as context:
+        evaltor = Evaluator(ns, context, location=['top'])
+        for text in formulas:
+            expected = outcome(lambda: evaltor._evaluate_result(parse_string(text), allow_unset=True))
+            assert outcome(lambda: compile_formula(text)(evaltor, True)) == expected, text
+            if not (isinstance(expected, type) and issubclass(expected, Exception)):
+                assert outcome(lambda: evaltor.evaluate("=" + text)) == expected, text
+        # compiled formulas are cached
+        assert compile_formula("previous.x") is compile_formula("previous.x")
+
+
+def test_formula_disk_cache(tmp_path, monkeypatch):
+    """Parsed formulas stored on disk are reused without constructing the parser"""
+    from scabha import evaluator
+
+    ns = SubstitutionNS(previous={})
+    ns.previous.x = 1
+    ns.previous.l = [3, 1, 2]
+    formulas = {"previous.x": 1, "IFSET(previous.xx,SELF,2)": 2, "SORT(previous.l)": [1, 2, 3],
+                "-previous.x + 3 * 2": 5, "IF(previous.xx, 1, 2, UNSET)": UNSET}
+
+    def evaluate_all():
+        with substitutions_from(ns, raise_errors=True) as context:
+            evaltor = Evaluator(ns, context, location=['top'])
+            for text, value in formulas.items():
+                result = evaltor.evaluate("=" + text)
+                assert (result is UNSET or type(result) is UNSET) if value is UNSET else result == value, text
+            with pytest.raises(ParserError):
+                evaltor.evaluate("=IF(previous.x")
+
+    try:
+        evaluator.set_formula_cache_dir(str(tmp_path), version="test")
+        evaluator._compile_formula.cache_clear()
+        evaluate_all()
+        evaluator.save_formula_cache()
+        assert len(list(tmp_path.glob("formulas-*.marshal"))) == 1
+
+        # a fresh session should not need the parser
+        evaluator.set_formula_cache_dir(str(tmp_path), version="test")
+        evaluator._compile_formula.cache_clear()
+        monkeypatch.setattr(evaluator, "_parser", None)
+        construct_parser = evaluator.construct_parser
+        monkeypatch.setattr(evaluator, "construct_parser", None)
+        evaluate_all()
+        assert evaluator._parser is None
+
+        # a different version doesn't see the entries
+        monkeypatch.setattr(evaluator, "construct_parser", construct_parser)
+        evaluator.set_formula_cache_dir(str(tmp_path), version="other")
+        evaluator._compile_formula.cache_clear()
+        evaluate_all()
+        assert evaluator._parser is not None
+    finally:
+        evaluator.set_formula_cache_dir(None)
+        evaluator._compile_formula.cache_clear()
+
+
 if __name__ == "__main__":
     test_subst()
     test_formulas()
+    test_compiled_formulas()
@@ -1,4 +1,5 @@
-import os, re, subprocess, pytest
+import os, re, shutil, subprocess, pytest
+from omegaconf import OmegaConf
 
 
 # Change into directory where test_recipy.py lives
@@ -108,3 +109,191 @@ def test_scatter():
     print("===== expecting no errors now =====")
     retcode = os.system("stimela -v -b native exec test_scatter.yml nested_loop")
     assert retcode == 0
+
+    print("===== expecting no errors now =====")
+    retcode = os.system("stimela -v -b native -s opts.runtime.max_workers=4 exec test_scatter.yml nested_loop")
+    assert retcode == 0
+
+    print("===== expecting no errors now =====")
+    retcode = os.system("stimela -v -b native exec test_scatter.yml thread_loop")
+    assert retcode == 0
+
+    print("===== expecting no errors now =====")
+    retcode = os.system("stimela -v -b native exec test_scatter.yml asyncio_loop")
+    assert retcode == 0
+
+    print("===== expecting no errors now =====")
+    retcode = os.system("stimela -v -b native exec test_scatter.yml nested_loop for_loop.engine=thread")
+    assert retcode == 0
+
+    print("===== expecting no errors now =====")
+    retcode, output = run("stimela -v -b native exec test_scatter.yml resource_loop")
+    assert retcode == 0
+    assert verify_output(output, "each iteration is expected to")
+
+    print("===== expecting no errors now =====")
+    retcode, output = run("stimela -v -b native exec test_scatter.yml chunked_loop")
+    assert retcode == 0
+    assert verify_output(output, "running 20 iterations in 10")
+
+    print("===== expecting no errors now =====")
+    retcode = os.system("stimela -v -b native exec test_scatter.yml chunked_loop for_loop.engine=thread for_loop.chunk_size=3")
+    assert retcode == 0
+
+def test_scatter_failures():
+    for engine in "process", "thread":
+        print("===== expecting an error now, with the remaining iterations cancelled =====")
+        retcode, output = run(f"stimela -v -b native exec test_scatter.yml fail_fast_loop for_loop.engine={engine}")
+        assert retcode != 0
+        assert verify_output(output, "cancelling remaining iterations", "sleep was interrupted after")
+        assert "1/4 jobs have failed, 3 cancelled" in output
+
+    shutil.rmtree("tmp/retry", ignore_errors=True)
+    os.makedirs("tmp/retry")
+    print("===== expecting no errors now, after retries =====")
+    retcode, output = run("stimela -v -b native exec test_scatter.yml retry_loop")
+    assert retcode == 0
+    assert verify_output(output, "retrying iteration")
+
+    shutil.rmtree("tmp/crash", ignore_errors=True)
+    os.makedirs("tmp/crash")
+    print("===== expecting no errors now, after a worker process is killed and its iterations are retried =====")
+    retcode, output = run("stimela -v -b native exec test_scatter.yml crash_loop")
+    assert retcode == 0
+    assert verify_output(output, "retrying iteration")
+
+def test_timeouts():
+    print("===== expecting an error now, since the step goes quiet =====")
+    retcode, output = run("stimela -v -b native exec test_scatter.yml idle_recipe")
+    assert retcode != 0
+    assert verify_output(output, "sleep has produced no output")
+
+    shutil.rmtree("tmp/timeout", ignore_errors=True)
+    os.makedirs("tmp/timeout")
+    print("===== expecting no errors now, after timeouts and retries =====")
+    retcode, output = run("stimela -v -b native exec test_scatter.yml timeout_loop")
+    assert retcode == 0
+    assert verify_output(output, "sh has exceeded its", "retrying iteration")
+
+def test_dag_schedule():
+    print("===== expecting no errors now =====")
+    retcode, output = run("stimela -v -b native exec test_dag.yml dag_recipe dir=tmp/dag")
+    assert retcode == 0
+    assert verify_output(output, "dispatching step 'make-a'", "dispatching step 'make-b'", "step 'make-b' has completed")
+    for name in "a", "a2", "b", "b2":
+        assert os.path.exists(f"tmp/dag/dag-{name}.txt")
+
+    print("===== expecting no errors now =====")
+    retcode = os.system("stimela -v -b native exec test_dag.yml dag_loop")
+    assert retcode == 0
+
+    print("===== expecting no errors now =====")
+    retcode, output = run("stimela -v -b native exec test_dag.yml dag_scatter")
+    assert retcode == 0
+    # outcomes of the iterations, recorded in the worker processes, make it into the stats
+    stats = OmegaConf.load("test-logs/logs/stimela.stats.full")
+    for label in "loop-a", "loop-b":
+        for count in range(2):
+            assert stats[f"dag_scatter.{label}.({count})"].outcome == "success"
+
+def test_step_cache():
+    shutil.rmtree("tmp/step-cache", ignore_errors=True)
+    os.makedirs("tmp", exist_ok=True)
+    with open("tmp/cache-src.txt", "wt") as f:
+        f.write("hello\n")
+
+    print("===== expecting no errors now =====")
+    retcode, output = run("stimela -v -b native exec test_step_cache.yml cached_recipe src=tmp/cache-src.txt")
+    assert retcode == 0
+    assert verify_output(output, "running cp")
+
+    print("===== expecting the step to be skipped now =====")
+    retcode, output = run("stimela -v -b native exec test_step_cache.yml cached_recipe src=tmp/cache-src.txt")
+    assert retcode == 0
+    assert verify_output(output, "outputs of an identical")
+    assert "running cp" not in output
+
+    print("===== expecting the step to re-run on a changed input =====")
+    with open("tmp/cache-src.txt", "wt") as f:
+        f.write("world\n")
+    retcode, output = run("stimela -v -b native exec test_step_cache.yml cached_recipe src=tmp/cache-src.txt")
+    assert retcode == 0
+    assert verify_output(output, "running cp")
+
+def test_deep_freshness():
+    shutil.rmtree("tmp/fresh-in", ignore_errors=True)
+    os.makedirs("tmp/fresh-in/sub")
+    with open("tmp/fresh-in/sub/a.txt", "wt") as f:
+        f.write("a\n")
+    if os.path.exists("tmp/fresh-stamp.txt"):
+        os.unlink("tmp/fresh-stamp.txt")
+
+    print("===== expecting no errors now =====")
+    retcode, output = run("stimela -v -b native exec test_step_cache.yml fresh_recipe dir=tmp/fresh-in")
+    assert retcode == 0
+    assert verify_output(output, "running touch")
+
+    print("===== expecting the step to be skipped now =====")
+    retcode, output = run("stimela -v -b native exec test_step_cache.yml fresh_recipe dir=tmp/fresh-in")
+    assert retcode == 0
+    assert "running touch" not in output
+
+    print("===== expecting the step to be skipped, since only the top-level directory is checked by default =====")
+    mtime = os.path.getmtime("tmp/fresh-stamp.txt") + 10
+    os.utime("tmp/fresh-in/sub/a.txt", (mtime, mtime))
+    retcode, output = run("stimela -v -b native exec test_step_cache.yml fresh_recipe dir=tmp/fresh-in")
+    assert retcode == 0
+    assert "running touch" not in output
+
+    print("===== expecting the step to re-run, since a file deep inside the input is newer =====")
+    retcode, output = run("stimela -v -s opts.runtime.deep_freshness=true -b native exec test_step_cache.yml "
+                          "fresh_recipe dir=tmp/fresh-in")
+    assert retcode == 0
+    assert verify_output(output, "most recently modified input is", "running touch")
+
+def test_resume():
+    shutil.rmtree("tmp/resume", ignore_errors=True)
+    os.makedirs("tmp/resume")
+    for name in "ok-1", "ok-3":
+        open(f"tmp/resume/{name}", "w").close()
+
+    print("===== expecting an error in iteration 2 now =====")
+    retcode, output = run("stimela -v -b native exec test_resume.yml resume_loop")
+    assert retcode != 0
+    for x in 1, 2, 3:
+        os.unlink(f"tmp/resume/mark-{x}")
+    open("tmp/resume/ok-2", "w").close()
+
+    print("===== expecting only the second half of iteration 2 to run now =====")
+    retcode, output = run("stimela -v -b native exec --resume test_resume.yml resume_loop")
+    assert retcode == 0
+    assert verify_output(output, "2/3 iterations were completed by a", "step 'mark' was completed by a")
+    assert not any(os.path.exists(f"tmp/resume/mark-{x}") for x in (1, 2, 3))
+
+def test_cab_index():
+    print("===== expecting cabs to be listed from the index =====")
+    retcode, output = run("stimela doc test_scatter.yml -l")
+    assert retcode == 0
+    assert verify_output(output, "Cabs:", "fail", "flaky")
+
+    print("===== expecting a cab setting to apply on top of the cab definition =====")
+    retcode, output = run("stimela -b native exec test_scatter.yml fail")
+    assert retcode != 0
+    retcode, output = run("stimela -b native exec -c cabs.fail.command=echo test_scatter.yml fail")
+    assert retcode == 0
+
+def test_recipe_cache():
+    command = "stimela -v -b native exec {} test_aliasing.yml a=1 s3.a=1 s4.a=1 e=e f=f"
+    retcode, output = run(command.format(""))
+    assert retcode == 0
+
+    print("===== expecting the compiled recipe to be reused =====")
+    retcode, output = run(command.format(""))
+    assert retcode == 0
+    assert verify_output(output, "loaded compiled recipe", "DEBUG:   out: 1")
+
+    print("===== expecting the recipe to be reloaded =====")
+    retcode, output = run(command.format("--no-recipe-cache"))
+    assert retcode == 0
+    assert "loaded compiled recipe" not in output
+    assert verify_output(output, "DEBUG:   out: 1")